@@ -1,25 +1,42 @@
-import re
+import os
 import sys
 import select
 import socket
 import argparse
-from typing import Tuple
+import time
+from typing import Dict, Set
 
-from messages import MessageType
+from messages import MessageType, SEQ
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # framing.py is shared by projects
+from framing import pack_frame, unpack_frame
 
 parser = argparse.ArgumentParser(description='Chat Client')
 parser.add_argument('-ip', '--server_ip', help='Destination server ip')
 parser.add_argument('-p', '--server_port', help='Destination server port')
+parser.add_argument('-hb', '--heartbeat', help='Seconds of silence before a heartbeat is sent to the server', default='10')
 
 args = parser.parse_args()
 SERVER_IP = args.server_ip
 SERVER_PORT = args.server_port
+HEARTBEAT = float(args.heartbeat)
+REGREET_INTERVAL = 1.0  # second. REGREETs answering datagrams sent before the last reconnect are ignored
 
 
 class ChatClient:
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, heartbeat: float = 10.0):
+        """
+        :param host: server ip
+        :param port: server port
+        :param heartbeat: seconds of silence before a heartbeat is sent, so the server does not evict this client
+        """
         self._host = host
         self._port = port
+        self._heartbeat = heartbeat
+        self._last_sent = time.monotonic()
+        self._rooms: Set[str] = set()  # rooms joined
+        self._last_seq: Dict[str, int] = {}  # room name('' for messages to everyone) -> last sequence number received
+        self._reconnected_at = float('-inf')  # time.monotonic() of the last reconnect
 
     def init(self):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)  # Create socket for IPv4,UDP Protocol
@@ -35,22 +52,26 @@ class ChatClient:
         :return:
         """
         data, sender = self._sock.recvfrom(2048)  # buffer size 2048 bytes
-        msg_type, content = self._parse_msg(data)
-
-        if msg_type == MessageType.INCOMING:  # chat client socket only receives multicasted messages
-            print(content)
-
-    def _parse_msg(self, msg: bytes) -> Tuple[str, str]:
-        """
-        Parse datagram easy to use.
-        :param msg: byte encoded message from socket
-        :return: message type, message content
-        """
-        match = re.search(r"^\[(\w+)\](\S.*)", msg.decode())
-        if not match:
-            raise ValueError()
-        msg_type, content = match.group(1), match.group(2)
-        return msg_type, content
+        msg_type, sender_id, payload = unpack_frame(data)
+
+        # chat client socket only receives multicasted messages, live or from history
+        if msg_type in (MessageType.INCOMING, MessageType.ROOM_INCOMING):
+            seq, = SEQ.unpack_from(payload)
+            payload = payload[SEQ.size:]
+        if msg_type == MessageType.INCOMING:
+            room = ''
+            print(f"<From {sender_id}>{payload.decode()}")
+        elif msg_type == MessageType.ROOM_INCOMING:
+            room, _, msg = payload.decode().partition(' ')
+            print(f"<From {sender_id} #{room}>{msg}")
+        elif msg_type == MessageType.REGREET:  # this client was evicted, or server restarted
+            if time.monotonic() - self._reconnected_at >= REGREET_INTERVAL:  # several datagrams may be answered
+                print("Server forgot this client. Reconnecting...")
+                self.reconnect()
+            return
+        else:
+            return
+        self._last_seq[room] = max(seq, self._last_seq.get(room, 0))
 
     def _create_message(self, type: MessageType, msg: str) -> bytes:
         """
@@ -59,39 +80,105 @@ class ChatClient:
         :param msg: message content
         :return: formatted binary message data
         """
-        data = f"[{type}]{msg}"
-        byte_msg = data.encode()
-        return byte_msg
+        return pack_frame(type, msg.encode())
+
+    def _send(self, message: bytes):
+        self._sock.sendto(message, (self._host, self._port))
+        self._last_sent = time.monotonic()
 
     def register(self):
         message = self._create_message(MessageType.GREETING, "greeting")
-        self._sock.sendto(message, (self._host, self._port))
+        self._send(message)
+        self.request_history('')
+
+    def reconnect(self):
+        """
+        Greet server and join rooms again(after being evicted or server restart),
+        then ask for every message missed since the last one received
+        """
+        self._reconnected_at = time.monotonic()
+        self.register()
+        for room in self._rooms:
+            self._send(self._create_message(MessageType.JOIN, room))
+            self.request_history(room)
+
+    def request_history(self, room: str):
+        """
+        Ask server for messages of room after the last one received. server streams them like live messages
+        :param room: room name. '' for messages to everyone
+        """
+        self._send(self._create_message(MessageType.HISTORY, f"{self._last_seq.get(room, 0)} {room}"))
+
+    def heartbeat_timeout(self) -> float:
+        """
+        :return: seconds until next heartbeat is due
+        """
+        return max(0.0, self._last_sent + self._heartbeat - time.monotonic())
+
+    def keep_alive(self):
+        """
+        Send heartbeat if nothing was sent for heartbeat seconds
+        """
+        if self.heartbeat_timeout() == 0:
+            self._send(self._create_message(MessageType.HEARTBEAT, "heartbeat"))
+
+    def leave(self):
+        """
+        Tell server this client leaves, so it is removed at once instead of after idle timeout
+        """
+        self._send(self._create_message(MessageType.BYE, "bye"))
 
     def send_msg(self, msg: str):
         """
         Send message to destination server.
-        :param msg: string message data to send.
+        :param msg: string message data to send. commands - /join <room>, /leave <room>, #<room> <message>,
+        /reconnect. /quit is handled by caller
         """
-        message = self._create_message(MessageType.MESSAGE, msg)
-        self._sock.sendto(message, (self._host, self._port))
+        if msg.startswith('/join '):
+            room = msg[len('/join '):].strip()
+            if ' ' in room:  # #<room> <message> ends room name at the first space
+                print(f"Room name [{room}] should not have spaces")
+                return
+            self._rooms.add(room)
+            self._send(self._create_message(MessageType.JOIN, room))
+            self.request_history(room)
+            return
+        elif msg.startswith('/leave '):
+            room = msg[len('/leave '):].strip()
+            self._rooms.discard(room)
+            message = self._create_message(MessageType.LEAVE, room)
+        elif msg == '/reconnect':
+            self.reconnect()
+            return
+        elif msg.startswith('#'):
+            message = self._create_message(MessageType.ROOM_MESSAGE, msg[1:])
+        else:
+            message = self._create_message(MessageType.MESSAGE, msg)
+        self._send(message)
 
 
-client = ChatClient(SERVER_IP, int(SERVER_PORT))
+client = ChatClient(SERVER_IP, int(SERVER_PORT), HEARTBEAT)
 client.init()
 client.register()
 
 client_sock = client.get_socket()
 readers = [client_sock, sys.stdin]  # read socket from server incoming message, user input message
 
-while True:
-    read_sockets, write_sockets, error_sockets = select.select(readers, [], [])
-
-    for sock in read_sockets:
-        # client socket listening INCOMING messages
-        if sock == client_sock:
-            client.recv_msg()
-        # sys.stdin socket listening user input
-        else:
-            msg = input('')
-            sys.stdout.write("\033[F")  # remove input echo (move line cursor one line up)
-            client.send_msg(msg)
+try:
+    while True:
+        read_sockets, write_sockets, error_sockets = select.select(readers, [], [], client.heartbeat_timeout())
+
+        for sock in read_sockets:
+            # client socket listening INCOMING messages
+            if sock == client_sock:
+                client.recv_msg()
+            # sys.stdin socket listening user input
+            else:
+                msg = input('')
+                sys.stdout.write("\033[F")  # remove input echo (move line cursor one line up)
+                if msg == '/quit':
+                    raise EOFError()
+                client.send_msg(msg)
+        client.keep_alive()
+except (EOFError, KeyboardInterrupt):  # /quit, end of input or Ctrl-C
+    client.leave()
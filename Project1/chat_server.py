@@ -1,74 +1,415 @@
 import argparse
-import re
+import heapq
+import os
+import selectors
 import socket
-from typing import Tuple
+import sys
+import time
+from collections import deque
+from typing import Tuple, Dict, Deque, Optional, Set, Iterable, List
 
-from messages import MessageType
+from messages import MessageType, SEQ
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # framing.py is shared by projects
+from framing import NO_SENDER, pack_frame, unpack_frame
+from history import MessageHistory, MessageLog
 
 parser = argparse.ArgumentParser(description='Chat SERVER')
 parser.add_argument('-p', '--port', help='Server listening socket port')
+parser.add_argument('-rb', '--recv_batch', help='Datagrams received per loop turn at most', default='64')
+parser.add_argument('-sb', '--send_batch', help='Queued datagrams sent per loop turn at most', default='256')
+parser.add_argument('-q', '--queue_limit', help='Datagrams queued per recipient at most. oldest one is dropped over it', default='1024')
+parser.add_argument('-i', '--idle_timeout', help='Seconds a client may stay silent before it is evicted. 0 to never evict', default='30')
+parser.add_argument('-hn', '--history_limit', help='Recent messages kept in memory per room', default='256')
+parser.add_argument('-hl', '--history_log', help='Directory of append-only message logs. history is kept in memory only if not given', default=None)
+parser.add_argument('-cb', '--catch_up_batch', help='History messages queued per catching up client per loop turn at most', default='64')
 
 args = parser.parse_args()
 PORT = args.port
+RECV_BATCH = int(args.recv_batch)
+SEND_BATCH = int(args.send_batch)
+QUEUE_LIMIT = int(args.queue_limit)
+IDLE_TIMEOUT = float(args.idle_timeout)
+HISTORY_LIMIT = int(args.history_limit)
+HISTORY_LOG = args.history_log
+CATCH_UP_BATCH = int(args.catch_up_batch)
+
+Address = Tuple[str, int]
+ROOM_NAME_LIMIT = 64  # room name bytes at most, looked up in ROOM_MESSAGE payload
+LOBBY = ''  # history key of messages to every greeted client. room name is never empty
+
 
 class ChatServer:
-    def __init__(self, port: int):
+    """
+    Selector driven chat server. Receiving and fan-out are decoupled:
+    broadcast only queues the once-encoded message for every recipient, and each loop turn receives
+    at most recv_batch datagrams and sends at most send_batch queued ones(round robin over recipients).
+    So a broadcast to thousands of clients drains over many turns while new datagrams keep being received.
+    Rooms are indexed both ways(room -> members, member -> rooms), so a room message costs O(room size)
+    and leaving every room costs O(rooms of the member).
+    Any datagram from a greeted client refreshes its last seen time, and clients silent for idle_timeout are evicted
+    from clients, rooms and send queues. Datagrams from a client not greeted(or evicted) are dropped and answered
+    with REGREET, so nothing untracked is ever kept and the client greets and joins its rooms again. Expiry times are kept in a heap with one entry per client,
+    which is pushed back with the new expiry when the client was seen since, so eviction check costs O(log n)
+    per expired entry, not per datagram.
+    Datagrams are binary frames(framing.py). Message payload is never decoded - relayed frame is the same payload
+    behind a new header with the sender id the server gave to the sender on greeting.
+    Relayed frames are numbered per room and kept in a history ring(and log), so a client asking for frames
+    since sequence number N gets them again as they were sent. Catch-up is streamed catch_up_batch frames per turn,
+    never more than its send queue has room for, so a long history neither floods the queue nor stalls live messages.
+    """
+
+    def __init__(self, port: int, recv_batch: int = 64, send_batch: int = 256, queue_limit: int = 1024,
+                 idle_timeout: float = 30.0, history_limit: int = 256, history_log: Optional[str] = None,
+                 catch_up_batch: int = 64):
+        """
+        :param port: listening port
+        :param recv_batch: datagrams received per loop turn at most
+        :param send_batch: queued datagrams sent per loop turn at most
+        :param queue_limit: datagrams queued per recipient at most. the oldest one is dropped over it
+        :param idle_timeout: seconds a client may stay silent before it is evicted. 0 to never evict
+        :param history_limit: recent frames kept in memory per room
+        :param history_log: directory of append-only logs of every room. history is kept in memory only if None
+        :param catch_up_batch: history frames queued per catching up client per loop turn at most
+        """
         self._port = port
         self._clients = set()  # greeted sender address list
+        self._sender_ids: Dict[Address, int] = {}  # greeted sender -> id written in frames relayed from it
+        self._next_sender_id = NO_SENDER + 1
+        self._rooms: Dict[str, Set[Address]] = {}  # room name -> members. empty room is removed
+        self._memberships: Dict[Address, Set[str]] = {}  # member -> names of rooms it joined
+        self._idle_timeout = idle_timeout
+        self._last_seen: Dict[Address, float] = {}  # greeted client -> time its last datagram was received
+        self._expiry: List[Tuple[float, Address]] = []  # heap of (expiry, client)
+        self._scheduled: Set[Address] = set()  # clients having an entry in expiry heap. at most one entry per client
+        self._recv_batch = recv_batch
+        self._send_batch = send_batch
+        self._queue_limit = queue_limit
+        self._queues: Dict[Address, Deque[bytes]] = {}  # recipient -> datagrams not sent yet
+        self._ready: Deque[Address] = deque()  # recipients with queued datagrams, in sending turn order
+        self._selector = selectors.DefaultSelector()
+        self._writing = False  # waiting for socket to be writable, kernel send buffer was full
+        self._history_limit = history_limit
+        self._history_log = history_log
+        self._catch_up_batch = catch_up_batch
+        self._histories: Dict[str, MessageHistory] = {}  # room name(or LOBBY) -> recent frames relayed to it
+        # removed room name -> next sequence number of its history, without log. log keeps it otherwise
+        self._next_seqs: Dict[str, int] = {}
+        self._unflushed: Set[str] = set()  # rooms with log written this turn
+        # (client, room) -> (last sequence number sent, sequence number to stop before)
+        self._catch_ups: Dict[Tuple[Address, str], Tuple[int, int]] = {}
+        self.dropped = 0  # queued datagrams dropped over queue_limit
+        self.evicted = 0  # clients evicted for being idle
 
     def init(self):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) # Create socket for IPv4,UDP Protocol
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # allow multiple socket on one port
         self._sock.bind(('0.0.0.0', self._port))  # listen from any ip address, but specific port
+        self._sock.setblocking(False)  # selector tells when to read or write
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        if self._history_log:
+            os.makedirs(self._history_log, exist_ok=True)
         print("Server Initialized...")
         print(f"CREATE CHATROOM listening [port {self._port}]")
 
-    def recv_msg(self):
-        data, sender = self._sock.recvfrom(2048)  # buffer size 2048 bytes
-        msg_type, content = self._parse_msg(data)
+    def serve_forever(self):
+        while True:
+            self.poll()
 
-        if msg_type == MessageType.MESSAGE:
-            self._broadcast(sender, content)
-        elif msg_type == MessageType.GREETING:
+    def poll(self, timeout: Optional[float] = None):
+        """
+        One loop turn - wait until socket is readable(or writable while datagrams are queued),
+        then receive a batch of datagrams and send a batch of queued ones
+        :param timeout: maximum waiting time(second). None to wait forever
+        """
+        if (self._ready or self._catch_ups) and not self._writing:
+            timeout = 0  # queued datagrams and history being streamed are sent without waiting
+        elif self._expiry:
+            until_expiry = max(0.0, self._expiry[0][0] - time.monotonic())
+            timeout = until_expiry if timeout is None else min(timeout, until_expiry)
+        self._selector.select(timeout)
+        self._recv_batch_msgs()
+        self._evict_idle()
+        self._stream_catch_ups()
+        self._flush()
+        self._flush_logs()
+
+    def _recv_batch_msgs(self):
+        for _ in range(self._recv_batch):
+            try:
+                data, sender = self._sock.recvfrom(2048)  # buffer size 2048 bytes
+            except BlockingIOError:
+                return
+            self._handle_msg(data, sender)
+
+    def _handle_msg(self, data: bytes, sender: Address):
+        try:
+            msg_type, _, payload = unpack_frame(data)
+            if msg_type == MessageType.ROOM_MESSAGE:
+                room = self._parse_room(payload)
+            elif msg_type in (MessageType.JOIN, MessageType.LEAVE):
+                if not payload or len(payload) > ROOM_NAME_LIMIT or b' ' in payload:  # ROOM_MESSAGE ends name at space
+                    raise ValueError()
+                room = payload.decode()
+            elif msg_type == MessageType.HISTORY:
+                seq, _, room = payload.decode().partition(' ')
+                seq = int(seq)
+        except (ValueError, UnicodeDecodeError):  # one broken datagram should not stop every room
+            return
+
+        if msg_type == MessageType.GREETING:
             self._add_greeted_client(sender)
+            return
+        if sender not in self._last_seen:  # never greeted, or evicted. only a greeted client is tracked and evicted
+            if msg_type != MessageType.BYE:
+                self._enqueue(sender, pack_frame(MessageType.REGREET, b''))
+            return
+        self._last_seen[sender] = time.monotonic()
+        if msg_type == MessageType.MESSAGE:
+            self._broadcast(sender, payload)
+        elif msg_type == MessageType.ROOM_MESSAGE:
+            self._broadcast_room(sender, room, payload)
+        elif msg_type == MessageType.JOIN:
+            self._join(sender, room)
+        elif msg_type == MessageType.LEAVE:
+            self._leave(sender, room)
+        elif msg_type == MessageType.HEARTBEAT:
+            pass  # last seen time is already refreshed
+        elif msg_type == MessageType.BYE:
+            self._remove_client(sender)
+        elif msg_type == MessageType.HISTORY:
+            self._request_history(sender, room, seq)
         else:
             pass  # do not handle exception case
 
-    def _parse_msg(self, msg: bytes) -> Tuple[str, str]:
+    def _parse_room(self, payload: bytes) -> str:
         """
-        Parse datagram easy to use.
-        :param msg: byte encoded message from socket
-        :return: message type, message content
+        :param payload: ROOM_MESSAGE payload - room name, space, message
+        :return: room name. only the name is decoded
         """
-        match = re.search(r"^\[(\w+)\](\S.*)", msg.decode())
-        if not match:
+        room, space, _ = payload[:ROOM_NAME_LIMIT + 1].partition(b' ')
+        if not room or not space:
             raise ValueError()
-        msg_type, content = match.group(1), match.group(2)
-        return msg_type, content
+        return room.decode()
 
-    def _add_greeted_client(self, sender: Tuple[str, int]):
+    def _add_greeted_client(self, sender: Address):
+        now = time.monotonic()
+        if sender not in self._last_seen:
+            self._sender_ids[sender] = self._next_sender_id
+            self._next_sender_id += 1
+            if self._idle_timeout > 0 and sender not in self._scheduled:
+                self._scheduled.add(sender)
+                heapq.heappush(self._expiry, (now + self._idle_timeout, sender))
+        self._last_seen[sender] = now
         self._clients.add(sender)
 
-    def _create_broadcast_message(self, sender: Tuple[str, int], msg: str):
+    def _evict_idle(self):
+        """
+        Evict clients silent for idle_timeout. entry of a client seen since it was pushed is pushed back
+        with its new expiry, and entry of a removed client is just dropped.
+        """
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, client = self._expiry[0]
+            last_seen = self._last_seen.get(client)
+            if last_seen is not None and last_seen + self._idle_timeout > now:
+                heapq.heapreplace(self._expiry, (last_seen + self._idle_timeout, client))
+                continue
+            heapq.heappop(self._expiry)
+            self._scheduled.discard(client)
+            if last_seen is not None:
+                self._remove_client(client)
+                self.evicted += 1
+
+    def _remove_client(self, client: Address):
+        """
+        Forget client - it gets no more broadcast, leaves every room, and its queued datagrams are dropped.
+        its heap entry is dropped lazily by _evict_idle, and its turn in ready queue by _flush
+        """
+        self._clients.discard(client)
+        self._last_seen.pop(client, None)
+        self._sender_ids.pop(client, None)
+        self._leave_all(client)
+        self._queues.pop(client, None)
+
+    def _join(self, member: Address, room: str):
+        self._rooms.setdefault(room, set()).add(member)
+        self._memberships.setdefault(member, set()).add(room)
+
+    def _leave(self, member: Address, room: str):
+        members = self._rooms.get(room)
+        if not members or member not in members:
+            return
+        members.discard(member)
+        if not members:
+            self._remove_room(room)
+        rooms = self._memberships[member]
+        rooms.discard(room)
+        if not rooms:
+            del self._memberships[member]
+
+    def _leave_all(self, member: Address):
+        for room in self._memberships.pop(member, ()):
+            members = self._rooms[room]
+            members.discard(member)
+            if not members:
+                self._remove_room(room)
+
+    def _remove_room(self, room: str):
+        """
+        Forget empty room and its history. history in log is loaded again when the room is used again.
+        without log only its next sequence number is kept, so numbering goes on instead of restarting from 1
+        """
+        del self._rooms[room]
+        history = self._histories.pop(room, None)
+        if history:
+            history.close()
+            if not self._history_log:
+                self._next_seqs[room] = history.next_seq
+        self._unflushed.discard(room)
+
+    def _history(self, room: str) -> MessageHistory:
+        """
+        :param room: room name or LOBBY
+        :return: history of room. created(and filled from log if any) on first use
+        """
+        history = self._histories.get(room)
+        if history is None:
+            log = None
+            if self._history_log:
+                log = MessageLog(os.path.join(self._history_log, f"room-{room.encode().hex()}.log"))
+            history = self._histories[room] = MessageHistory(self._history_limit, log, self._next_seqs.pop(room, 1))
+        return history
+
+    def _request_history(self, client: Address, room: str, seq: int):
+        """
+        Start streaming frames of room after seq to client. only frames relayed before this request are streamed,
+        later ones reach the client as live messages
+        :param client: greeted client. member of room unless room is LOBBY
+        :param room: room name or LOBBY
+        :param seq: last sequence number the client has. 0 for everything kept
+        """
+        if not self._may_read(client, room):
+            return
+        self._catch_ups[client, room] = (seq, self._history(room).next_seq)
+
+    def _may_read(self, client: Address, room: str) -> bool:
+        if room == LOBBY:
+            return client in self._clients
+        return client in self._rooms.get(room, ())
+
+    def _stream_catch_ups(self):
+        """
+        Queue next batch of history frames for every catching up client, as many as its send queue has room for
+        """
+        for key, (seq, until) in list(self._catch_ups.items()):
+            client, room = key
+            if not self._may_read(client, room):  # client left the room or was removed
+                del self._catch_ups[key]
+                continue
+            space = self._queue_limit - len(self._queues.get(client, ()))
+            if space <= 0:
+                continue
+            seq, frames = self._history(room).since(seq, until, min(self._catch_up_batch, space))
+            for frame in frames:
+                self._enqueue(client, frame)
+            if frames and seq < until - 1:
+                self._catch_ups[key] = (seq, until)
+            else:
+                del self._catch_ups[key]
+
+    def _flush_logs(self):
+        for room in self._unflushed:
+            self._histories[room].flush()
+        self._unflushed.clear()
+
+    def _relay_frame(self, sender: Address, msg_type: MessageType, payload: bytes, room: str) -> bytes:
         """
-        Make formatted broadcast message.
         :param sender: UDP message sender address. Including IP, port.
-        :param msg: message content
-        :return: formatted binary message data
+        :param msg_type: message type of relayed frame
+        :param payload: payload of received frame, relayed untouched
+        :param room: room name or LOBBY. frame is numbered(sequence number in front of payload) and kept in its history
+        :return: datagram built once, shared by every recipient and the history
         """
-        ip, port = sender
-        data = f"[{MessageType.INCOMING}]<From {ip}:{port}>{msg}"
-        byte_msg = data.encode()
+        history = self._history(room)
+        byte_msg = pack_frame(msg_type, SEQ.pack(history.next_seq) + payload, self._sender_ids.get(sender, NO_SENDER))
+        history.append(byte_msg)
+        if self._history_log:
+            self._unflushed.add(room)
         return byte_msg
 
-    def _broadcast(self, sender: Tuple[str, int], msg: str):
-        byte_msg = self._create_broadcast_message(sender, msg)
-        for client_addr in self._clients:
-            self._sock.sendto(byte_msg, client_addr)
+    def _broadcast(self, sender: Address, payload: bytes):
+        self._fan_out(self._relay_frame(sender, MessageType.INCOMING, payload, LOBBY), self._clients)
 
+    def _broadcast_room(self, sender: Address, room: str, payload: bytes):
+        """
+        Send message to members of room. only members can send to it
+        """
+        members = self._rooms.get(room)
+        if not members or sender not in members:
+            return
+        self._fan_out(self._relay_frame(sender, MessageType.ROOM_INCOMING, payload, room), members)
 
-server = ChatServer(int(PORT))
-server.init()
+    def _fan_out(self, byte_msg: bytes, recipients: Iterable[Address]):
+        """
+        :param byte_msg: datagram encoded once, shared by every queue
+        :param recipients: destination addresses
+        """
+        for client_addr in recipients:
+            self._enqueue(client_addr, byte_msg)
 
-while True:
-    server.recv_msg()
+    def _enqueue(self, recipient: Address, byte_msg: bytes):
+        """
+        Queue datagram to send in a later batch
+        :param recipient: destination address
+        :param byte_msg: datagram
+        """
+        queue = self._queues.get(recipient)
+        if queue is None:
+            queue = self._queues[recipient] = deque()
+        if not queue:
+            self._ready.append(recipient)
+        elif len(queue) >= self._queue_limit:
+            queue.popleft()
+            self.dropped += 1
+        queue.append(byte_msg)
+
+    def _flush(self):
+        """
+        Send at most send_batch queued datagrams, one per recipient in turn, so every recipient gets its messages
+        at the same pace. Stop when kernel send buffer is full, and wait for the socket to be writable.
+        """
+        for _ in range(self._send_batch):
+            if not self._ready:
+                break
+            recipient = self._ready[0]
+            queue = self._queues.get(recipient)
+            if not queue:  # recipient was removed
+                self._ready.popleft()
+                continue
+            try:
+                self._sock.sendto(queue[0], recipient)
+            except BlockingIOError:
+                self._set_writing(True)
+                return
+            queue.popleft()
+            self._ready.popleft()
+            if queue:
+                self._ready.append(recipient)
+            else:
+                del self._queues[recipient]
+        self._set_writing(False)
+
+    def _set_writing(self, writing: bool):
+        """
+        :param writing: also wait for the socket to be writable(True), or only readable(False)
+        """
+        if writing != self._writing:
+            self._writing = writing
+            self._selector.modify(self._sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0))
+
+
+server = ChatServer(int(PORT), RECV_BATCH, SEND_BATCH, QUEUE_LIMIT, IDLE_TIMEOUT, HISTORY_LIMIT, HISTORY_LOG,
+                    CATCH_UP_BATCH)
+server.init()
+server.serve_forever()
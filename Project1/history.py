@@ -0,0 +1,139 @@
+import os
+from collections import deque
+from itertools import islice
+from struct import Struct
+from typing import Deque, List, Optional, Tuple
+
+from framing import frame_size
+
+OFFSET = Struct('!Q')  # index entry - offset of a frame in the log file
+
+
+class MessageLog:
+    """
+    Append-only file of frames written back to back, with an index file of fixed size offsets,
+    so the frame of any sequence number is found with one seek instead of scanning the log.
+    Frames carry their own length, so the log needs no record header.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path of log file. index is written next to it with .idx suffix
+        """
+        self._log = open(path, 'ab+')
+        self._index = open(path + '.idx', 'ab+')
+        self._log.seek(0, os.SEEK_END)
+        self._index.seek(0, os.SEEK_END)
+        self._size = self._log.tell()
+        self.count = self._index.tell() // OFFSET.size  # frames in the log. sequence numbers are 1..count
+
+    def append(self, frame: bytes):
+        self._index.write(OFFSET.pack(self._size))
+        self._log.write(frame)
+        self._size += len(frame)
+        self.count += 1
+
+    def read(self, first_seq: int, limit: int) -> List[bytes]:
+        """
+        :param first_seq: sequence number of the first frame to read
+        :param limit: frames read at most
+        :return: frames from first_seq on, in order
+        """
+        first_seq = max(first_seq, 1)
+        last_seq = min(first_seq + limit - 1, self.count)
+        if last_seq < first_seq:
+            return []
+        self.flush()
+        self._index.seek((first_seq - 1) * OFFSET.size)
+        start, = OFFSET.unpack(self._index.read(OFFSET.size))
+        if last_seq < self.count:
+            self._index.seek(last_seq * OFFSET.size)
+            end, = OFFSET.unpack(self._index.read(OFFSET.size))
+        else:
+            end = self._size
+        self._log.seek(start)
+        data = self._log.read(end - start)
+        frames = []
+        offset = 0
+        while offset < len(data):
+            size = frame_size(data, offset)
+            frames.append(data[offset:offset + size])
+            offset += size
+        return frames
+
+    def flush(self):
+        self._log.flush()
+        self._index.flush()
+
+    def close(self):
+        self._log.close()
+        self._index.close()
+
+
+class MessageHistory:
+    """
+    Recent frames of one room, numbered from 1 in the order they were relayed.
+    Frames are kept as the bytes sent to the members, so catch-up sends them again without encoding anything.
+    The ring keeps the last `limit` frames. Older ones are read from the log if there is one, otherwise they are gone.
+    """
+
+    def __init__(self, limit: int, log: Optional[MessageLog] = None, next_seq: int = 1):
+        """
+        :param limit: frames kept in memory at most
+        :param log: log holding every frame of the room. ring is refilled from its tail, so history survives restart
+        :param next_seq: sequence number of the first frame, without log. frames before it are gone.
+        a room used again goes on from where it stopped, so sequence numbers clients have stay valid
+        """
+        self._log = log
+        self._ring: Deque[bytes] = deque(maxlen=limit)
+        self.next_seq = next_seq
+        if log:
+            self._ring.extend(log.read(log.count - limit + 1, limit))
+            self.next_seq = log.count + 1
+
+    @property
+    def first_seq(self) -> int:
+        """
+        :return: sequence number of the oldest frame in memory
+        """
+        return self.next_seq - len(self._ring)
+
+    def append(self, frame: bytes):
+        """
+        :param frame: frame carrying next_seq as its sequence number
+        """
+        self._ring.append(frame)
+        if self._log:
+            self._log.append(frame)
+        self.next_seq += 1
+
+    def since(self, seq: int, until: int, limit: int) -> Tuple[int, List[bytes]]:
+        """
+        :param seq: last sequence number the client has. frames after it are returned.
+        seq not below next_seq is from a history before server restart(without log), so every kept frame is returned
+        :param until: sequence number to stop before
+        :param limit: frames returned at most
+        :return: sequence number of the last returned frame(seq if none), frames after seq oldest first.
+        starts from the oldest kept frame if frames right after seq are gone
+        """
+        if seq >= self.next_seq:
+            seq = 0
+        first = seq + 1
+        if first < self.first_seq and not self._log:  # log holds every frame from 1
+            first = self.first_seq
+        last = min(until, self.next_seq, first + limit) - 1  # inclusive
+        if last < first:
+            return seq, []
+        if first < self.first_seq:
+            frames = self._log.read(first, last - first + 1)
+        else:
+            frames = list(islice(self._ring, first - self.first_seq, last - self.first_seq + 1))
+        return last, frames
+
+    def flush(self):
+        if self._log:
+            self._log.flush()
+
+    def close(self):
+        if self._log:
+            self._log.close()
@@ -1,8 +1,19 @@
-from enum import Enum
+from enum import IntEnum
+from struct import Struct
 
+# sequence number in front of INCOMING / ROOM_INCOMING payload. relayed frames are numbered per room from 1
+SEQ = Struct('!I')
 
-class MessageType(str, Enum):
-    GREETING = 'GREETING'
-    MESSAGE = 'MESSAGE'
-    INCOMING = 'INCOMING'
 
+class MessageType(IntEnum):
+    GREETING = 0
+    MESSAGE = 1
+    INCOMING = 2  # MESSAGE relayed by server, content behind sequence number. sender id in frame header
+    JOIN = 3  # content: room name, no spaces
+    LEAVE = 4  # content: room name
+    ROOM_MESSAGE = 5  # content: room name, space, message. delivered to members of the room only
+    ROOM_INCOMING = 6  # ROOM_MESSAGE relayed by server, content untouched behind sequence number. sender id in header
+    HEARTBEAT = 7  # content: any. keeps the sender alive on the server while it has nothing to say
+    BYE = 8  # content: any. sender leaves the server and every room
+    HISTORY = 9  # content: last sequence number the sender has, space, room name(empty for every greeted client)
+    REGREET = 10  # content: empty. server does not know the sender(not greeted, evicted or restarted), greet again
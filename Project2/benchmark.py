@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from impairment import ImpairmentConfig
+from messages import ChecksumType, CompressionType
+from rdt_socket import RDTSocket, SEGMENT_SIZE
+from utility import Address
+
+PROFILES = {
+    'clean': '',
+    'loss1': 'loss=0.01',
+    'delay5ms': 'delay=0.005,jitter=0.001',
+    'lossy_delay': 'loss=0.02,delay=0.005,jitter=0.001,reorder=0.01',
+}
+
+parser = argparse.ArgumentParser(description='RDT throughput/latency benchmark over loopback')
+parser.add_argument('-s', '--sizes', help='Comma separated file sizes(bytes)', default='100000,1000000')
+parser.add_argument('-ws', '--window_sizes', help='Comma separated window sizes', default='8,32')
+parser.add_argument('-pr', '--profiles', help=f'Comma separated impairment profiles. one of {list(PROFILES)}',
+                    default=','.join(PROFILES))
+parser.add_argument('-r', '--repeat', help='Transfers per matrix cell', type=int, default=5)
+parser.add_argument('-m', '--mode', help='Sender mode. gbn or sr', default='sr')
+parser.add_argument('-cc', '--congestion', help='Congestion control. fixed or aimd', default='fixed')
+parser.add_argument('-ae', '--ack_every', help='Receiver delayed ACK - one ACK per N in order packets', type=int, default=1)
+parser.add_argument('-cs', '--checksum', help='Checksum algorithm. none, crc32 or crc32c', default='crc32')
+parser.add_argument('-z', '--compression', help='Compression. none, zlib, lz4 or zstd', default='none')
+parser.add_argument('-zl', '--compression_level', help='Compression level. default of the algorithm if not given',
+                    type=int, default=None)
+parser.add_argument('-d', '--data', help='Transferred data. random(incompressible) or text(alice.txt repeated)',
+                    default='random')
+parser.add_argument('-ss', '--segment_size', help='Largest datagram of both sides', type=int, default=SEGMENT_SIZE)
+parser.add_argument('-pm', '--probe_mtu', help='Sender probes path MTU up to segment size', action='store_true')
+parser.add_argument('--subprocess', help='Run sender.py/receiver.py as separate processes', action='store_true')
+parser.add_argument('-o', '--output', help='File path to write JSON report. stdout if not given', default=None)
+parser.add_argument('--cell', help=argparse.SUPPRESS, default=None)  # internal. run one transfer, print JSON
+
+args = parser.parse_args()
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class DigestSink:
+    """
+    Write-only file object that keeps only sha256 of written data, so receiving does not grow memory
+    """
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.hash.update(data)
+        return len(data)
+
+
+def make_data(size: int) -> bytes:
+    """
+    :return: data of size bytes, kind chosen by --data
+    """
+    if args.data == 'text':
+        with open(os.path.join(HERE, 'alice.txt'), 'rb') as f:
+            text = f.read()
+        return (text * (size // len(text) + 1))[:size]
+    return os.urandom(size)
+
+
+def impairment_pair(profile: str):
+    """
+    :return: impairment of receiver(data path) and sender(ACK path). different seeds, so paths are independent
+    """
+    spec = PROFILES[profile]
+    if not spec:
+        return None, None
+    return ImpairmentConfig.parse(spec + ',seed=1'), ImpairmentConfig.parse(spec + ',seed=2')
+
+
+def run_in_process(size: int, window_size: int, profile: str, mode: str, congestion: str) -> Dict:
+    """
+    Run one transfer with sender and receiver in this process(two threads)
+    """
+    data = make_data(size)
+    receiver_impairment, sender_impairment = impairment_pair(profile)
+    receiver = RDTSocket(window_size, impairment=receiver_impairment, ack_every=args.ack_every,
+                         segment_size=args.segment_size)
+    receiver.bind(('127.0.0.1', 0))
+    sink = DigestSink()
+
+    def receive():
+        receiver.sender_addr = receiver.accept()
+        receiver.recv_into(sink)
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    sender = RDTSocket(window_size, mode=mode, congestion=congestion, impairment=sender_impairment,
+                        checksum=ChecksumType[args.checksum.upper()],
+                        compression=CompressionType[args.compression.upper()],
+                        compression_level=args.compression_level, segment_size=args.segment_size,
+                        probe_mtu=args.probe_mtu)
+    sender.bind(('127.0.0.1', 0))
+    start = time.perf_counter()
+    sender.connect(Address('127.0.0.1', receiver.getsockname()[1]))
+    sender.send(data)
+    sender.close()
+    seconds = time.perf_counter() - start
+    thread.join()
+
+    sender_stats = sender.stats.snapshot()
+    return {
+        'seconds': seconds,
+        'ok': sink.hash.digest() == hashlib.sha256(data).digest(),
+        'packets_sent': sender_stats['packets_sent'],
+        'packets_retransmitted': sender_stats['packets_retransmitted'],
+        'acks_sent': receiver.stats.acks_sent,
+        'payload_bytes': sender_stats['payload_bytes'],
+        'encoded_bytes': sender_stats['encoded_bytes'],
+        'compress_seconds': sender_stats['compress_seconds'],
+    }
+
+
+def wait_with_rusage(process: subprocess.Popen) -> int:
+    """
+    :return: peak RSS(KB on linux) of finished child process
+    """
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return rusage.ru_maxrss
+
+
+def run_cell_in_worker(size: int, window_size: int, profile: str) -> Dict:
+    """
+    Run one in-process transfer in a fresh worker process, so peak RSS belongs to this transfer only
+    """
+    cell = json.dumps({'size': size, 'window_size': window_size, 'profile': profile})
+    command = [sys.executable, __file__, '--cell', cell, '-m', args.mode, '-cc', args.congestion,
+               '-ae', str(args.ack_every), '-cs', args.checksum, '-z', args.compression, '-d', args.data,
+               '-ss', str(args.segment_size)] + (['-pm'] if args.probe_mtu else [])
+    if args.compression_level is not None:
+        command += ['-zl', str(args.compression_level)]
+    worker = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=HERE)
+    output = worker.stdout.read()
+    result = json.loads(output)
+    result['peak_rss_kb'] = wait_with_rusage(worker)
+    return result
+
+
+def run_subprocesses(size: int, window_size: int, profile: str) -> Dict:
+    """
+    Run one transfer with receiver.py and sender.py as separate processes
+    """
+    receiver_impairment, sender_impairment = impairment_pair(profile)
+    with tempfile.TemporaryDirectory() as directory:
+        source, target = os.path.join(directory, 'source.bin'), os.path.join(directory, 'target.bin')
+        with open(source, 'wb') as f:
+            f.write(make_data(size))
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:  # find free port
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+
+        receiver_command = [sys.executable, 'receiver.py', '-p', str(port), '-ws', str(window_size), '-f', target,
+                            '-ae', str(args.ack_every), '-ss', str(args.segment_size)]
+        sender_command = [sys.executable, 'sender.py', '-ip', '127.0.0.1', '-p', str(port), '-sp', '0',
+                          '-ws', str(window_size), '-m', args.mode, '-cc', args.congestion, '-f', source,
+                          '-cs', args.checksum, '-z', args.compression, '-ss', str(args.segment_size)]
+        if args.probe_mtu:
+            sender_command.append('-pm')
+        if args.compression_level is not None:
+            sender_command += ['-zl', str(args.compression_level)]
+        if receiver_impairment:
+            receiver_command += ['-imp', PROFILES[profile] + ',seed=1']
+            sender_command += ['-imp', PROFILES[profile] + ',seed=2']
+
+        receiver = subprocess.Popen(receiver_command, stdout=subprocess.DEVNULL, cwd=HERE)
+        time.sleep(0.2)  # wait receiver to bind
+        start = time.perf_counter()
+        sender = subprocess.Popen(sender_command, stdout=subprocess.DEVNULL, cwd=HERE)
+        sender_rss = wait_with_rusage(sender)
+        seconds = time.perf_counter() - start
+        receiver_rss = wait_with_rusage(receiver)
+
+        with open(source, 'rb') as f, open(target, 'rb') as g:
+            ok = hashlib.sha256(f.read()).digest() == hashlib.sha256(g.read()).digest()
+
+    # process start up is included in seconds. retransmissions are not visible from outside the sender
+    return {'seconds': seconds, 'ok': ok, 'packets_sent': None, 'packets_retransmitted': None, 'acks_sent': None,
+            'payload_bytes': None, 'encoded_bytes': None, 'compress_seconds': None,
+            'peak_rss_kb': max(sender_rss, receiver_rss)}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    nearest rank percentile
+    """
+    ordered = sorted(values)
+    rank = max(int(-(-percent * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(size: int, window_size: int, profile: str, runs: List[Dict]) -> Dict:
+    seconds = [run['seconds'] for run in runs]
+    sent = [run['packets_sent'] for run in runs if run['packets_sent'] is not None]
+    retransmitted = [run['packets_retransmitted'] for run in runs if run['packets_retransmitted'] is not None]
+    retransmission_ratio: Optional[float] = sum(retransmitted) / sum(sent) if sent and sum(sent) else None
+    acks = [run['acks_sent'] for run in runs if run['acks_sent'] is not None]
+    ack_ratio: Optional[float] = sum(acks) / sum(sent) if acks and sent and sum(sent) else None  # reverse path packets
+    payload = sum(run['payload_bytes'] or 0 for run in runs)
+    # payload bytes on the wire per application byte, and sender time spent compressing. compressed transfers only
+    compression_ratio = sum(run['encoded_bytes'] or 0 for run in runs) / payload if payload else None
+    compress_seconds = [run['compress_seconds'] for run in runs if run['compress_seconds'] is not None]
+    return {
+        'size': size,
+        'window_size': window_size,
+        'profile': profile,
+        'runs': len(runs),
+        'failures': sum(not run['ok'] for run in runs),
+        'goodput_mbps': size * 8 / percentile(seconds, 50) / 1e6,
+        'transfer_seconds_p50': percentile(seconds, 50),
+        'transfer_seconds_p99': percentile(seconds, 99),
+        'retransmission_ratio': retransmission_ratio,
+        'ack_ratio': ack_ratio,
+        'packets_sent': sum(sent) / len(sent) if sent else None,
+        'compression_ratio': compression_ratio,
+        'compress_seconds_p50': percentile(compress_seconds, 50) if compress_seconds else None,
+        'peak_rss_kb': max(run['peak_rss_kb'] for run in runs),
+    }
+
+
+if args.cell:
+    cell = json.loads(args.cell)
+    result = run_in_process(cell['size'], cell['window_size'], cell['profile'], args.mode, args.congestion)
+    sys.stdout.write(json.dumps(result))
+    sys.exit(0)
+
+sizes = [int(size) for size in args.sizes.split(',')]
+window_sizes = [int(window_size) for window_size in args.window_sizes.split(',')]
+profiles = args.profiles.split(',')
+run = run_subprocesses if args.subprocess else run_cell_in_worker
+
+results = []
+for size, window_size, profile in itertools.product(sizes, window_sizes, profiles):
+    runs = [run(size, window_size, profile) for _ in range(args.repeat)]
+    results.append(summarize(size, window_size, profile, runs))
+    print(f'size [{size}] window [{window_size}] profile [{profile}] - '
+          f'{results[-1]["goodput_mbps"]:.2f} Mbps', file=sys.stderr)
+
+report = {
+    'mode': args.mode,
+    'congestion': args.congestion,
+    'ack_every': args.ack_every,
+    'checksum': args.checksum,
+    'compression': args.compression,
+    'compression_level': args.compression_level,
+    'data': args.data,
+    'segment_size': args.segment_size,
+    'probe_mtu': args.probe_mtu,
+    'subprocess': args.subprocess,
+    'python': sys.version.split()[0],
+    'results': results,
+}
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+else:
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,105 @@
+import fcntl
+import os
+import struct
+from contextlib import contextmanager
+from typing import List, Tuple, Iterator
+
+FILE_SIZE_STRUCT = struct.Struct('Q')  # size of the whole file the extents belong to
+EXTENT_STRUCT = struct.Struct('2Q')  # start, end(exclusive) byte offset
+
+Extent = Tuple[int, int]
+
+
+def merge_extents(extents: List[Extent]) -> List[Extent]:
+    """
+    :param extents: (start, end) ranges, overlapping or adjacent ones allowed
+    :return: sorted, disjoint ranges covering the same bytes
+    """
+    merged: List[Extent] = []
+    for start, end in sorted(extents):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        elif start < end:
+            merged.append((start, end))
+    return merged
+
+
+class ExtentFile:
+    """
+    On-disk checkpoint of byte ranges of an output file that are received and written, kept next to the output as
+    <output>.extents. Receiver of a resumable transfer answers the end of the range it already has, so restarted
+    transfer sends only missing bytes. Removed when the whole file is received.
+    Stripes of one file update the same extent file from different processes, so every read-modify-write holds
+    flock of the output file, and new content replaces the old one atomically(os.replace).
+    """
+
+    def __init__(self, output_path: str, file_size: int):
+        """
+        :param output_path: file being received
+        :param file_size: size of the whole file. extents saved for a different size are ignored
+        """
+        self.path = output_path + '.extents'
+        self.file_size = file_size
+        self._lock_fd = os.open(output_path, os.O_RDONLY | os.O_CREAT, 0o644)
+
+    def load(self) -> List[Extent]:
+        """
+        :return: received ranges. empty if no checkpoint or it belongs to another file
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        if len(data) < FILE_SIZE_STRUCT.size or FILE_SIZE_STRUCT.unpack_from(data)[0] != self.file_size:
+            return []
+        records = data[FILE_SIZE_STRUCT.size:]
+        return list(EXTENT_STRUCT.iter_unpack(records[:len(records) - len(records) % EXTENT_STRUCT.size]))
+
+    def resume_offset(self, offset: int) -> int:
+        """
+        :param offset: where sender would start without checkpoint
+        :return: first byte from offset that is not received yet
+        """
+        with self._locked():
+            for start, end in self.load():
+                if start <= offset < end:
+                    return end
+        return offset
+
+    def add(self, start: int, end: int) -> None:
+        """
+        Record [start, end) as received. data should be on disk already
+        """
+        with self._locked():
+            extents = merge_extents(self.load() + [(start, end)])
+            if extents == [(0, self.file_size)] or not self.file_size:  # whole file received. nothing to resume
+                self._remove()
+                return
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(FILE_SIZE_STRUCT.pack(self.file_size))
+                f.write(b''.join(EXTENT_STRUCT.pack(*extent) for extent in extents))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+
+    def close(self) -> None:
+        os.close(self._lock_fd)
+
+    def _remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        hold exclusive flock of the output file in with block
+        """
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
@@ -0,0 +1,142 @@
+import time
+import zlib
+from functools import lru_cache
+from itertools import islice
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from messages import CompressionType, PacketFlag
+from stats import TransferStats
+from utility import Payload
+
+try:
+    import lz4.block as lz4_block  # optional. pip install lz4
+except ImportError:
+    lz4_block = None
+try:
+    import zstandard  # optional. pip install zstandard
+except ImportError:
+    zstandard = None
+
+MAX_BLOCK_CHUNKS = 16  # raw chunks joined into one compressed payload at most. bounds decompressed payload size
+MAX_RAW_RUN = 64  # chunks sent raw at most before trying compression again
+DEFAULT_LEVELS = {CompressionType.ZLIB: 6, CompressionType.LZ4: 0, CompressionType.ZSTD: 3}
+
+
+@lru_cache(maxsize=None)
+def _zstd_compressor(level: int):
+    return zstandard.ZstdCompressor(level=level)
+
+
+@lru_cache(maxsize=None)
+def _zstd_decompressor():
+    return zstandard.ZstdDecompressor()
+
+
+def _lz4_compress(data: Payload, level: int) -> bytes:
+    if level > 0:
+        return lz4_block.compress(data, mode='high_compression', compression=level)
+    return lz4_block.compress(data)
+
+
+# algorithms available in this process. level -> compressed payload, compressed payload -> data
+COMPRESSORS: Dict[CompressionType, Callable[[Payload, int], bytes]] = {
+    CompressionType.ZLIB: zlib.compress,
+}
+DECOMPRESSORS: Dict[CompressionType, Callable[[Payload], bytes]] = {
+    CompressionType.ZLIB: zlib.decompress,
+}
+if lz4_block:
+    COMPRESSORS[CompressionType.LZ4] = _lz4_compress
+    DECOMPRESSORS[CompressionType.LZ4] = lz4_block.decompress
+if zstandard:
+    COMPRESSORS[CompressionType.ZSTD] = lambda data, level: _zstd_compressor(level).compress(data)
+    DECOMPRESSORS[CompressionType.ZSTD] = lambda data: _zstd_decompressor().decompress(data)
+
+
+class PayloadCompressor:
+    """
+    Turns raw chunks of sender into DATA payloads.
+    Consecutive chunks are joined into a block, as many as the block still fits one segment after compression,
+    estimated from the ratio of the previous block. Every payload is compressed on its own, so a lost, reordered
+    or selectively retransmitted segment is decompressed without any other segment.
+    Block that does not fit is split in half until it does, and incompressible data is sent raw(no COMPRESSED flag)
+    without spending CPU on it for a while.
+    """
+
+    def __init__(self, compression: CompressionType, max_payload: int, level: Optional[int] = None,
+                 stats: Optional[TransferStats] = None):
+        """
+        :param compression: algorithm agreed with receiver
+        :param max_payload: maximum payload size of a segment
+        :param level: compression level. default level of the algorithm if None
+        :param stats: counters of raw/encoded bytes and compression time to update
+        """
+        self.max_payload = max_payload
+        self.level = DEFAULT_LEVELS[compression] if level is None else level
+        self.stats = stats if stats is not None else TransferStats()
+        self._compress = COMPRESSORS[compression]
+
+    def payloads(self, chunks: Iterator[Payload]) -> Iterator[Tuple[Payload, int]]:
+        """
+        :param chunks: raw data chunks of at most max_payload bytes
+        :return: (payload, PacketFlag) to send in order
+        """
+        block_chunks = 1
+        raw_run = 0  # chunks to send raw without trying, after incompressible data. doubles while data stays so
+        skip = 0
+        while True:
+            if skip:
+                chunk = next(chunks, None)
+                if not chunk:
+                    return
+                self._count(chunk, chunk)
+                yield chunk, 0
+                skip -= 1
+                continue
+            block = b''.join(islice(chunks, block_chunks))
+            if not block:
+                return
+            encoded = list(self._encode(memoryview(block)))
+            yield from encoded
+            if len(encoded) == 1 and encoded[0][1] & PacketFlag.COMPRESSED:
+                # aim at 90% of a segment. bigger blocks often compress better than the estimate, so probe one more
+                ratio = len(encoded[0][0]) / len(block)
+                estimate = int(0.9 / ratio * block_chunks * self.max_payload / len(block))
+                if len(encoded[0][0]) < 0.9 * self.max_payload:
+                    estimate = max(estimate, block_chunks + 1)
+                block_chunks = max(1, min(estimate, MAX_BLOCK_CHUNKS))
+                raw_run = 0
+            elif not any(flags for _, flags in encoded):  # nothing compressed
+                block_chunks = 1
+                raw_run = min(max(raw_run * 2, 1), MAX_RAW_RUN)
+                skip = raw_run
+            else:  # split
+                block_chunks = max(1, block_chunks // 2)
+
+    def _encode(self, block: memoryview) -> Iterator[Tuple[Payload, int]]:
+        start = time.perf_counter()
+        compressed = self._compress(block, self.level)
+        self.stats.compress_seconds += time.perf_counter() - start
+        if len(compressed) <= self.max_payload and len(compressed) < len(block):
+            self._count(block, compressed)
+            yield compressed, PacketFlag.COMPRESSED
+        elif len(block) <= self.max_payload:  # incompressible
+            self._count(block, block)
+            yield block, 0
+        else:
+            half = len(block) // 2
+            yield from self._encode(block[:half])
+            yield from self._encode(block[half:])
+
+    def _count(self, block: Payload, payload: Payload) -> None:
+        self.stats.payload_bytes += len(block)
+        self.stats.encoded_bytes += len(payload)
+
+
+def decompress(compression: CompressionType, payload: Payload) -> bytes:
+    """
+    :param compression: algorithm agreed with sender
+    :param payload: payload of a segment with COMPRESSED flag
+    :return: raw data
+    """
+    return DECOMPRESSORS[compression](payload)
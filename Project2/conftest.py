@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules of this project import each other flat(run from this directory), so tests need it on the path too
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,124 @@
+import math
+import time
+from dataclasses import dataclass
+from typing import List, Union
+
+
+@dataclass
+class CwndSample:
+    time: float  # time.monotonic() the round(one RTT) ended. only differences between samples mean anything
+    cwnd: float  # congestion window at the end of the round(packets)
+    ssthresh: float  # slow start threshold at the end of the round(packets)
+
+
+class CongestionControl:
+    """
+    Base of sender congestion control strategies.
+    RDTSocket sends at most min(window_size, window) packets in flight, and reports ACKs and losses to the strategy.
+    cwnd is traced once per round trip - a round ends when the packet that was sent first after the previous round
+    ending is acknowledged.
+    """
+    name: str = ''
+    cwnd: float  # congestion window(packets)
+    ssthresh: float  # slow start threshold(packets)
+    trace: List[CwndSample]  # cwnd per round trip
+
+    def __init__(self, window_size: int):
+        """
+        :param window_size: sender window size. upper bound of congestion window
+        """
+        self.max_window = window_size
+        self.cwnd = window_size
+        self.ssthresh = math.inf
+        self.trace = []
+        self._round_end_seq_num = 0
+
+    @property
+    def window(self) -> int:
+        """
+        :return: number of packets allowed in flight now
+        """
+        return max(1, min(int(self.cwnd), self.max_window))
+
+    def on_ack(self, acked_count: int, ack_num: int, next_seq_num: int) -> None:
+        """
+        invoked when cumulative ACK moves sender window forward
+        :param acked_count: number of newly acknowledged packets
+        :param ack_num: cumulative ACK seq_num
+        :param next_seq_num: seq_num of the next new packet sender will send
+        """
+        if ack_num > self._round_end_seq_num:
+            self.trace.append(CwndSample(time.monotonic(), self.cwnd, self.ssthresh))
+            self._round_end_seq_num = next_seq_num
+
+    def on_fast_retransmit(self) -> None:
+        """
+        invoked when a loss is detected by duplicated ACKs
+        """
+        pass
+
+    def on_timeout(self) -> None:
+        """
+        invoked when retransmission timer expires
+        """
+        pass
+
+
+class FixedWindow(CongestionControl):
+    """
+    Keep congestion window at window size. No congestion control.
+    """
+    name = 'fixed'
+
+
+class AIMD(CongestionControl):
+    """
+    TCP Reno like congestion control
+    - slow start: cwnd grows 1 packet per ACKed packet(doubles per RTT) until ssthresh
+    - congestion avoidance: cwnd grows 1 packet per RTT(additive increase)
+    - loss by duplicated ACKs: cwnd halves(multiplicative decrease)
+    - loss by timeout: ssthresh halves, cwnd restarts slow start from 1 packet
+    """
+    name = 'aimd'
+    min_ssthresh: float = 2
+
+    def __init__(self, window_size: int, initial_cwnd: float = 1):
+        super().__init__(window_size)
+        self.cwnd = initial_cwnd
+
+    def on_ack(self, acked_count: int, ack_num: int, next_seq_num: int) -> None:
+        for _ in range(acked_count):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1  # slow start
+            else:
+                self.cwnd += 1 / self.cwnd  # congestion avoidance
+        # cwnd over window size is meaningless, and it would take long to shrink after loss
+        self.cwnd = min(self.cwnd, self.max_window)
+        super().on_ack(acked_count, ack_num, next_seq_num)
+
+    def on_fast_retransmit(self) -> None:
+        self.ssthresh = max(self.cwnd / 2, self.min_ssthresh)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self) -> None:
+        self.ssthresh = max(self.cwnd / 2, self.min_ssthresh)
+        self.cwnd = 1
+
+
+CONGESTION_CONTROLS = {
+    FixedWindow.name: FixedWindow,
+    AIMD.name: AIMD,
+}
+
+
+def create_congestion_control(congestion: Union[str, CongestionControl], window_size: int) -> CongestionControl:
+    """
+    :param congestion: strategy name registered in CONGESTION_CONTROLS, or strategy instance
+    :param window_size: sender window size
+    :return: congestion control strategy
+    """
+    if isinstance(congestion, CongestionControl):
+        return congestion
+    if congestion not in CONGESTION_CONTROLS:
+        raise ValueError(f'Unknown congestion control [{congestion}] - one of {list(CONGESTION_CONTROLS)}')
+    return CONGESTION_CONTROLS[congestion](window_size)
@@ -0,0 +1,99 @@
+import random
+from dataclasses import dataclass, fields
+from typing import Optional, List, Tuple
+
+
+@dataclass
+class ImpairmentConfig:
+    """
+    Network impairments UnreliableSocket applies to received datagrams.
+    Probabilities are per datagram. Same seed reproduces same impairment sequence for same traffic.
+    """
+    seed: Optional[int] = None
+    loss: float = 0.0  # bernoulli loss probability
+    # gilbert-elliott bursty loss. two state(good, bad) markov chain with its own loss probability per state
+    burst_enter: float = 0.0  # good -> bad transition probability. 0 disables gilbert-elliott model
+    burst_exit: float = 0.5  # bad -> good transition probability
+    burst_loss: float = 1.0  # loss probability in bad state
+    delay: float = 0.0  # one way delay(second)
+    jitter: float = 0.0  # delay varies uniformly in [delay - jitter, delay + jitter]
+    reorder: float = 0.0  # probability of holding datagram back by reorder_delay, so later ones overtake it
+    reorder_delay: float = 0.01  # second
+    duplicate: float = 0.0  # probability of delivering datagram twice
+    corrupt: float = 0.0  # probability of flipping one random bit
+    bandwidth: Optional[float] = None  # link rate(bytes per second). None for unlimited
+    queue_limit: Optional[int] = None  # bytes waiting for the link over this are dropped(tail drop). None for unlimited
+
+    @classmethod
+    def parse(cls, text: str) -> 'ImpairmentConfig':
+        """
+        Parse command line style config
+        :param text: comma separated key=value. ex) loss=0.05,delay=0.01,seed=1
+        :return: parsed config
+        """
+        types = {field.name: field.type for field in fields(cls)}
+        values = {}
+        for item in filter(None, text.split(',')):
+            key, value = item.split('=')
+            if key not in types:
+                raise ValueError(f'Unknown impairment [{key}] - one of {list(types)}')
+            values[key] = int(value) if key in ('seed', 'queue_limit') else float(value)
+        return cls(**values)
+
+
+class Impairment:
+    """
+    Decides what happens to each datagram - dropped, delayed, duplicated, corrupted.
+    Delay is returned as release time rather than slept, so the caller can keep receiving while datagrams are in flight.
+    """
+
+    def __init__(self, config: ImpairmentConfig):
+        self.config = config
+        self._random = random.Random(config.seed)
+        self._bad_state = False  # gilbert-elliott channel state
+        self._link_free_at = 0.0  # when the bandwidth limited link finishes sending queued datagrams
+
+    def process(self, datagram: bytes, now: float) -> List[Tuple[float, bytes]]:
+        """
+        :param datagram: datagram arrived from network
+        :param now: arrival time(time.monotonic())
+        :return: (release time, datagram) to deliver. empty if datagram is lost
+        """
+        config = self.config
+        if self._is_lost():
+            return []
+
+        if config.bandwidth:
+            backlog = max(self._link_free_at - now, 0) * config.bandwidth
+            if config.queue_limit is not None and backlog + len(datagram) > config.queue_limit:
+                return []
+            self._link_free_at = max(self._link_free_at, now) + len(datagram) / config.bandwidth
+            now = self._link_free_at
+
+        copies = 2 if self._random.random() < config.duplicate else 1
+        deliveries = []
+        for _ in range(copies):
+            release = now + max(config.delay + self._random.uniform(-config.jitter, config.jitter), 0)
+            if self._random.random() < config.reorder:
+                release += config.reorder_delay
+            deliveries.append((release, self._corrupt(datagram)))
+        return deliveries
+
+    def _is_lost(self) -> bool:
+        config = self.config
+        if config.burst_enter:
+            if self._bad_state:
+                self._bad_state = self._random.random() >= config.burst_exit
+            else:
+                self._bad_state = self._random.random() < config.burst_enter
+            if self._bad_state and self._random.random() < config.burst_loss:
+                return True
+        return self._random.random() < config.loss
+
+    def _corrupt(self, datagram: bytes) -> bytes:
+        if not datagram or self._random.random() >= self.config.corrupt:
+            return datagram
+        corrupted = bytearray(datagram)
+        bit = self._random.randrange(len(corrupted) * 8)
+        corrupted[bit // 8] ^= 1 << (bit % 8)
+        return bytes(corrupted)
@@ -1,4 +1,4 @@
-from enum import IntEnum
+from enum import IntEnum, IntFlag
 
 
 class PacketType(IntEnum):
@@ -7,3 +7,32 @@ class PacketType(IntEnum):
     DATA = 2
     ACK = 3
     END_ACK = 4
+    START_ACK = 5
+    PROBE = 6  # path MTU probe. padded to the size being probed
+    PROBE_ACK = 7
+
+
+class ChecksumType(IntEnum):
+    NONE = 0  # no integrity check. only for trusted links
+    CRC32 = 1  # zlib
+    CRC32C = 2  # castagnoli. needs crc32c package(C accelerated, uses SSE4.2/ARMv8 crc instructions)
+
+
+class HandshakeOption(IntEnum):
+    CHECKSUM = 0  # ChecksumType sender asks for(START), receiver agreed(START_ACK)
+    STRIPE_OFFSET = 1  # striped transfer - file offset(bytes) where data of this connection starts
+    FILE_SIZE = 2  # striped transfer - size(bytes) of the whole file, so receiver can preallocate it
+    RESUME = 3  # sender can resume(START). receiver answers file offset to resume from(START_ACK)
+    COMPRESSION = 4  # CompressionType sender asks for(START), receiver agreed(START_ACK)
+    SEGMENT_SIZE = 5  # largest datagram sender can send(START), the one receiver can take too(START_ACK)
+
+
+class PacketFlag(IntFlag):
+    COMPRESSED = 1  # DATA payload is compressed with the agreed CompressionType. decompressed on its own
+
+
+class CompressionType(IntEnum):
+    NONE = 0
+    ZLIB = 1
+    LZ4 = 2  # needs lz4 package
+    ZSTD = 3  # needs zstandard package
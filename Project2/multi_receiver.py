@@ -0,0 +1,47 @@
+import argparse
+import logging
+import os
+
+from rdt_server import RDTServer
+
+parser = argparse.ArgumentParser(description='Multi connection receiver')
+parser.add_argument('-p', '--receiver_port', help='Receiver port')
+parser.add_argument('-ws', '--window_size', help='Window size')
+parser.add_argument('-d', '--directory', help='Directory to write received files', default='./downloads')
+parser.add_argument('-ae', '--ack_every', help='Delayed ACK - send one ACK per N in order packets', default='1')
+parser.add_argument('-ad', '--ack_delay', help='Maximum delay(second) of delayed ACK', default='0.01')
+parser.add_argument('-ss', '--segment_size', help='Largest datagram to receive. ex) 65507 on loopback', default='1472')
+parser.add_argument('-tw', '--time_wait', help='Seconds a closed connection keeps answering END', default='1')
+parser.add_argument('-it', '--idle_timeout', help='Give up connection whose sender sends nothing for N seconds. 0 to keep forever', default='120')
+parser.add_argument('-l', '--log_level', help='Logging level. DEBUG shows every packet', default='INFO')
+
+args = parser.parse_args()
+RECEIVER_PORT = int(args.receiver_port)
+WINDOW_SIZE = int(args.window_size)
+DIRECTORY = args.directory
+ACK_EVERY = int(args.ack_every)
+ACK_DELAY = float(args.ack_delay)
+SEGMENT_SIZE = int(args.segment_size)
+TIME_WAIT = float(args.time_wait)
+IDLE_TIMEOUT = float(args.idle_timeout)
+logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
+
+
+def open_file(connection):
+    ip, port = connection.addr
+    return open(os.path.join(DIRECTORY, f'{ip}_{port}_{connection.conn_id}.bin'), 'wb')
+
+
+def close_file(connection):
+    connection.sink.close()
+    result = 'Received' if connection.closed else 'Gave up idle connection after'
+    logging.info('%s %d bytes from %s - %s, %s', result, connection.received_bytes, connection.addr,
+                 connection.sink.name, connection.stats.snapshot())
+
+
+os.makedirs(DIRECTORY, exist_ok=True)
+server = RDTServer(WINDOW_SIZE, sink_factory=open_file, on_close=close_file,
+                   ack_every=ACK_EVERY, ack_delay=ACK_DELAY, segment_size=SEGMENT_SIZE, time_wait=TIME_WAIT,
+                   idle_timeout=IDLE_TIMEOUT)
+server.bind(('127.0.0.1', RECEIVER_PORT))
+server.serve_forever()
@@ -0,0 +1,438 @@
+import asyncio
+import io
+import random
+import time
+from typing import Optional, Dict, Set, Iterator, BinaryIO, Union, Tuple, Any
+
+from congestion import CongestionControl, create_congestion_control
+from messages import PacketType, ChecksumType, HandshakeOption
+from rdt_socket import ReceiverConnection, SEGMENT_SIZE, DATA_SIZE
+from rto import RTOEstimator
+from stats import TransferStats
+from utility import PacketHeader, Segment, verify_packet, decode_sack_ranges, str_to_byte, Payload, CHECKSUMS, \
+    encode_options, decode_options
+
+
+class RDTProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio implementation of RDT transport. Same wire format with RDTSocket, so either side can talk to the other.
+    Every timer is a callback scheduled on the event loop, so one process can drive many transfers,
+    and no coroutine waits forever on a silent peer - it fails with asyncio.TimeoutError instead.
+    Sender works in selective repeat mode: per packet timers, cumulative ACKs, SACK ranges and fast retransmit.
+    """
+    timer: float = 0.5  # second. initial retransmission timeout before first RTT sample
+    dup_ack_threshold: int = 3  # number of duplicated ACKs that triggers fast retransmit
+    max_retransmissions: int = 10  # one packet resent more than this means peer is gone
+
+    idle_timeout: float  # second. receiver gives up if sender sends nothing this long. 0 to wait forever
+    transport: Optional[asyncio.DatagramTransport]
+    peer_addr: Any  # receiver address(sender side), sender address(receiver side)
+    conn_id: int
+    rto_estimator: RTOEstimator
+    congestion: CongestionControl
+    receiver_connection: Optional[ReceiverConnection]
+    stats: TransferStats  # counters of sent, retransmitted, dropped packets, delivered bytes, RTT samples
+
+    def __init__(self, window_size: int, congestion: Union[str, CongestionControl] = 'fixed',
+                 ack_every: int = 1, ack_delay: float = 0.01, checksum: ChecksumType = ChecksumType.CRC32,
+                 idle_timeout: float = 120.0):
+        """
+        :param window_size: maximum number of packets in flight(sender), buffered out of order packets(receiver)
+        :param congestion: sender congestion control strategy name('fixed', 'aimd') or instance
+        :param ack_every: receiver sends one cumulative ACK per N in order segments. 1 disables delayed ACK
+        :param ack_delay: receiver sends delayed ACK at latest this long(second) after the segment it acknowledges
+        :param checksum: sender asks receiver for this algorithm. crc32 if receiver does not have it
+        :param idle_timeout: receiver fails recv_into() with asyncio.TimeoutError if no segment arrives from sender
+            this long(second). longer than maximum RTO, as a backing off sender is silent that long. 0 to wait forever
+        """
+        if checksum not in CHECKSUMS:
+            raise ValueError(f'Checksum [{ChecksumType(checksum).name}] not available - install crc32c package')
+        self.window_size = window_size
+        self.checksum = ChecksumType(checksum)
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.idle_timeout = idle_timeout
+        self.transport = None
+        self.peer_addr = None
+        self.conn_id = 0
+        self.sent_seq_num = 0
+        self.rto_estimator = RTOEstimator(initial_rto=self.timer)
+        self.congestion = create_congestion_control(congestion, window_size)
+        self.receiver_connection = None
+        self.stats = TransferStats()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._send_buffer = bytearray(SEGMENT_SIZE)
+        self._send_view = memoryview(self._send_buffer)
+        # control message(START_ACK, END_ACK) waiter - (type, seq_num, future)
+        self._control_waiter: Optional[Tuple[PacketType, int, asyncio.Future]] = None
+        self._accept_waiter: Optional[asyncio.Future] = None
+        self._recv_waiter: Optional[asyncio.Future] = None
+        self._ack_timer: Optional[asyncio.TimerHandle] = None  # receiver delayed ACK timer
+        self._idle_timer: Optional[asyncio.TimerHandle] = None  # receiver gives up silent sender
+        # sender state
+        self._payloads: Optional[Iterator[Payload]] = None
+        self._send_waiter: Optional[asyncio.Future] = None
+        self._chunks: Dict[int, Segment] = {}  # in flight seq_num -> segment
+        self._timers: Dict[int, asyncio.TimerHandle] = {}  # in flight seq_num -> retransmission timer
+        self._send_times: Dict[int, float] = {}  # in flight seq_num -> last sent time
+        self._send_counts: Dict[int, int] = {}  # in flight seq_num -> number of transmissions
+        self._sacked: Set[int] = set()
+        self._base = 1
+        self._next_seq_num = 1
+        self._window_end = 1 + window_size  # receive window end advertised by receiver
+        self._persist_timer: Optional[asyncio.TimerHandle] = None  # receive window closed with nothing in flight
+        self._probe_due = False  # persist timer expired. one chunk over receive window is sent as zero window probe
+        self._end_of_data = False
+        self._dup_ack_count = 0
+
+    @classmethod
+    async def create(cls, local_addr: Tuple[str, int], *args, **kwargs) -> 'RDTProtocol':
+        """
+        Create UDP endpoint bound to local_addr, driven by running event loop
+        :param local_addr: (host, port)
+        :return: protocol instance
+        """
+        loop = asyncio.get_running_loop()
+        _, protocol = await loop.create_datagram_endpoint(lambda: cls(*args, **kwargs), local_addr=local_addr)
+        return protocol
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+        self._loop = asyncio.get_running_loop()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        for waiter in (self._send_waiter, self._recv_waiter, self._accept_waiter):
+            if waiter and not waiter.done():
+                waiter.set_exception(exc or ConnectionError('Transport closed'))
+
+    def _send_segment(self, segment: Segment, address) -> None:
+        segment.header.conn_id = self.conn_id
+        size = segment.pack_into(self._send_buffer, checksum=self.checksum)
+        self.transport.sendto(self._send_view[:size], address)
+
+    async def _request(self, segment: Segment, reply_type: PacketType, retries: int) -> Segment:
+        """
+        Send control message and wait for its reply, resend it every RTO(with backoff)
+        :param segment: control message
+        :param reply_type: expected reply type. reply seq_num must be same with control message
+        :param retries: maximum number of resending
+        :return: reply
+        """
+        waiter = self._loop.create_future()
+        self._control_waiter = (reply_type, segment.header.seq_num, waiter)
+        rto = self.rto_estimator.rto
+        try:
+            for _ in range(retries + 1):
+                self._send_segment(segment, self.peer_addr)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(waiter), rto)
+                except asyncio.TimeoutError:
+                    rto = min(rto * 2, self.rto_estimator.max_rto)
+            raise asyncio.TimeoutError(f'No [{PacketType(reply_type).name}] from {self.peer_addr}')
+        finally:
+            self._control_waiter = None
+
+    async def connect(self, address: Tuple[str, int], retries: int = 5) -> None:
+        """
+        invoked by sender. Send START and wait START_ACK, agreeing on checksum algorithm
+        :param address: receiver address
+        :param retries: maximum number of resending START
+        """
+        self.peer_addr = address
+        self.conn_id = random.getrandbits(32)
+        header = PacketHeader(type=PacketType.START, seq_num=random.randint(1, 100))
+        start = Segment(header, encode_options({HandshakeOption.CHECKSUM: self.checksum}))
+        reply = await self._request(start, PacketType.START_ACK, retries)
+        self.checksum = ChecksumType(decode_options(reply.data).get(HandshakeOption.CHECKSUM, ChecksumType.CRC32))
+        self._window_end = self._next_seq_num + (reply.header.window or self.window_size)
+
+    async def accept(self) -> Any:
+        """
+        invoked by receiver. Wait until getting START message
+        :return: sender address
+        """
+        self._accept_waiter = self._loop.create_future()
+        self.receiver_connection = await self._accept_waiter
+        self.peer_addr = self.receiver_connection.addr
+        self.conn_id = self.receiver_connection.conn_id
+        return self.peer_addr
+
+    async def send(self, data: Union[Payload, str]) -> None:
+        """
+        invoked by sender to transmit data to the receiver
+        :param data: binary data to send. str is encoded to utf-8 once.
+        """
+        if isinstance(data, str):
+            data = str_to_byte(data)
+        data_view = memoryview(data)
+        await self._send_payloads(data_view[i:i + DATA_SIZE] for i in range(0, len(data_view), DATA_SIZE))
+
+    async def send_stream(self, fileobj: BinaryIO) -> None:
+        """
+        invoked by sender to transmit a binary file to the receiver. file is read lazily chunk by chunk
+        :param fileobj: file object opened in binary read mode
+        """
+        await self._send_payloads(iter(lambda: fileobj.read(DATA_SIZE), b''))
+
+    async def _send_payloads(self, payloads: Iterator[Payload]) -> None:
+        self._payloads = payloads
+        self._end_of_data = False
+        self._send_waiter = self._loop.create_future()
+        self._fill_window()
+        try:
+            await self._send_waiter
+        finally:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            if self._persist_timer:
+                self._persist_timer.cancel()
+                self._persist_timer = None
+        self.sent_seq_num = self._next_seq_num - 1
+
+    def _fill_window(self) -> None:
+        """
+        Send new chunks until window(limited by congestion window and receive window) is full.
+        Receive window closed with nothing in flight and no window update in RTO(persist timer) - send one chunk anyway
+        as zero window probe, resent by its own timer. Finish sending if everything is ACKed.
+        """
+        while not self._end_of_data and self._next_seq_num < self._base + self.congestion.window \
+                and (self._next_seq_num < self._window_end or self._probe_due):
+            payload = next(self._payloads, None)
+            if not payload:
+                self._end_of_data = True
+                break
+            seq_num = self._next_seq_num
+            if seq_num >= self._window_end:
+                self.stats.window_probes += 1
+                self._probe_due = False
+            self._chunks[seq_num] = Segment(PacketHeader(type=PacketType.DATA, seq_num=seq_num), payload)
+            self._send_counts[seq_num] = 0
+            self._transmit(seq_num)
+            self._next_seq_num += 1
+
+        if self._end_of_data and self._base == self._next_seq_num and not self._send_waiter.done():
+            self._send_waiter.set_result(None)
+        elif not self._end_of_data and self._base == self._next_seq_num and self._persist_timer is None:
+            # receive window closed
+            self._persist_timer = self._loop.call_later(self.rto_estimator.rto, self._on_persist_timeout)
+
+    def _on_persist_timeout(self) -> None:
+        """
+        Receive window stayed closed for RTO with nothing in flight. window update may be lost, so probe it
+        """
+        self._persist_timer = None
+        if self._base == self._next_seq_num:
+            self._probe_due = True
+            self._fill_window()
+
+    def _transmit(self, seq_num: int) -> None:
+        """
+        (Re)send in flight chunk and restart its timer
+        :param seq_num: chunk seq_num
+        """
+        if self._send_counts[seq_num] > self.max_retransmissions:
+            if not self._send_waiter.done():
+                self._send_waiter.set_exception(asyncio.TimeoutError(f'No ACK of [{seq_num}] from {self.peer_addr}'))
+            return
+        self._send_segment(self._chunks[seq_num], self.peer_addr)
+        self.stats.packets_sent += 1
+        if self._send_counts[seq_num]:
+            self.stats.packets_retransmitted += 1
+        self._send_counts[seq_num] += 1
+        self._send_times[seq_num] = self._loop.time()
+        if seq_num in self._timers:
+            self._timers[seq_num].cancel()
+        self._timers[seq_num] = self._loop.call_later(self.rto_estimator.rto, self._on_timeout, seq_num)
+
+    def _on_timeout(self, seq_num: int) -> None:
+        """
+        Retransmission timer of one packet expired. Resend only that packet.
+        :param seq_num: expired packet seq_num
+        """
+        self._timers.pop(seq_num, None)
+        if seq_num < self._base or seq_num in self._sacked:
+            return
+        self.stats.timeouts += 1
+        if seq_num == self._base:  # back off once per loss event, not once per packet in flight
+            self.rto_estimator.on_timeout()
+            if seq_num < self._window_end:  # zero window probe is not lost for congestion
+                self.congestion.on_timeout()
+        self._transmit(seq_num)
+
+    def _on_ack(self, segment: Segment) -> None:
+        now = self._loop.time()
+        ack_num = segment.header.seq_num
+        self.stats.acks_received += 1
+        previous_window_end = self._window_end
+        if ack_num <= self._next_seq_num:  # receive window end never moves back, even with reordered ACKs
+            self._window_end = max(self._window_end, ack_num + segment.header.window)
+        if self._base < ack_num <= self._next_seq_num:
+            acked = range(self._base, ack_num)
+            # sample RTT only when ACK is not ambiguous - no packet in acked range was resent or acknowledged before
+            if not any(self._send_counts[seq_num] > 1 or seq_num in self._sacked for seq_num in acked):
+                self._sample_rtt(now - self._send_times[ack_num - 1])
+            for seq_num in acked:
+                self._release(seq_num)
+            self._base = ack_num
+            self._dup_ack_count = 0
+            self.congestion.on_ack(len(acked), ack_num, self._next_seq_num)
+        elif ack_num == self._base and self._window_end != previous_window_end:
+            # window update, not a sign of loss. zero window probe it answers was dropped, so resend it now
+            if previous_window_end <= self._base < min(self._window_end, self._next_seq_num):
+                self._transmit(self._base)
+        elif ack_num == self._base and self._base < self._next_seq_num:
+            self._dup_ack_count += 1
+            self.stats.duplicate_acks += 1
+            # fast retransmit - receiver got 3 more packets after base, so base is lost rather than delayed
+            if self._dup_ack_count == self.dup_ack_threshold and self._base not in self._sacked:
+                self.congestion.on_fast_retransmit()
+                self.stats.fast_retransmits += 1
+                self._transmit(self._base)
+
+        # selectively acknowledged packets are received but out of order. stop their timers not to resend them
+        for start, end in decode_sack_ranges(segment.data):
+            for seq_num in range(max(start, self._base), min(end, self._next_seq_num)):
+                if seq_num in self._sacked:
+                    continue
+                self._sacked.add(seq_num)
+                if seq_num in self._timers:
+                    self._timers.pop(seq_num).cancel()
+                if self._send_counts[seq_num] == 1:
+                    self._sample_rtt(now - self._send_times[seq_num])
+
+        self._fill_window()
+
+    def _sample_rtt(self, rtt: float) -> None:
+        """
+        :param rtt: round trip time(second) of a packet sent only once
+        """
+        self.rto_estimator.sample(rtt)
+        self.stats.add_rtt(rtt)
+
+    def _release(self, seq_num: int) -> None:
+        """
+        Forget cumulatively acknowledged chunk
+        """
+        del self._chunks[seq_num]
+        del self._send_counts[seq_num]
+        self._send_times.pop(seq_num, None)
+        self._sacked.discard(seq_num)
+        if seq_num in self._timers:
+            self._timers.pop(seq_num).cancel()
+
+    async def recv(self) -> bytes:
+        """
+        invoked by the receiver to receive data from the sender. whole data is kept in memory
+        :return: received binary data
+        """
+        buffer = io.BytesIO()
+        await self.recv_into(buffer)
+        return buffer.getvalue()
+
+    async def recv_into(self, fileobj: BinaryIO) -> int:
+        """
+        invoked by the receiver. in order data is written to fileobj as soon as it arrives, until END
+        :param fileobj: file object opened in binary write mode
+        :return: number of received bytes
+        :raise asyncio.TimeoutError: no segment from sender within idle_timeout
+        """
+        connection = self.receiver_connection
+        # data arrived before recv_into() is kept in memory. write it first
+        fileobj.write(connection.sink.getvalue())
+        connection.sink = fileobj
+        if not connection.closed:
+            self._recv_waiter = self._loop.create_future()
+            if self.idle_timeout:
+                self._on_idle_timer()
+            try:
+                await self._recv_waiter
+            finally:
+                if self._idle_timer:
+                    self._idle_timer.cancel()
+                    self._idle_timer = None
+        return connection.received_bytes
+
+    async def close(self, retries: int = 5) -> None:
+        """
+        invoked by the sender. Send END, wait END_ACK and close transport
+        :param retries: maximum number of resending END
+        """
+        header = PacketHeader(PacketType.END, seq_num=self.sent_seq_num + 1)
+        self.sent_seq_num += 1
+        try:
+            await self._request(Segment(header), PacketType.END_ACK, retries)
+        finally:
+            self.transport.close()
+
+    def _on_ack_timer(self) -> None:
+        """
+        Send delayed ACK of receiver connection. reschedule if it is not due yet
+        """
+        self._ack_timer = None
+        connection = self.receiver_connection
+        if connection.closed or connection.ack_deadline is None:
+            return
+        ack = connection.flush_ack(time.monotonic())
+        if ack:
+            self._send_segment(ack, connection.addr)
+        else:
+            self._ack_timer = self._loop.call_later(connection.ack_deadline - time.monotonic(), self._on_ack_timer)
+
+    def _on_idle_timer(self) -> None:
+        """
+        Fail recv_into() if sender sent nothing for idle_timeout. reschedule for last_heard + idle_timeout otherwise,
+        so the timer is not restarted per segment
+        """
+        self._idle_timer = None
+        connection = self.receiver_connection
+        if self._recv_waiter is None or self._recv_waiter.done():
+            return
+        remaining = connection.last_heard + self.idle_timeout - time.monotonic()
+        if remaining > 0:
+            self._idle_timer = self._loop.call_later(remaining, self._on_idle_timer)
+            return
+        self._recv_waiter.set_exception(asyncio.TimeoutError(
+            f'No segment from {connection.addr} for {self.idle_timeout} seconds - '
+            f'{connection.received_bytes} bytes received'))
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if not verify_packet(data, self.checksum):
+            self.stats.dropped_corrupt += 1
+            return
+        segment = Segment.from_bytes(data)
+        header = segment.header
+
+        # receiver
+        connection = self.receiver_connection
+        if connection is None and header.type == PacketType.START:
+            if self._accept_waiter is None or self._accept_waiter.done():
+                return
+            connection = ReceiverConnection(addr, header.conn_id, self.window_size, io.BytesIO(),
+                                            ack_every=self.ack_every, ack_delay=self.ack_delay, stats=self.stats)
+            self.receiver_connection = connection
+            self.conn_id = header.conn_id
+            self._accept_waiter.set_result(connection)
+        if connection is not None:
+            if addr != connection.addr or header.conn_id != connection.conn_id:
+                return
+            reply = connection.on_segment(segment)
+            self.checksum = connection.checksum  # agreed in START
+            if reply:
+                self._send_segment(reply, addr)
+            if connection.ack_deadline is not None and self._ack_timer is None:
+                self._ack_timer = self._loop.call_later(connection.ack_delay, self._on_ack_timer)
+            if connection.closed and self._recv_waiter and not self._recv_waiter.done():
+                self._recv_waiter.set_result(None)
+            return
+
+        # sender
+        if header.conn_id != self.conn_id:
+            return
+        if self._control_waiter:
+            reply_type, seq_num, waiter = self._control_waiter
+            if header.type == reply_type and header.seq_num == seq_num and not waiter.done():
+                waiter.set_result(segment)
+                return
+        if header.type == PacketType.ACK and self._send_waiter and not self._send_waiter.done():
+            self._on_ack(segment)
@@ -0,0 +1,220 @@
+import io
+import logging
+import selectors
+import socket
+import time
+from collections import deque
+from typing import Dict, Tuple, Any, Callable, Optional, BinaryIO, Deque, Set
+
+from impairment import ImpairmentConfig
+from messages import PacketType
+from rdt_socket import ReceiverConnection, SEGMENT_SIZE
+from stats import TransferStats
+from utility import UnreliableSocket, Segment, verify_packet, HEADER_SIZE, HEADER_STRUCT, HANDSHAKE_CHECKSUM
+
+ConnectionKey = Tuple[Any, int]  # sender address, connection id
+
+logger = logging.getLogger(__name__)
+
+
+class RDTServer(UnreliableSocket):
+    """
+    Receiver that serves many sender connections on one UDP port.
+    Datagrams are demultiplexed by (sender address, connection id) to per connection ReceiverConnection state,
+    and one selector loop drives every transfer concurrently.
+    Each connection counts its own packets in connection.stats.
+    """
+    window_size: int
+    segment_size: int  # largest datagram received
+    connections: Dict[ConnectionKey, ReceiverConnection]  # connections in progress
+    time_wait: float  # second. closed connection keeps answering END this long, in case its END_ACK was lost
+    idle_timeout: float  # second. connection whose sender sends nothing this long is given up. 0 to keep forever
+    stats: TransferStats  # datagrams that belong to no connection
+
+    def __init__(self, window_size: int,
+                 sink_factory: Optional[Callable[[ReceiverConnection], BinaryIO]] = None,
+                 on_close: Optional[Callable[[ReceiverConnection], None]] = None,
+                 receive_buffer_size: int = 4 * 1024 * 1024, impairment: Optional[ImpairmentConfig] = None,
+                 ack_every: int = 1, ack_delay: float = 0.01, segment_size: int = SEGMENT_SIZE,
+                 time_wait: float = 1.0, idle_timeout: float = 120.0):
+        """
+        :param window_size: receiver window size of each connection
+        :param sink_factory: returns file object to write data of new connection. in memory buffer if not given
+        :param on_close: invoked when connection received END, or was given up for being idle(connection.closed False)
+        :param receive_buffer_size: kernel socket receive buffer(bytes). windows of every sender share it
+        :param impairment: simulated network impairments on received packets
+        :param ack_every: each connection sends one cumulative ACK per N in order segments. 1 disables delayed ACK
+        :param ack_delay: delayed ACK is sent at latest this long(second) after the segment it acknowledges
+        :param segment_size: largest datagram to receive. each sender agrees on the smaller one of its own and this
+        :param time_wait: closed connection answers END resent by its sender this long(second)
+        :param idle_timeout: connection with no segment this long(second) is dropped, so a dead sender does not hold
+            its state and sink forever. longer than maximum RTO, as a backing off sender is silent that long.
+            0 to keep forever
+        """
+        super().__init__(impairment)
+        self.setblocking(False)
+        self.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+        self.window_size = window_size
+        self.sink_factory = sink_factory
+        self.on_close = on_close
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.segment_size = segment_size
+        self.connections = {}
+        self.time_wait = time_wait
+        self.idle_timeout = idle_timeout
+        self._idle_check_at = time.monotonic() + idle_timeout  # next scan of connections for idle ones
+        # closed connections in TIME_WAIT -> expiry time.monotonic(). in close order, so the oldest expires first
+        self._time_wait: Dict[ConnectionKey, Tuple[ReceiverConnection, float]] = {}
+        self.stats = TransferStats()
+        self._delayed_acks: Set[ReceiverConnection] = set()  # connections holding a delayed ACK
+        self._accept_queue: Deque[ReceiverConnection] = deque()  # established, but not returned by accept() yet
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self, selectors.EVENT_READ)
+        self._send_buffer = bytearray(SEGMENT_SIZE)
+        self._send_view = memoryview(self._send_buffer)
+        self._recv_buffer = bytearray(segment_size)
+        self._recv_view = memoryview(self._recv_buffer)
+
+    def accept(self) -> ReceiverConnection:
+        """
+        Wait until a new connection is established, while keeping other transfers in progress.
+        :return: new connection handle. its transfer goes on while poll() / serve_forever() / accept() runs
+        """
+        while not self._accept_queue:
+            self.poll()
+        return self._accept_queue.popleft()
+
+    def serve_forever(self) -> None:
+        while True:
+            self.poll()
+
+    def poll(self, timeout: Optional[float] = None) -> int:
+        """
+        Wait until socket is readable, then handle every datagram already received
+        :param timeout: maximum waiting time(second). None to wait forever
+        :return: number of handled datagrams
+        """
+        delay = self.pending_delay()  # delayed datagrams are released without making socket readable
+        if delay is not None:
+            timeout = delay if timeout is None else min(timeout, delay)
+        if self._delayed_acks:  # wake up for the earliest delayed ACK
+            ack_delay = max(min(c.ack_deadline for c in self._delayed_acks) - time.monotonic(), 0)
+            timeout = ack_delay if timeout is None else min(timeout, ack_delay)
+        if self.idle_timeout and self.connections:  # wake up to give up idle connections
+            idle_check = max(self._idle_check_at - time.monotonic(), 0)
+            timeout = idle_check if timeout is None else min(timeout, idle_check)
+        self._selector.select(timeout)
+        handled = 0
+        while True:
+            try:
+                size, addr = self.recvfrom_into(self._recv_buffer)
+            except BlockingIOError:
+                break
+            self._dispatch(self._recv_view[:size], addr)
+            handled += 1
+        self._flush_delayed_acks()
+        self._expire_time_wait()
+        self._expire_idle()
+        return handled
+
+    def _expire_time_wait(self) -> None:
+        """
+        Forget closed connections whose TIME_WAIT is over
+        """
+        now = time.monotonic()
+        while self._time_wait:
+            key, (_, expiry) = next(iter(self._time_wait.items()))
+            if expiry > now:
+                break
+            del self._time_wait[key]
+
+    def _expire_idle(self) -> None:
+        """
+        Give up connections whose sender sent nothing for idle_timeout, and hand them to on_close.
+        connections are scanned at most once per second(or idle_timeout), not per datagram
+        """
+        now = time.monotonic()
+        if not self.idle_timeout or now < self._idle_check_at:
+            return
+        self._idle_check_at = now + min(self.idle_timeout, 1.0)
+        for key, connection in list(self.connections.items()):
+            if now - connection.last_heard < self.idle_timeout:
+                continue
+            logger.warning('Connection [%d] with %s idle for %.1f seconds - given up after %d bytes',
+                           connection.conn_id, connection.addr, now - connection.last_heard,
+                           connection.received_bytes)
+            del self.connections[key]
+            self._delayed_acks.discard(connection)
+            if self.on_close:
+                self.on_close(connection)
+
+    def _flush_delayed_acks(self) -> None:
+        """
+        Send delayed ACKs whose time has come
+        """
+        now = time.monotonic()
+        for connection in list(self._delayed_acks):
+            ack = connection.flush_ack(now)
+            if ack:
+                self._delayed_acks.discard(connection)
+                self._send_reply(connection, ack)
+
+    def _dispatch(self, datagram: memoryview, addr) -> None:
+        """
+        Verify datagram with checksum of its connection, pass it to the connection, and send reply back
+        :param datagram: received datagram
+        :param addr: sender address
+        """
+        if len(datagram) < HEADER_SIZE:
+            self.stats.dropped_corrupt += 1
+            return
+        # only conn_id is read before verifying - it picks the checksum, and nothing else is trusted until verified
+        conn_id = HEADER_STRUCT.unpack_from(datagram)[6]
+        key = (addr, conn_id)
+        connection = self.connections.get(key)
+        if connection is None and key in self._time_wait:  # closed one answers END only
+            connection = self._time_wait[key][0]
+        if not verify_packet(datagram, connection.checksum if connection else HANDSHAKE_CHECKSUM):
+            (connection.stats if connection else self.stats).dropped_corrupt += 1
+            logger.debug('Data Corrupted. Drop Packet from %s', addr)
+            return
+        segment = Segment.from_bytes(datagram)
+        if connection is None:
+            if segment.header.type != PacketType.START:
+                logger.debug('Drop packet from %s - connection [%d] not established', addr, segment.header.conn_id)
+                return
+            connection = ReceiverConnection(addr, segment.header.conn_id, self.window_size,
+                                            ack_every=self.ack_every, ack_delay=self.ack_delay,
+                                            max_segment_size=self.segment_size)
+            connection.sink = self.sink_factory(connection) if self.sink_factory else io.BytesIO()
+            self.connections[key] = connection
+            self._accept_queue.append(connection)
+            logger.info('Connection [%d] established with %s', connection.conn_id, addr)
+
+        reply = connection.on_segment(segment)
+        if reply:
+            self._send_reply(connection, reply)
+            if key in self._time_wait:  # restart timer, the same as TCP on resent FIN. moves to the end of close order
+                del self._time_wait[key]
+                self._time_wait[key] = (connection, time.monotonic() + self.time_wait)
+        if connection.ack_deadline is None:
+            self._delayed_acks.discard(connection)
+        else:
+            self._delayed_acks.add(connection)
+
+        if connection.closed and key in self.connections:
+            del self.connections[key]
+            self._time_wait[key] = (connection, time.monotonic() + self.time_wait)
+            self._delayed_acks.discard(connection)
+            if self.on_close:
+                self.on_close(connection)
+
+    def _send_reply(self, connection: ReceiverConnection, reply: Segment) -> None:
+        """
+        :param connection: connection the reply belongs to
+        :param reply: segment to send back to sender of the connection
+        """
+        reply.header.conn_id = connection.conn_id
+        size = reply.pack_into(self._send_buffer, checksum=connection.checksum)
+        self.sendto(self._send_view[:size], connection.addr)
@@ -1,261 +1,932 @@
+import errno
+import io
+import logging
 import random
+import socket
 import time
-from typing import Tuple
+from enum import Enum
+from typing import Tuple, Union, Dict, Set, BinaryIO, Iterator, Optional, Any, List, Callable
+
+from congestion import CongestionControl, create_congestion_control
+from impairment import ImpairmentConfig
+from compression import PayloadCompressor, COMPRESSORS, DECOMPRESSORS, decompress
+from messages import PacketType, ChecksumType, HandshakeOption, CompressionType, PacketFlag
+from rto import RTOEstimator
+from stats import TransferStats
+from write_behind import WriteBehindWriter
+from utility import UnreliableSocket, PacketHeader, Segment, Address, verify_packet, str_to_byte, Payload, \
+    encode_sack_ranges, decode_sack_ranges, SACK_RANGE_STRUCT, ReorderBuffer, HEADER_SIZE, CHECKSUMS, encode_options, decode_options
+
+SEGMENT_SIZE = 1472  # 1500 - 8(UDP header) - 20 (IP protocol). default, when peer does not agree on another one
+DATA_SIZE = SEGMENT_SIZE - HEADER_SIZE  # 1452 = 1472 - 20(Packet Header size)
+IP_UDP_HEADER_SIZE = 28
+MIN_SEGMENT_SIZE = 576 - IP_UDP_HEADER_SIZE  # every IPv4 host accepts 576 bytes datagram
+MAX_SEGMENT_SIZE = 65535 - IP_UDP_HEADER_SIZE  # largest UDP payload
+MAX_WINDOW = 0xFFFF  # largest receive window(packets) the 16 bit header field can advertise
+
+logger = logging.getLogger(__name__)
+
+
+class SenderMode(str, Enum):
+    GO_BACK_N = 'gbn'  # resend whole window on timeout
+    SELECTIVE_REPEAT = 'sr'  # resend only timed out packets, skip packets selectively acknowledged by receiver
+
+class ReceiverConnection:
+    """
+    Receiver side state of one connection - expected seq_num, out of order packets, output file.
+    Transport(RDTSocket, RDTServer) receives segments and sends the replies this returns.
+    """
+    addr: Any  # sender address
+    conn_id: int
+    window_size: int
+    rcv_expected_seq_num: int  # pkt sequence number that receiver expected to receive next time.
+    reorder_buffer: ReorderBuffer  # receiver buffer, stores out of order packets payloads
+    sink: Optional[BinaryIO]  # in order data is written here. WriteBehindWriter's queued chunks shrink the window
+    received_bytes: int
+    closed: bool  # END received
+    ack_every: int  # in order segments acknowledged by one cumulative ACK. 1 acknowledges every segment
+    ack_delay: float  # second. delayed ACK is sent at latest this long after the first segment it acknowledges
+    ack_deadline: Optional[float]  # time.monotonic() the pending delayed ACK should be sent. None if nothing pending
+    stats: TransferStats
+    checksum: ChecksumType  # algorithm sender asked for in START
+    compression: CompressionType  # algorithm of COMPRESSED payloads, agreed in START
+    options: Dict[int, int]  # HandshakeOption -> value, sent by sender in START
+    max_segment_size: int  # largest datagram transport can receive
+    segment_size: int  # largest datagram of this connection, agreed in START
+    reply_options: Optional[Dict[int, int]]  # HandshakeOption -> value sent back in START_ACK. None until START
+    on_start: Optional[Callable[[Dict[int, int]], Dict[int, int]]]
+    advertised_window: int  # window sent in the last ACK(or START_ACK)
+    last_heard: float  # time.monotonic() the last segment of this connection arrived. transports give up idle ones
+
+    def __init__(self, addr, conn_id: int, window_size: int, sink: Optional[BinaryIO] = None,
+                 ack_every: int = 1, ack_delay: float = 0.01, stats: Optional[TransferStats] = None,
+                 on_start: Optional[Callable[[Dict[int, int]], Dict[int, int]]] = None,
+                 max_segment_size: int = SEGMENT_SIZE):
+        """
+        :param addr: sender address
+        :param conn_id: connection id chosen by sender
+        :param window_size: receiver window size
+        :param sink: file object to write in order data
+        :param ack_every: delayed ACK mode if over 1 - acknowledge every N in order segments, or after ack_delay.
+            out of order, duplicated and gap filling segments are still acknowledged immediately
+        :param ack_delay: maximum delay of delayed ACK(second)
+        :param stats: counters to update. new one if not given
+        :param on_start: called once with START options, returns options to add to START_ACK. ex) resume offset
+        :param max_segment_size: largest datagram transport can receive. sender is asked not to send bigger ones
+        """
+        self.addr = addr
+        self.conn_id = conn_id
+        self.window_size = window_size
+        self.rcv_expected_seq_num = 1
+        self.reorder_buffer = ReorderBuffer(window_size)
+        self.sink = sink
+        self.received_bytes = 0
+        self.closed = False
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.ack_deadline = None
+        self._unacked_count = 0  # in order segments not acknowledged yet
+        self.stats = stats if stats is not None else TransferStats()
+        self.checksum = ChecksumType.CRC32
+        self.compression = CompressionType.NONE
+        self.max_segment_size = max_segment_size
+        self.segment_size = min(SEGMENT_SIZE, max_segment_size)
+        self.options = {}
+        self.reply_options = None
+        self.last_heard = time.monotonic()
+        self.on_start = on_start
+        self.advertised_window = 0
+
+    def on_segment(self, segment: Segment) -> Optional[Segment]:
+        """
+        Handle one received segment of this connection.
+        :param segment: received segment, already verified by transport. its payload may be overwritten after return
+        :return: reply segment to send back to sender, None if nothing to send
+        """
+        self.last_heard = time.monotonic()
+
+        # 0. connection request(or START_ACK was lost, so send the same one again)
+        if segment.header.type == PacketType.START:
+            if self.reply_options is None:
+                # agree on sender's checksum and compression if available here
+                self.options = decode_options(segment.data)
+                requested = self.options.get(HandshakeOption.CHECKSUM, ChecksumType.CRC32)
+                self.checksum = ChecksumType(requested) if requested in CHECKSUMS else ChecksumType.CRC32
+                requested = self.options.get(HandshakeOption.COMPRESSION, CompressionType.NONE)
+                self.compression = CompressionType(requested) if requested in DECOMPRESSORS else CompressionType.NONE
+                self.segment_size = min(self.options.get(HandshakeOption.SEGMENT_SIZE, SEGMENT_SIZE),
+                                        self.max_segment_size)
+                self.reply_options = self.on_start(self.options) if self.on_start else {}
+                self.reply_options[HandshakeOption.CHECKSUM] = self.checksum
+                self.reply_options[HandshakeOption.COMPRESSION] = self.compression
+                self.reply_options[HandshakeOption.SEGMENT_SIZE] = self.segment_size
+            # seq_num same with START. window tells sender how much it can send before the first ACK
+            header = PacketHeader(PacketType.START_ACK, segment.header.seq_num, window=self._advertise())
+            return Segment(header, encode_options(self.reply_options))
+
+        # path MTU probe. answered only if it arrived, which is the answer
+        if segment.header.type == PacketType.PROBE:
+            return Segment(PacketHeader(PacketType.PROBE_ACK, segment.header.seq_num))
+
+        # 1. connection end message
+        if segment.header.type == PacketType.END:
+            if self.closed:  # TIME_WAIT. END_ACK was lost, so sender sent END again
+                logger.debug('Duplicated END [%d] - resend END_ACK', segment.header.seq_num)
+                return Segment(PacketHeader(type=PacketType.END_ACK, seq_num=segment.header.seq_num))
+            if segment.header.seq_num != self.rcv_expected_seq_num:
+                logger.warning('END message [%d] - Transferring packet missed. Receiving not done yet',
+                               segment.header.seq_num)
+            self.rcv_expected_seq_num += 1
+            self.closed = True
+            self.ack_deadline = None  # END_ACK acknowledges every segment
+            logger.info('Transmission done - connection [%d] closed', self.conn_id)
+            return Segment(PacketHeader(type=PacketType.END_ACK, seq_num=segment.header.seq_num))
+
+        # 2. data messsage. nothing is written after END
+        if segment.header.type != PacketType.DATA or self.closed:
+            return None
+        self.stats.packets_received += 1
+
+        # over window - buffer is full of data not written yet, or sender does not respect the window.
+        # acknowledged with current window, which also answers zero window probe
+        window_end = self.rcv_expected_seq_num + self.receive_window()
+        if segment.header.seq_num >= window_end:
+            self.stats.dropped_out_of_window += 1
+            logger.debug('Dropped packet [%d] over window [%d ~ %d]', segment.header.seq_num,
+                         self.rcv_expected_seq_num, window_end)
+            return self._create_ack()
+
+        # out of order packet
+        if self.rcv_expected_seq_num != segment.header.seq_num:
+            if segment.header.seq_num < self.rcv_expected_seq_num:  # already received. its ACK was lost
+                self.stats.dropped_duplicate += 1
+                logger.debug('Dropped packet [%d] already received', segment.header.seq_num)
+            elif segment.header.seq_num in self.reorder_buffer:
+                self.stats.dropped_duplicate += 1
+                logger.debug('Dropped packet [%d] already buffered', segment.header.seq_num)
+            else: # in window size and newly received
+                logger.debug('New out of order packet buffered - seq_num [%d]', segment.header.seq_num)
+                # payload refers to receive buffer which is overwritten by next packet, so keep its copy
+                self.reorder_buffer.put(segment.header.seq_num, bytes(self._payload(segment)))
+            logger.debug('Sent ACK [%d] - missing data request', self.rcv_expected_seq_num)
+            return self._create_ack()  # send duplicated ACK
+
+        # correct order packet
+        self.received_bytes += self.sink.write(self._payload(segment))  # assemble
+        self.rcv_expected_seq_num += 1
+        gap_filled = self.rcv_expected_seq_num in self.reorder_buffer
+
+        # deliver buffered packets following it, until there is another missing packet
+        while self.rcv_expected_seq_num in self.reorder_buffer:
+            payload = self.reorder_buffer.pop(self.rcv_expected_seq_num)  # next packet
+            self.received_bytes += self.sink.write(payload)
+            self.rcv_expected_seq_num += 1
+        self.stats.bytes_delivered = self.received_bytes
+
+        # delay ACK only while there is no gap. sender recovering a loss needs to hear about it at once
+        if self.ack_every > 1 and not gap_filled and not self.reorder_buffer:
+            self._unacked_count += 1
+            if self._unacked_count < self.ack_every:
+                if self.ack_deadline is None:
+                    self.ack_deadline = time.monotonic() + self.ack_delay
+                return None
+        return self._create_ack()
+
+    def _payload(self, segment: Segment) -> Payload:
+        """
+        :return: data of DATA segment. decompressed if it has COMPRESSED flag
+        """
+        if segment.header.flags & PacketFlag.COMPRESSED:
+            return decompress(self.compression, segment.data)
+        return segment.data
+
+    def receive_window(self) -> int:
+        """
+        :return: packets receiver can take from rcv_expected_seq_num on - window_size minus in order data
+            handed to sink but not written yet. out of order packets are inside it already
+        """
+        unwritten = len(self.sink) if isinstance(self.sink, WriteBehindWriter) else 0
+        return max(self.window_size - unwritten, 0)
 
-from messages import PacketType
-from utility import UnreliableSocket, PacketHeader, byte_to_str, Segment, Address, verify_packet, str_to_byte
+    def window_update(self) -> Optional[Segment]:
+        """
+        invoked by transport while sink drains. window is not announced for every written chunk(silly window syndrome),
+        only after it opened by half of window_size since the last ACK
+        :return: ACK carrying opened window, None if it is not worth sending yet
+        """
+        if self.closed or self.receive_window() - self.advertised_window < max(self.window_size // 2, 1):
+            return None
+        logger.debug('Window update [%d] - was [%d]', self.receive_window(), self.advertised_window)
+        return self._create_ack()
+
+    def awaits_window_update(self) -> bool:
+        """
+        :return: True if window was advertised nearly closed while sink writes behind, so window_update() may be due
+        """
+        return not self.closed and isinstance(self.sink, WriteBehindWriter) \
+            and self.advertised_window + max(self.window_size // 2, 1) <= self.window_size
+
+    def _advertise(self) -> int:
+        """
+        :return: receive window to put in a reply header, remembered as the last advertised one
+        """
+        self.advertised_window = min(self.receive_window(), MAX_WINDOW)
+        return self.advertised_window
+
+    def flush_ack(self, now: float) -> Optional[Segment]:
+        """
+        invoked by transport when it wakes up, to send delayed ACK whose time has come
+        :param now: time.monotonic()
+        :return: ACK to send, None if no delayed ACK is due
+        """
+        if self.ack_deadline is None or now < self.ack_deadline:
+            return None
+        return self._create_ack()
+
+    def _create_ack(self) -> Segment:
+        """
+        Create cumulative ACK(seq_num of the next expected packet).
+        Payload carries SACK ranges of buffered out of order packets, so selective repeat sender does not resend them.
+        Ranges nearest to the expected seq_num are reported, as many as fit one default-sized segment of this connection
+        (transports send ACKs from buffers of SEGMENT_SIZE), the others are reported once the first ones are delivered.
+        """
+        self._unacked_count = 0  # cumulative ACK acknowledges every segment before it, delayed ones too
+        self.ack_deadline = None
+        self.stats.acks_sent += 1
+        header = PacketHeader(type=PacketType.ACK, seq_num=self.rcv_expected_seq_num, window=self._advertise())
+        max_ranges = (min(self.segment_size, SEGMENT_SIZE) - HEADER_SIZE) // SACK_RANGE_STRUCT.size
+        ranges = self.reorder_buffer.ranges(self.rcv_expected_seq_num + 1, max_ranges)
+        return Segment(header, encode_sack_ranges(ranges))
 
-SEGMENT_SIZE = 1472  # 1500 - 8(UDP header) - 20 (IP protocol)
-DATA_SIZE = 1456  # 1472 - 16(Packet Header size)
 
 class RDTSocket(UnreliableSocket):
     receiver_addr: Address  # ip, port
     sender_addr: Address  # ip, port
 
     window_size: int
+    mode: SenderMode
     window_boundary: Tuple[int, int]  # window boundary - (start, end + 1)
     sent_seq_num: int  # last sent pkt sequence number. last seq num of sender window
-    rcv_expected_seq_num: int  # pkt sequence number that receiver expected to receive next time.
-    out_of_order_pkts: list = []  # receiver buffer, stores out of order packets
-    buffered_pkt_seq_nums: set = set() # out of order packets seq nums set
-    total_data_bytes: bytes = b'' # sum of payloads
-    total_data: str = ''
+    conn_id: int  # connection id, chosen by sender. every packet of the connection carries it
+    receiver_connection: 'ReceiverConnection'  # receiver state of accepted connection
+    start_ack_options: Dict[int, int]  # HandshakeOption -> value receiver sent back in START_ACK
 
     connected: bool = False  # Is sender-receiver connection established?
 
-    timer: float = 0.5  # second
-
-    def __init__(self, window_size: int):
-        super().__init__()
-        # self.settimeout(self.timer) # socket timer setup. Later check again for case that did not get ACK message
-        self.sent_seq_num = -1
+    timer: float = 0.5  # second. initial retransmission timeout before first RTT sample
+    rto_estimator: RTOEstimator  # adaptive retransmission timeout. SRTT, RTTVAR, RTO
+    dup_ack_threshold: int = 3  # number of duplicated ACKs that triggers fast retransmit
+    congestion: CongestionControl  # decides how many packets of the window can be in flight
+    stats: TransferStats  # counters of sent, retransmitted, dropped packets, delivered bytes, RTT samples
+    ack_every: int  # receiver acknowledges every N in order segments(delayed ACK). 1 acknowledges every segment
+    ack_delay: float  # second. maximum delay of delayed ACK
+    checksum: ChecksumType  # asked for by sender until handshake, then the one agreed with receiver
+    compression: CompressionType  # asked for by sender until handshake, then the one agreed with receiver
+    compression_level: Optional[int]  # None for default level of the algorithm
+    max_segment_size: int  # largest datagram this socket sends or receives
+    segment_size: int  # largest datagram of current connection. agreed in handshake, lowered by path MTU probing
+    data_size: int  # payload size of full DATA segment
+    probe_mtu: bool  # sender probes path MTU after handshake
+    control_timeout: float  # second. connect() and close() give up if receiver does not answer within it
+    time_wait: float  # second. receiver keeps answering resent END this long after END(TIME_WAIT)
+    write_behind: bool  # receiver writes output in a thread, and advertises window shrunk by data not written yet
+    idle_timeout: float  # second. receiver gives up if sender sends nothing this long, sender if no ACK arrives
+    # this long. 0 to wait forever
+    peer_window: int  # receive window receiver advertised in START_ACK. sender window until the first ACK
+
+    def __init__(self, window_size: int, mode: SenderMode = SenderMode.GO_BACK_N,
+                 congestion: Union[str, CongestionControl] = 'fixed', impairment: Optional[ImpairmentConfig] = None,
+                 ack_every: int = 1, ack_delay: float = 0.01, checksum: ChecksumType = ChecksumType.CRC32,
+                 compression: CompressionType = CompressionType.NONE, compression_level: Optional[int] = None,
+                 segment_size: int = SEGMENT_SIZE, probe_mtu: bool = False, control_timeout: float = 10.0,
+                 time_wait: float = 1.0, write_behind: bool = False, idle_timeout: float = 120.0):
+        """
+        :param window_size: maximum number of packets in flight(sender, also limited by receive window receiver
+            advertises), receive window(receiver)
+        :param mode: sender retransmission mode
+        :param congestion: sender congestion control strategy name('fixed', 'aimd') or instance
+        :param impairment: simulated network impairments on received packets
+        :param ack_every: receiver sends one cumulative ACK per N in order segments. 1 disables delayed ACK
+        :param ack_delay: receiver sends delayed ACK at latest this long(second) after the segment it acknowledges
+        :param checksum: sender asks receiver for this algorithm. crc32 if receiver does not have it
+        :param compression: sender asks receiver for this algorithm. not compressed if receiver does not have it
+        :param compression_level: sender compression level
+        :param segment_size: largest datagram(header included) to send or receive. peers use the smaller one of theirs
+        :param probe_mtu: sender finds the largest datagram that reaches receiver unfragmented, up to agreed size
+        :param control_timeout: sender resends START / END with backoff, and raises socket.timeout after this long
+        :param time_wait: receiver answers END resent by sender(its END_ACK was lost) this long before recv returns
+        :param write_behind: receiver hands data to a writer thread, so slow output throttles sender through
+            advertised window instead of stalling receive loop
+        :param idle_timeout: receiver raises socket.timeout if no segment arrives from sender this long(second),
+            and sender if no ACK arrives from receiver this long while sending data, so a dead peer does not hang
+            either side forever. longer than maximum RTO, as a backing off sender is silent that long. 0 to wait forever
+        """
+        if checksum not in CHECKSUMS:
+            raise ValueError(f'Checksum [{ChecksumType(checksum).name}] not available - install crc32c package')
+        if compression != CompressionType.NONE and compression not in COMPRESSORS:
+            raise ValueError(f'Compression [{CompressionType(compression).name}] not available - install its package')
+        if not MIN_SEGMENT_SIZE <= segment_size <= MAX_SEGMENT_SIZE:
+            raise ValueError(f'Segment size [{segment_size}] out of range [{MIN_SEGMENT_SIZE} ~ {MAX_SEGMENT_SIZE}]')
+        super().__init__(impairment)
+        self.sent_seq_num = 0
         self.window_size = window_size
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.checksum = ChecksumType(checksum)
+        self.compression = CompressionType(compression)
+        self.compression_level = compression_level
+        self.max_segment_size = segment_size
+        self.probe_mtu = probe_mtu
+        self.control_timeout = control_timeout
+        self.time_wait = time_wait
+        self.write_behind = write_behind
+        self.idle_timeout = idle_timeout
+        self.peer_window = window_size
+        self.mode = SenderMode(mode)
+        self.rto_estimator = RTOEstimator(initial_rto=self.timer)
+        self.congestion = create_congestion_control(congestion, window_size)
         self.window_boundary = (0, self.window_size)
+        self.stats = TransferStats()
+        self.conn_id = 0
+        self._resize_buffers(segment_size)  # until handshake, any datagram up to max_segment_size is taken
+
+    def _resize_buffers(self, segment_size: int) -> None:
+        """
+        (Re)allocate send/receive buffers for datagrams up to segment_size
+        :param segment_size: largest datagram(header included)
+        """
+        self.segment_size = segment_size
+        self.data_size = segment_size - HEADER_SIZE
+        # a whole window arrives as one burst, so kernel receive buffer should hold it(linux doubles it for bookkeeping)
+        if self.window_size * segment_size > self.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2:
+            self.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.window_size * segment_size)
+        # preallocated datagram buffers. every packet is packed into / received into these, not into new bytes objects
+        # one slot per packet of the window, so a whole window is flushed or drained in one burst
+        self._send_buffer = bytearray(self.window_size * segment_size)
+        self._send_view = memoryview(self._send_buffer)
+        self._send_slots = [self._send_view[i:i + segment_size] for i in range(0, len(self._send_buffer), segment_size)]
+        self._recv_buffer = bytearray(self.window_size * segment_size)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._recv_slots = [self._recv_view[i:i + segment_size] for i in range(0, len(self._recv_buffer), segment_size)]
+
+    def _send_segment(self, segment: Segment, address) -> None:
+        """
+        Pack segment into the send buffer and send it without building intermediate bytes
+        :param segment: segment to send
+        :param address: destination address
+        """
+        segment.header.conn_id = self.conn_id
+        size = segment.pack_into(self._send_buffer, checksum=self.checksum)
+        self.sendto(self._send_view[:size], address)
+
+    def _send_segments(self, segments: List[Segment], address) -> None:
+        """
+        Pack segments into send buffer slots and flush them in bursts of at most window_size datagrams
+        :param segments: segments to send, in order
+        :param address: destination address
+        """
+        for start in range(0, len(segments), len(self._send_slots)):
+            datagrams = []
+            for slot, segment in zip(self._send_slots, segments[start:start + len(self._send_slots)]):
+                segment.header.conn_id = self.conn_id
+                datagrams.append(slot[:segment.pack_into(slot, checksum=self.checksum)])
+            self.sendto_many(datagrams, address)
+
+    def _recv_segments(self) -> List[Tuple[Segment, Address]]:
+        """
+        Wait for one datagram, then receive every datagram already readable(up to window_size) into receive buffer slots.
+        Corrupted datagrams are dropped in the buffer, before parsing.
+        Payloads of returned segments refer to the receive buffer, so they are valid only until next receive.
+        :return: parsed segments and their sender addresses, in arrival order. empty if every datagram was corrupted
+        """
+        segments = []
+        for slot, (size, addr) in zip(self._recv_slots, self.recvfrom_many(self._recv_slots)):
+            if self._verify(slot[:size]):
+                segments.append((Segment.from_bytes(slot[:size]), addr))
+        return segments
 
-    def accept(self) -> Address:
+    def _verify(self, datagram: memoryview) -> bool:
+        """
+        :param datagram: received datagram
+        :return: True if intact. corrupted one is counted and logged
+        """
+        if verify_packet(datagram, self.checksum):
+            return True
+        self.stats.dropped_corrupt += 1
+        logger.debug('Data Corrupted. Drop Packet')
+        return False
+
+    def _sample_rtt(self, rtt: float) -> None:
+        """
+        :param rtt: round trip time(second) of a packet sent only once
+        """
+        self.rto_estimator.sample(rtt)
+        self.stats.add_rtt(rtt)
+
+    def _recv_segment(self) -> Tuple[Segment, Address]:
+        """
+        Receive one intact datagram into the receive buffer and parse it in place. corrupted ones are dropped.
+        Payload of returned segment refers to the receive buffer, so copy it before receiving next segment if needed.
+        :return: parsed segment, sender address
+        """
+        while True:
+            size, addr = self.recvfrom_into(self._recv_buffer)
+            if self._verify(self._recv_view[:size]):
+                return Segment.from_bytes(self._recv_view[:size]), addr
+
+    def accept(self, on_start: Optional[Callable[[Dict[int, int]], Dict[int, int]]] = None) -> Address:
         """
         TCP-like accept function
         invoked by "receiver" to establish connections with the sender
         Wait until getting START message
+        :param on_start: called with START options, returns options to add to START_ACK. ex) resume offset
         """
-        print('Waiting connection request...')
+        logger.info('Waiting connection request...')
         while True:
-            segment_bytes, addr = self.recvfrom(SEGMENT_SIZE)
-            print(f"Received packet from {addr}")
-            segment = Segment.from_bytes(segment_bytes)
+            segment, addr = self._recv_segment()
+            logger.debug('Received packet from %s', addr)
             if segment.header.type == PacketType.START:
                 break
-            print(f"Connection not established yet : dropped [{segment.header.type}] [{segment.header.seq_num}] [{segment.data}]")
+            logger.debug('Connection not established yet : dropped [%d] [%d]', segment.header.type, segment.header.seq_num)
 
         # Got START message
         # create START_ACK message
-        self.rcv_expected_seq_num = 1
-        header = PacketHeader(PacketType.ACK, segment.header.seq_num)  # Set START_ACK seq_num same with START msg
-        payload = ''
-        packet = Segment(header, payload)
-        self.sendto(packet.to_bytes(), addr)
-        print('Sent START_ACK message to sender - connection established')
+        self.conn_id = segment.header.conn_id
+        self.receiver_connection = ReceiverConnection(addr, self.conn_id, self.window_size,
+                                                      ack_every=self.ack_every, ack_delay=self.ack_delay,
+                                                      stats=self.stats, on_start=on_start,
+                                                      max_segment_size=self.max_segment_size)
+        self._send_segment(self.receiver_connection.on_segment(segment), addr)
+        self.checksum = self.receiver_connection.checksum
+        self._resize_buffers(self.receiver_connection.segment_size)
+        logger.info('Sent START_ACK message to %s - connection established, checksum [%s], segment size [%d]', addr,
+                    self.checksum.name, self.segment_size)
 
         self.connected = True
         return addr
 
-    def connect(self, address: Address) -> None:
+    def connect(self, address: Address, options: Optional[Dict[int, int]] = None) -> None:
         """
         TCP-like connect function
         invoked by "sender" to initiate connection request with the receiver
-        Send START message
-        Waiting for ACK
-        Checking seq_num of ACK message should be the same with that of START message
+        Send START message, asking for checksum algorithm
+        Waiting for START_ACK, carrying algorithm receiver agreed. START is resent every RTO(with backoff)
+        Checking seq_num of START_ACK message should be the same with that of START message
+        :param address: receiver address
+        :param options: extra HandshakeOption -> value for receiver. ex) stripe offset. receiver_connection.options
+            receiver answers in start_ack_options
+        :raise socket.timeout: no START_ACK within control_timeout
         """
-        print(f'Try to connect with {address}...')
+        logger.info('Try to connect with %s...', address)
         self.receiver_addr = address
         # create & send connection request packet
         random_seq_num = random.randint(1, 100)
+        self.conn_id = random.getrandbits(32)
         header = PacketHeader(type=PacketType.START, seq_num=random_seq_num)
-        packet = Segment(header, '')
-        self.sendto(packet.to_bytes(), self.receiver_addr)
-
-        while True:
-            segment_bytes, sender_addr = self.recvfrom(SEGMENT_SIZE)
-            segment = Segment.from_bytes(segment_bytes)
-            if not verify_packet(segment):
-                # Drop and do not send ACK
-                print(f'seq_num [{segment.header.seq_num}] - Data Corrupted. Drop Packet')
-                continue
+        packet = Segment(header, encode_options({**(options or {}), HandshakeOption.CHECKSUM: self.checksum,
+                                                 HandshakeOption.COMPRESSION: self.compression,
+                                                 HandshakeOption.SEGMENT_SIZE: self.max_segment_size}))
+        segment, sender_addr = self._request(packet, PacketType.START_ACK)
+
+        self.start_ack_options = decode_options(segment.data)
+        self.checksum = ChecksumType(self.start_ack_options.get(HandshakeOption.CHECKSUM, ChecksumType.CRC32))
+        self.compression = CompressionType(self.start_ack_options.get(HandshakeOption.COMPRESSION,
+                                                                      CompressionType.NONE))
+        segment_size = self.start_ack_options.get(HandshakeOption.SEGMENT_SIZE, SEGMENT_SIZE)
+        self.peer_window = segment.header.window or self.window_size  # 0 from receiver that does not advertise
+        logger.info('Connection established. checksum [%s], compression [%s], segment size [%d]',
+                    self.checksum.name, self.compression.name, segment_size)
+        self.connected = True
+        self.sender_addr = sender_addr
+        self._resize_buffers(min(segment_size, self.max_segment_size))
+        if self.probe_mtu:
+            self._probe_segment_size()
 
-            if segment.header.type == PacketType.ACK and segment.header.seq_num == random_seq_num:
-                print('Connection established.')
-                self.connected = True
-                self.sender_addr = sender_addr
-                break
+    def _request(self, segment: Segment, reply_type: PacketType) -> Tuple[Segment, Address]:
+        """
+        Send control message to receiver and wait for its reply, resend it every RTO(with exponential backoff)
+        :param segment: control message
+        :param reply_type: expected reply type. reply seq_num must be same with control message
+        :return: reply, its sender address. reply payload refers to the receive buffer
+        :raise socket.timeout: no reply within control_timeout
+        """
+        deadline = time.monotonic() + self.control_timeout
+        rto = self.rto_estimator.base_rto  # new timer. backoff of lost DATA is not carried over
+        try:
+            while True:
+                self._send_segment(segment, self.receiver_addr)
+                resend_time = min(time.monotonic() + rto, deadline)
+                while True:
+                    self.settimeout(max(resend_time - time.monotonic(), 0))
+                    try:
+                        received = self._recv_segments()
+                    except (socket.timeout, BlockingIOError):  # timeout 0 makes socket non-blocking
+                        break
+                    for reply, addr in received:
+                        if reply.header.type == reply_type and reply.header.seq_num == segment.header.seq_num \
+                                and reply.header.conn_id == self.conn_id:
+                            return reply, addr
+                        logger.debug('Drop packet - packet type [%d], not %s', reply.header.type, reply_type.name)
+                if time.monotonic() >= deadline:
+                    raise socket.timeout(f'No [{reply_type.name}] from {self.receiver_addr} '
+                                         f'in {self.control_timeout} seconds')
+                rto = min(rto * 2, self.rto_estimator.max_rto)
+                self.stats.timeouts += 1
+                logger.debug('Timeout error - resend [%s], next timeout [%f]', PacketType(segment.header.type).name, rto)
+        finally:
+            self.settimeout(None)
+
+    def _probe_segment_size(self) -> None:
+        """
+        Find the largest datagram that reaches receiver without fragmentation, up to agreed segment size,
+        and use it as segment size. Datagrams are sent with DF bit, so too big one fails locally or is lost on the path.
+        Binary search from the route MTU kernel knows. each probe is tried twice, so a random loss is not taken as
+        too big.
+        """
+        if not self.set_dont_fragment():
+            logger.info('Path MTU probing not supported on this platform. segment size [%d]', self.segment_size)
+            return
+        low, high = MIN_SEGMENT_SIZE, self.segment_size
+        address = self.receiver_addr
+        route_mtu = self.route_mtu((address.ip, address.port) if isinstance(address, Address) else address)
+        if route_mtu:
+            high = max(min(high, route_mtu - IP_UDP_HEADER_SIZE), low)
+        if self._probe(high):
+            low = high
+        while low < high:
+            size = (low + high + 1) // 2
+            if self._probe(size):
+                low = size
             else:
-                print(f'Drop packet - packet type [{segment.header.type}], not START_ACK')
+                high = size - 1
+        self.settimeout(None)
+        self._resize_buffers(low)
+        logger.info('Path MTU probed - segment size [%d]', self.segment_size)
+
+    def _probe(self, size: int, attempts: int = 2) -> bool:
+        """
+        :param size: datagram size to probe
+        :param attempts: number of probes before giving up
+        :return: True if receiver acknowledged a probe of size bytes
+        """
+        for seq_num in range(attempts):
+            probe = Segment(PacketHeader(type=PacketType.PROBE, seq_num=seq_num), bytes(size - HEADER_SIZE))
+            try:
+                self._send_segment(probe, self.receiver_addr)
+            except OSError as error:  # over MTU of local interface or known path MTU
+                if error.errno == errno.EMSGSIZE:
+                    return False
+                raise
+            deadline = time.monotonic() + self.rto_estimator.rto
+            while True:
+                self.settimeout(max(deadline - time.monotonic(), 0))
+                try:
+                    received = self._recv_segments()
+                except (socket.timeout, BlockingIOError):  # timeout 0 makes socket non-blocking
+                    break
+                if any(reply.header.type == PacketType.PROBE_ACK and reply.header.seq_num == seq_num
+                       and reply.header.conn_id == self.conn_id for reply, _ in received):
+                    return True
+        return False
 
 
-    def send(self, data: str):
+    def send(self, data: Union[Payload, str]):
         """
         invoked by sender to transmit data to the receiver
         1. split input data into appropriately sized chunks of data
-        2. append a checksum(calculated by 'compute_checksum()' in utility.py) to each packet
+        2. append a checksum(algorithm agreed in connect()) covering header and data to each packet, when it is packed
         3. seq_num should increment by one for each additional segment in a connection.
+        :param data: binary data to send. str is encoded to utf-8 once.
+        """
+        if isinstance(data, str):
+            data = str_to_byte(data)
+        data_view = memoryview(data)
+        # each payload is a memoryview slice of data, not a copy
+        payloads = (data_view[i:i + self.data_size] for i in range(0, len(data_view), self.data_size))
+        self._send_payloads(payloads)
+
+    def send_stream(self, fileobj: BinaryIO, length: Optional[int] = None):
+        """
+        invoked by sender to transmit a binary file to the receiver
+        file is read lazily chunk by chunk, so only packets in flight are kept in memory
+        :param fileobj: file object opened in binary read mode
+        :param length: bytes to send from current file position. until end of file if None
+        """
+        if length is None:
+            payloads = iter(lambda: fileobj.read(self.data_size), b'')
+        else:
+            payloads = (fileobj.read(min(self.data_size, length - offset))
+                        for offset in range(0, length, self.data_size))
+        self._send_payloads(payloads)
+
+    def _send_payloads(self, payloads: Iterator[Payload]):
+        """
+        Send payloads in order, as DATA segments. seq_num starts from 1.
+        Segment is created when it gets into the window and released when it is acknowledged.
+        :param payloads: payloads of at most data_size bytes
+        :raise socket.timeout: no ACK from receiver within idle_timeout
         """
         if not self.connected or not self.receiver_addr:
-            print('Connection not established yet.')
+            logger.error('Connection not established yet.')
             return
-
-        data_bytes = str_to_byte(data)
-
-        # split whole data to chunks
-        chunks = []
-        segment_count = 0
-        for i in range(0, len(data_bytes), DATA_SIZE):
-            segment_count += 1
-            header = PacketHeader(type=PacketType.DATA, seq_num=segment_count)
-            data = byte_to_str(data_bytes[i:i + DATA_SIZE])
-            segment = Segment(header, data)
-            chunks.append(segment)
-        last_ack_num = 1
-
-        # send chunks in order
-        while last_ack_num <= chunks[-1].header.seq_num:
-            window = chunks[self.window_boundary[0] : self.window_boundary[1]]
-            for chunk in window:
-                self.sendto(chunk.to_bytes(), self.receiver_addr)
-                self.sent_seq_num += 1
-                print(f'Sent chunk seq_num [{chunk.header.seq_num}]')
-
-            last_ack_time = time.time()
-            window_ack_count = 0
-            while window_ack_count < self.window_size and len(chunks) > self.window_boundary[0]:
-                if time.time() - last_ack_time > self.timer:
-                    print('Timeout error')
-                    # break and go to outer while loop(send whole unacknowledged window packets again)
+        if self.compression == CompressionType.NONE:
+            encoded = ((payload, 0) for payload in payloads)
+        else:  # (payload, PacketFlag) - consecutive payloads joined and compressed into one
+            compressor = PayloadCompressor(self.compression, self.data_size, self.compression_level, self.stats)
+            encoded = compressor.payloads(payloads)
+
+        chunks: Dict[int, Segment] = {}  # in flight seq_num -> segment
+        end_of_data = False
+        base = 1  # oldest unacknowledged seq_num. sender window is [base, base + window_size)
+        next_seq_num = 1  # seq_num of the next new chunk to send
+        window_end = 1 + self.peer_window  # receive window end. nothing from it on is sent, but a zero window probe
+        send_times: Dict[int, float] = {}  # per packet timers. in flight seq_num -> last sent time
+        retransmitted: Set[int] = set()  # in flight seq_nums sent more than once. no RTT sample from them(Karn's rule)
+        sacked: Set[int] = set()  # in flight seq_nums selectively acknowledged by receiver
+        resend: Set[int] = set()  # in flight seq_nums lost by timeout, resent as congestion window allows
+        dup_ack_count = 0
+        gbn_timer_start = time.monotonic()  # go-back-n uses one timer, restarted when window moves forward
+        last_ack_time = gbn_timer_start  # receiver is given up idle_timeout after its last ACK
+        probe_due = False  # receive window stayed closed with nothing in flight for RTO(persist timer)
+
+        while not end_of_data or base < next_seq_num:
+            # resend chunks lost by timeout first, as many as congestion window(shrunk by the timeout) allows,
+            # oldest first. the rest waits until ACKs open the window again, instead of going out in one burst
+            if resend:
+                resend = {seq_num for seq_num in resend if seq_num >= base and seq_num not in sacked}
+                due = sorted(seq_num for seq_num in resend if seq_num < base + self.congestion.window)
+                if due:
+                    now = time.monotonic()
+                    self._send_segments([chunks[seq_num] for seq_num in due], self.receiver_addr)
+                    self.stats.packets_sent += len(due)
+                    self.stats.packets_retransmitted += len(due)
+                    for seq_num in due:
+                        send_times[seq_num] = now
+                    resend.difference_update(due)
+                    logger.debug('Resent chunks %s, %d waiting for window', due, len(resend))
+
+            # send new chunks until window(limited by congestion window and receive window) is full, in one burst.
+            # receive window closed with nothing in flight and no window update in RTO - send one chunk anyway
+            # as zero window probe. it is resent on timeout with backoff until an ACK opens the window
+            burst = []
+            while not end_of_data and next_seq_num < base + self.congestion.window \
+                    and (next_seq_num < window_end or probe_due):
+                payload, flags = next(encoded, (None, 0))
+                if not payload:
+                    end_of_data = True
                     break
-                segment_bytes, sender = self.recvfrom(SEGMENT_SIZE)
-                segment = Segment.from_bytes(segment_bytes)
+                if next_seq_num >= window_end:
+                    self.stats.window_probes += 1
+                    probe_due = False
+                header = PacketHeader(type=PacketType.DATA, seq_num=next_seq_num, flags=flags)
+                chunks[next_seq_num] = Segment(header, payload)
+                burst.append(chunks[next_seq_num])
+                next_seq_num += 1
+            if burst:
+                now = time.monotonic()
+                self._send_segments(burst, self.receiver_addr)
+                for segment in burst:
+                    send_times[segment.header.seq_num] = now
+                self.stats.packets_sent += len(burst)
+                logger.debug('Sent chunks seq_num [%d~%d]', burst[0].header.seq_num, burst[-1].header.seq_num)
+            if base == next_seq_num and end_of_data:  # end of data found after every packet was acknowledged
+                break
 
-                if segment.header.type != PacketType.ACK:
-                    print('Drop packet - Not ACK type')
+            # wait ACK until the earliest timer expires
+            rto = self.rto_estimator.rto
+            if self.mode == SenderMode.SELECTIVE_REPEAT:
+                unsacked_times = [sent_time for seq_num, sent_time in send_times.items()
+                                  if seq_num not in sacked and seq_num not in resend]
+                deadline = min(unsacked_times, default=time.monotonic()) + rto
+            else:
+                deadline = gbn_timer_start + rto
+            if self.idle_timeout:
+                deadline = min(deadline, last_ack_time + self.idle_timeout)
+            self.settimeout(max(deadline - time.monotonic(), 0))
+            try:
+                received = self._recv_segments()  # every ACK arrived so far
+            except (socket.timeout, BlockingIOError):  # timeout 0 makes socket non-blocking
+                now = time.monotonic()
+                if self.idle_timeout and now - last_ack_time >= self.idle_timeout:
+                    self.settimeout(None)
+                    self.connected = False
+                    raise socket.timeout(f'No ACK from {self.receiver_addr} for {self.idle_timeout} seconds - '
+                                         f'{base - 1} of {next_seq_num - 1} packets acknowledged')
+                if base == next_seq_num:  # persist timer. nothing to resend, receive window is still closed
+                    probe_due = True
+                    gbn_timer_start = now
                     continue
+                if self.mode == SenderMode.SELECTIVE_REPEAT:
+                    # resend only expired packets, not the whole window
+                    expired = [seq_num for seq_num, sent_time in send_times.items()
+                               if seq_num not in sacked and seq_num not in resend and now - sent_time >= rto]
+                    if not expired:  # every packet in flight is selectively acknowledged, but base is not
+                        expired = [base]
+                else:
+                    # resend whole unacknowledged window packets again
+                    expired = list(send_times)
+                    gbn_timer_start = now
+                self.rto_estimator.on_timeout()
+                if base < window_end:  # zero window probe is not lost for congestion
+                    self.congestion.on_timeout()
+                logger.debug('Timeout error - resend %s, %s', expired, self.rto_estimator)
+                self.stats.timeouts += 1
+                resend.update(expired)  # sent at the top of the loop, within congestion window
+                retransmitted.update(expired)
+                continue
 
-                # Right next ack received 0 - window moves forward
-                if segment.header.seq_num == last_ack_num + 1:
-                    last_ack_time = time.time()  # so update timer
-                    last_ack_num += 1
-                    self.window_boundary = (self.window_boundary[0]+1, self.window_boundary[1]+1)
-                    print(f'Received ACK [{segment.header.seq_num}] - window moves forward [({self.window_boundary[0]}~{self.window_boundary[1]})]')
-                    window_ack_count += 1
+            now = time.monotonic()
+            previous_base = base
+            for segment, sender in received:
+                if segment.header.type != PacketType.ACK or segment.header.conn_id != self.conn_id:
+                    logger.debug('Drop packet - Not ACK of this connection')
+                    continue
+                self.stats.acks_received += 1
+                last_ack_time = now
+
+                # ACK seq_num is cumulative - every packet before it is received. window moves forward
+                ack_num = segment.header.seq_num
+                previous_window_end = window_end
+                if ack_num <= next_seq_num:  # receive window end never moves back, even with reordered ACKs
+                    window_end = max(window_end, ack_num + segment.header.window)
+                if base < ack_num <= next_seq_num:
+                    acked = range(base, ack_num)
+                    # sample RTT only when ACK is not ambiguous - no packet in acked range was resent or acknowledged before
+                    if not any(seq_num in retransmitted or seq_num in sacked for seq_num in acked):
+                        self._sample_rtt(now - send_times[ack_num - 1])
+                    for seq_num in acked:
+                        del chunks[seq_num]
+                        send_times.pop(seq_num, None)
+                        retransmitted.discard(seq_num)
+                        sacked.discard(seq_num)
+                    base = ack_num
+                    dup_ack_count = 0
+                    gbn_timer_start = now  # so update timer
+                    self.congestion.on_ack(len(acked), ack_num, next_seq_num)
+                elif ack_num == base and window_end != previous_window_end:
+                    # window update, not a sign of loss. zero window probe it answers was dropped, so resend it now
+                    logger.debug('Window update - receive window [%d~%d]', ack_num, window_end)
+                    if previous_window_end <= base < min(window_end, next_seq_num):
+                        resend.discard(base)
+                        self._send_segment(chunks[base], self.receiver_addr)
+                        self.stats.packets_sent += 1
+                        self.stats.packets_retransmitted += 1
+                        send_times[base] = now
+                        retransmitted.add(base)
+                elif ack_num == base and base < next_seq_num:
+                    dup_ack_count += 1
+                    self.stats.duplicate_acks += 1
+                    logger.debug('Duplicated ACK [%d] - count [%d]', ack_num, dup_ack_count)
+                    # fast retransmit - receiver got 3 more packets after base, so base is lost rather than delayed
+                    if dup_ack_count == self.dup_ack_threshold and base not in sacked:
+                        logger.debug('Fast retransmit [%d]', base)
+                        self.congestion.on_fast_retransmit()
+                        resend.discard(base)
+                        self._send_segment(chunks[base], self.receiver_addr)
+                        self.stats.fast_retransmits += 1
+                        self.stats.packets_sent += 1
+                        self.stats.packets_retransmitted += 1
+                        send_times[base] = now
+                        retransmitted.add(base)
                 else:
-                    print(f'Drop ACK packet - expected[{last_ack_num + 1}], but got [{segment.header.seq_num}]')
+                    self.stats.dropped_out_of_window += 1
+                    logger.debug('Drop ACK packet - out of window [%d]', ack_num)
+
+                # selectively acknowledged packets are received but out of order. stop their timers not to resend them
+                if self.mode == SenderMode.SELECTIVE_REPEAT:
+                    for start, end in decode_sack_ranges(segment.data):
+                        for seq_num in range(max(start, base), min(end, next_seq_num)):
+                            if seq_num in sacked:
+                                continue
+                            sacked.add(seq_num)
+                            if seq_num not in retransmitted:
+                                self._sample_rtt(now - send_times[seq_num])
+
+            if base != previous_base:  # one log line per drained batch, not per ACK
+                self.window_boundary = (base - 1, base - 1 + self.congestion.window)
+                logger.debug('Received ACK [%d] - window moves forward [(%d~%d)]', base, *self.window_boundary)
 
-        print('Transmitting data done')
+        self.settimeout(None)
+        self.sent_seq_num = next_seq_num - 1
+        logger.info('Transmitting data done')
 
 
     def recv(self):
+        """
+        invoked by the receiver to receive data from the sender
+        whole data is kept in memory. use recv_into() for big files.
+        :return: received binary data
+        """
+        buffer = io.BytesIO()
+        if self.recv_into(buffer) is None:
+            return
+        return buffer.getvalue()
+
+    def recv_into(self, fileobj: BinaryIO):
         """
         invoked by the receiver to receive data from the sender
         1. reassemble the chunks
-        2. check integrity of the segments by verify_packet() function in utility.py
+        2. check integrity of the segments by verify_packet() function in utility.py, straight from receive buffer
             - If calculated checksum does not match with header checksum, then drop packet(do not send ACK)
-        3. pass the message back to the application process
-        Drop all packets which seq_num >= EXPECTED_SEQ_NUM + WINDOW_SIZE to maintain window size window.
-        :return:
+        3. pass the message back to the application process - in order data is written to fileobj as soon as it arrives
+            (or queued to a writer thread with write_behind, and written before return)
+        Drop all packets which seq_num >= EXPECTED_SEQ_NUM + receive window, advertised in every ACK.
+        :param fileobj: file object opened in binary write mode
+        :return: number of received bytes
+        :raise socket.timeout: no segment from sender for idle_timeout seconds
         """
         if not self.connected or not self.sender_addr:
-            print('Connection is not established properly yet. Cannot receive data')
+            logger.error('Connection is not established properly yet. Cannot receive data')
             return
 
-        # Receive all segments and assemble
-
-        while True:
-            segment_bytes, sender = self.recvfrom(SEGMENT_SIZE)
-            segment = Segment.from_bytes(segment_bytes)
-            if not verify_packet(segment):
-                # Drop and do not send ACK
-                print(f'seq_num [{segment.header.seq_num}] - Data Corrupted. Drop Packet')
-                continue
-
-            # Received uncorrupted packet
-
-            # 1. connection end message
-            if segment.header.type == PacketType.END:
-                if segment.header.seq_num != self.rcv_expected_seq_num:
-                    print(f'Drop END message packet [{segment.header.seq_num}] - Transferring packet missed. Receiving not done yet')
-                header = PacketHeader(type=PacketType.END_ACK, seq_num=segment.header.seq_num)
-                segment = Segment(header, '')
-                self.sendto(segment.to_bytes(), self.sender_addr)
-
-                self.rcv_expected_seq_num += 1
-                self.connected = False
-                print('Transmission done - connection closed')
-                break  # The only way to break the whole loop - receiving done, connection closed
-
-            # 2. data messsage
-            elif segment.header.type == PacketType.DATA:
-                # out of order packet
-                if self.rcv_expected_seq_num != segment.header.seq_num:
-                    if segment.header.seq_num >= self.rcv_expected_seq_num + self.window_size: # over window size
-                        print(f'Dropped packet [{segment.header.seq_num}] over window [{self.rcv_expected_seq_num} ~ {self.rcv_expected_seq_num + self.window_size}]')
-                        continue
-                    elif segment.header.seq_num in self.buffered_pkt_seq_nums:
-                        print(f'Dropped packet [{segment.header.seq_num}] already buffered')
-                        continue
-                    else: # in window size and newly received
-                        print(f'New out of order packet buffered - seq_num [{segment.header.seq_num}]')
-                        self.out_of_order_pkts.append(segment)
-                        self.buffered_pkt_seq_nums.add(segment.header.seq_num)
-                        header = PacketHeader(type=PacketType.ACK, seq_num=self.rcv_expected_seq_num) # send duplicated ACK
-                        segment = Segment(header, '')
-                        self.sendto(segment.to_bytes(), self.sender_addr)
-                        print(f'Sent ACK{self.rcv_expected_seq_num} - missing data request')
-                # correct order packet
+        # Receive all segments and write them in order
+        connection = self.receiver_connection
+        connection.sink = WriteBehindWriter(fileobj) if self.write_behind else fileobj
+
+        try:
+            while not connection.closed:
+                # wake up for pending delayed ACK, and now and then while window update may be due
+                wake_times = [] if connection.ack_deadline is None else [connection.ack_deadline]
+                if connection.awaits_window_update():
+                    wake_times.append(time.monotonic() + self.ack_delay)
+                if self.idle_timeout:
+                    wake_times.append(connection.last_heard + self.idle_timeout)
+                if wake_times:
+                    self.settimeout(max(min(wake_times) - time.monotonic(), 0))
                 else:
-                    self.total_data_bytes += segment.data.encode() # assemble
-                    self.rcv_expected_seq_num += 1
-                    self.out_of_order_pkts.sort(key=lambda segment: segment.header.seq_num)
-
-                    while self.out_of_order_pkts:
-                        # there is another missing pkt in out of order packets
-                        if self.out_of_order_pkts[0].header.seq_num != self.rcv_expected_seq_num:
-                            break
-
-                        pkt = self.out_of_order_pkts.pop()  # next packet
-                        self.total_data_bytes += bytes(pkt.data)
-                        self.rcv_expected_seq_num += 1
-
-                    header = PacketHeader(type=PacketType.ACK, seq_num=self.rcv_expected_seq_num)
-                    segment = Segment(header, '')
-                    self.sendto(segment.to_bytes(), self.sender_addr)
-                    print(f'Sent ACK [{segment.header.seq_num}] - missing data found, not normalized')
-
-        self.total_data = byte_to_str(self.total_data_bytes)
-        return self.total_data
+                    self.settimeout(None)
+                try:
+                    received = self._recv_segments()
+                except (socket.timeout, BlockingIOError):  # timeout 0 makes socket non-blocking
+                    received = []
+
+                # handle every datagram arrived so far, then send their ACKs in one burst
+                replies = []
+                for segment, sender in received:
+                    if sender != connection.addr or segment.header.conn_id != connection.conn_id:
+                        logger.debug('Drop packet from %s - not a packet of current connection', sender)
+                        continue
+                    reply = connection.on_segment(segment)
+                    if reply:
+                        replies.append(reply)
+                    if connection.closed:
+                        break
+                delayed_ack = connection.flush_ack(time.monotonic()) or connection.window_update()
+                if delayed_ack:
+                    replies.append(delayed_ack)
+                if replies:
+                    self._send_segments(replies, connection.addr)
+                    logger.debug('Sent ACK [%d] - %d ACKs in burst', connection.rcv_expected_seq_num, len(replies))
+                if self.idle_timeout and time.monotonic() - connection.last_heard >= self.idle_timeout:
+                    self.settimeout(None)
+                    self.connected = False
+                    raise socket.timeout(f'No segment from sender for {self.idle_timeout} seconds - '
+                                         f'{connection.received_bytes} bytes received')
+        finally:
+            if isinstance(connection.sink, WriteBehindWriter):
+                connection.sink.close()  # every queued chunk is written before returning
+
+        self._linger(connection)
+        self.settimeout(None)
+        self.connected = False
+        return connection.received_bytes
+
+    def _linger(self, connection: ReceiverConnection) -> None:
+        """
+        TIME_WAIT of receiver. END_ACK may be lost, and sender resends END until it gets one,
+        so keep answering END of the closed connection until no END arrives for time_wait seconds
+        :param connection: closed connection
+        """
+        deadline = time.monotonic() + self.time_wait
+        while time.monotonic() < deadline:
+            self.settimeout(max(deadline - time.monotonic(), 0))
+            try:
+                received = self._recv_segments()
+            except (socket.timeout, BlockingIOError):  # timeout 0 makes socket non-blocking
+                break
+            replies = [connection.on_segment(segment) for segment, sender in received
+                       if sender == connection.addr and segment.header.conn_id == connection.conn_id]
+            replies = [reply for reply in replies if reply]
+            if replies:
+                self._send_segments(replies, connection.addr)
+                deadline = time.monotonic() + self.time_wait  # restart timer, the same as TCP on resent FIN
 
     def close(self):
         """
         invoked by the sender to terminate the connection between the sender and the receiver.
-        Send END message and then wait for ACK.
+        Send END message and then wait for ACK. END is resent every RTO(with backoff)
         seq_num of ACK message should be the same with that of END message.
-        After all, connection is closed.
-        :return:
+        After all, connection is closed, and so is the UDP socket even if receiver did not answer.
+        :raise socket.timeout: no END_ACK within control_timeout
         """
         # create & send connection request packet
         header = PacketHeader(PacketType.END, seq_num=self.sent_seq_num + 1)
-        end_msg = Segment(header, '')
-        self.sendto(end_msg.to_bytes(), self.receiver_addr)
+        end_msg = Segment(header)
         self.sent_seq_num += 1
+        try:
+            self._request(end_msg, PacketType.END_ACK)
+        finally:
+            self.connected = False
+            super().close()
 
-        while True:
-            segment_bytes, sender = self.recvfrom(SEGMENT_SIZE)
-            segment = Segment.from_bytes(segment_bytes)
-            if not verify_packet(segment):
-                # Drop and do not send ACK
-                print(f'seq_num [{segment.header.seq_num}] - Data Corrupted. Drop Packet')
-                continue
-
-            if segment.header.type == PacketType.END_ACK and segment.header.seq_num == self.sent_seq_num:
-                break
-            else:
-                print(f'Drop packet - packet type [{segment.header.type}], not END_ACK')
-
-        print('Transmitting is done. Connection closed.')
+        logger.info('Transmitting is done. Connection closed.')
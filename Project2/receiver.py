@@ -1,21 +1,56 @@
 import argparse
+import logging
+import sys
 
-from utility import byte_to_str
+from impairment import ImpairmentConfig
 from rdt_socket import RDTSocket
+from striping import receive_striped
+from utility import Address
 
 parser = argparse.ArgumentParser(description='Client')
 parser.add_argument('-p', '--receiver_port', help='Receiver port')
 parser.add_argument('-ws', '--window_size', help='Window size')
+parser.add_argument('-imp', '--impairment', help='Simulated impairments on received packets. ex) loss=0.05,delay=0.01,seed=1', default='')
+parser.add_argument('-f', '--file', help='File path to write received data', default='./download.txt')
+parser.add_argument('-ae', '--ack_every', help='Delayed ACK - send one ACK per N in order packets', default='1')
+parser.add_argument('-ad', '--ack_delay', help='Maximum delay(second) of delayed ACK', default='0.01')
+parser.add_argument('-ss', '--segment_size', help='Largest datagram to receive. ex) 65507 on loopback', default='1472')
+parser.add_argument('-st', '--streams', help='Receive file striped over N connections on ports p ~ p + N - 1', default='1')
+parser.add_argument('-rs', '--resume', help='Checkpoint received ranges in <file>.extents, resume from them', action='store_true')
+parser.add_argument('-wb', '--write_behind', help='Write file in a thread. slow disk shrinks window advertised to sender', action='store_true')
+parser.add_argument('-tw', '--time_wait', help='Seconds to keep answering END after transfer, in case END_ACK was lost', default='1')
+parser.add_argument('-it', '--idle_timeout', help='Give up if sender sends nothing for N seconds. 0 to wait forever', default='120')
+parser.add_argument('-l', '--log_level', help='Logging level. DEBUG shows every packet', default='INFO')
 
 args = parser.parse_args()
 RECEIVER_PORT = int(args.receiver_port)
 WINDOW_SIZE = int(args.window_size)
+IMPAIRMENT = ImpairmentConfig.parse(args.impairment) if args.impairment else None
+FILE_PATH = args.file
+ACK_EVERY = int(args.ack_every)
+ACK_DELAY = float(args.ack_delay)
+SEGMENT_SIZE = int(args.segment_size)
+STREAMS = int(args.streams)
+RESUME = args.resume
+TIME_WAIT = float(args.time_wait)
+WRITE_BEHIND = args.write_behind
+IDLE_TIMEOUT = float(args.idle_timeout)
+logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
 
+if STREAMS > 1 or RESUME:  # one process per stripe, each writes its own range of FILE_PATH
+    stripe_stats = receive_striped(Address('127.0.0.1', RECEIVER_PORT), FILE_PATH, STREAMS, WINDOW_SIZE,
+                                   processes=STREAMS > 1, resume=RESUME, impairment=IMPAIRMENT,
+                                   ack_every=ACK_EVERY, ack_delay=ACK_DELAY, segment_size=SEGMENT_SIZE,
+                                   time_wait=TIME_WAIT, write_behind=WRITE_BEHIND, idle_timeout=IDLE_TIMEOUT)
+    for i, stats in enumerate(stripe_stats):
+        logging.info('Stripe [%d] receiver stats %s', i, stats)
+    sys.exit(0)
 
-socket = RDTSocket(WINDOW_SIZE)
+socket = RDTSocket(WINDOW_SIZE, impairment=IMPAIRMENT, ack_every=ACK_EVERY, ack_delay=ACK_DELAY,
+                   segment_size=SEGMENT_SIZE, time_wait=TIME_WAIT, write_behind=WRITE_BEHIND, idle_timeout=IDLE_TIMEOUT)
 socket.bind(('127.0.0.1', RECEIVER_PORT))
 socket.sender_addr = socket.accept()
-total_data = socket.recv()
 
-with open('./download.txt', 'w', encoding='utf-8') as f:
-    f.write(total_data)
+with open(FILE_PATH, 'wb') as f:
+    socket.recv_into(f)
+logging.info('Receiver stats %s', socket.stats.snapshot())
@@ -0,0 +1,68 @@
+from typing import Optional
+
+
+class RTOEstimator:
+    """
+    Jacobson/Karels retransmission timeout estimator (RFC 6298)
+    SRTT and RTTVAR are smoothed from RTT samples, RTO = SRTT + K * RTTVAR.
+    Every timeout doubles RTO(exponential backoff) until next valid sample.
+    Samples must come only from packets that were not retransmitted(Karn's rule). It is caller's duty.
+    """
+    alpha: float = 1 / 8  # SRTT gain
+    beta: float = 1 / 4  # RTTVAR gain
+    k: int = 4  # RTTVAR weight
+
+    srtt: Optional[float]  # smoothed round trip time. None until first sample
+    rttvar: Optional[float]  # round trip time variation. None until first sample
+    rto: float  # current retransmission timeout(second), including backoff
+    backoff_count: int  # number of consecutive timeouts since last valid sample
+
+    def __init__(self, initial_rto: float = 0.5, min_rto: float = 0.02, max_rto: float = 60.0):
+        """
+        :param initial_rto: RTO before first sample(second)
+        :param min_rto: lower bound of RTO. much lower than RFC 6298 1 second, so loss on fast local link recovers quickly
+        :param max_rto: upper bound of RTO, also limits backoff
+        """
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.backoff_count = 0
+
+    def sample(self, rtt: float) -> None:
+        """
+        Update estimation with new RTT measurement and reset backoff
+        :param rtt: measured round trip time(second) of a packet sent only once
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.backoff_count = 0
+        self.rto = self._bound(self.srtt + self.k * self.rttvar)
+
+    @property
+    def base_rto(self) -> float:
+        """
+        :return: RTO without backoff of consecutive timeouts. initial_rto before first sample
+        """
+        if self.srtt is None:
+            return self.initial_rto
+        return self._bound(self.srtt + self.k * self.rttvar)
+
+    def on_timeout(self) -> None:
+        """
+        Back off RTO exponentially when retransmission timer expires
+        """
+        self.backoff_count += 1
+        self.rto = self._bound(self.rto * 2)
+
+    def _bound(self, rto: float) -> float:
+        return min(max(rto, self.min_rto), self.max_rto)
+
+    def __repr__(self):
+        return f'RTOEstimator(srtt={self.srtt}, rttvar={self.rttvar}, rto={self.rto}, backoff_count={self.backoff_count})'
@@ -1,24 +1,79 @@
 import argparse
+import logging
+import sys
 import time
 
-from rdt_socket import RDTSocket
+from impairment import ImpairmentConfig
+from messages import ChecksumType, CompressionType
+from rdt_socket import RDTSocket, SenderMode
+from striping import send_striped
 from utility import Address
 
 parser = argparse.ArgumentParser(description='Server')
 parser.add_argument('-ip', '--receiver_ip', help='Receiver ip')
 parser.add_argument('-p', '--receiver_port', help='Receiver port')
+parser.add_argument('-sp', '--sender_port', help='Sender port. 0 for any free port', default=23456)
 parser.add_argument('-ws', '--window_size', help='Window size')
+parser.add_argument('-imp', '--impairment', help='Simulated impairments on received packets. ex) loss=0.05,delay=0.01,seed=1', default='')
+parser.add_argument('-f', '--file', help='File path to send', default='./alice.txt')
+parser.add_argument('-m', '--mode', help='Retransmission mode. gbn(go-back-n) or sr(selective repeat)', default=SenderMode.GO_BACK_N.value)
+parser.add_argument('-cc', '--congestion', help='Congestion control. fixed or aimd', default='fixed')
+parser.add_argument('-t', '--trace', help='File path to write cwnd per RTT as csv', default=None)
+parser.add_argument('-cs', '--checksum', help='Checksum algorithm. none, crc32 or crc32c(needs crc32c package)', default='crc32')
+parser.add_argument('-z', '--compression', help='Compression. none, zlib, lz4(needs lz4), zstd(needs zstandard)', default='none')
+parser.add_argument('-zl', '--compression_level', help='Compression level. default level of the algorithm if not given', default=None)
+parser.add_argument('-ss', '--segment_size', help='Largest datagram(1472 fits ethernet). receiver may agree on a smaller one', default='1472')
+parser.add_argument('-pm', '--probe_mtu', help='Probe the largest unfragmented datagram up to segment size', action='store_true')
+parser.add_argument('-st', '--streams', help='Stripe file over N connections to receiver ports p ~ p + N - 1', default='1')
+parser.add_argument('-rs', '--resume', help='Send only the part receiver(also -rs) does not have yet', action='store_true')
+parser.add_argument('-ct', '--control_timeout', help='Give up connecting / closing if receiver does not answer in N seconds', default='10')
+parser.add_argument('-it', '--idle_timeout', help='Give up if receiver sends no ACK for N seconds. 0 to wait forever', default='120')
+parser.add_argument('-l', '--log_level', help='Logging level. DEBUG shows every packet', default='INFO')
 
 args = parser.parse_args()
 RECEIVER_IP = args.receiver_ip
 RECEIVER_PORT = int(args.receiver_port)
+SENDER_PORT = int(args.sender_port)
 WINDOW_SIZE = int(args.window_size)
+IMPAIRMENT = ImpairmentConfig.parse(args.impairment) if args.impairment else None
+MODE = SenderMode(args.mode)
+CONGESTION = args.congestion
+TRACE_PATH = args.trace
+FILE_PATH = args.file
+CHECKSUM = ChecksumType[args.checksum.upper()]
+COMPRESSION = CompressionType[args.compression.upper()]
+COMPRESSION_LEVEL = int(args.compression_level) if args.compression_level else None
+SEGMENT_SIZE = int(args.segment_size)
+PROBE_MTU = args.probe_mtu
+STREAMS = int(args.streams)
+RESUME = args.resume
+CONTROL_TIMEOUT = float(args.control_timeout)
+IDLE_TIMEOUT = float(args.idle_timeout)
+logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
 
-socket = RDTSocket(WINDOW_SIZE)
-socket.bind(('127.0.0.1', 23456))
+if STREAMS > 1 or RESUME:  # one process per stripe, each with its own port
+    stripe_stats = send_striped(Address(RECEIVER_IP, RECEIVER_PORT), FILE_PATH, STREAMS, WINDOW_SIZE,
+                                processes=STREAMS > 1, resume=RESUME, mode=MODE, congestion=CONGESTION,
+                                impairment=IMPAIRMENT, checksum=CHECKSUM, compression=COMPRESSION,
+                                compression_level=COMPRESSION_LEVEL, segment_size=SEGMENT_SIZE, probe_mtu=PROBE_MTU,
+                                control_timeout=CONTROL_TIMEOUT, idle_timeout=IDLE_TIMEOUT)
+    for i, stats in enumerate(stripe_stats):
+        logging.info('Stripe [%d] sender stats %s', i, stats)
+    sys.exit(0)
+
+socket = RDTSocket(WINDOW_SIZE, mode=MODE, congestion=CONGESTION, impairment=IMPAIRMENT, checksum=CHECKSUM,
+                   compression=COMPRESSION, compression_level=COMPRESSION_LEVEL, segment_size=SEGMENT_SIZE,
+                   probe_mtu=PROBE_MTU, control_timeout=CONTROL_TIMEOUT, idle_timeout=IDLE_TIMEOUT)
+socket.bind(('127.0.0.1', SENDER_PORT))
 socket.connect(Address(RECEIVER_IP, RECEIVER_PORT))
 
-with open('./alice.txt', 'r') as f:
-    data = f.read()
-socket.send(data)
+with open(FILE_PATH, 'rb') as f:
+    socket.send_stream(f)
 socket.close()
+logging.info('Sender stats %s', socket.stats.snapshot())
+
+if TRACE_PATH:
+    with open(TRACE_PATH, 'w') as f:
+        f.write('time,cwnd,ssthresh\n')
+        for sample in socket.congestion.trace:
+            f.write(f'{sample.time},{sample.cwnd},{sample.ssthresh}\n')
@@ -0,0 +1,51 @@
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any
+
+
+@dataclass
+class TransferStats:
+    """
+    Counters of one RDT endpoint(or one connection of RDTServer).
+    Fields are plain numbers incremented in place, so counting costs almost nothing in the packet loop,
+    and another thread can scrape snapshot() while transfer goes on.
+    """
+    # sender
+    packets_sent: int = 0  # DATA packets sent, including retransmissions
+    packets_retransmitted: int = 0
+    timeouts: int = 0  # retransmission timer expirations
+    fast_retransmits: int = 0
+    acks_received: int = 0
+    duplicate_acks: int = 0
+    rtt_samples: int = 0
+    rtt_sum: float = 0.0  # second
+    rtt_min: Optional[float] = None
+    rtt_max: Optional[float] = None
+    payload_bytes: int = 0  # compression only. application bytes compressed into DATA payloads
+    encoded_bytes: int = 0  # compression only. DATA payload bytes they became(raw ones included)
+    compress_seconds: float = 0.0  # CPU time spent compressing
+    window_probes: int = 0  # packets sent over receive window, because it was closed with nothing in flight
+    # receiver
+    packets_received: int = 0  # DATA packets, including dropped ones
+    acks_sent: int = 0
+    bytes_delivered: int = 0  # in order bytes written to application
+    # both
+    dropped_corrupt: int = 0  # checksum mismatch
+    dropped_out_of_window: int = 0  # DATA over receiver window, ACK out of sender window
+    dropped_duplicate: int = 0  # DATA already received or buffered
+
+    def add_rtt(self, rtt: float) -> None:
+        """
+        :param rtt: round trip time sample(second), same one given to RTOEstimator
+        """
+        self.rtt_samples += 1
+        self.rtt_sum += rtt
+        self.rtt_min = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+        self.rtt_max = rtt if self.rtt_max is None else max(self.rtt_max, rtt)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        :return: copy of every counter and mean RTT. json serializable, not changed by later packets
+        """
+        values = asdict(self)
+        values['rtt_mean'] = self.rtt_sum / self.rtt_samples if self.rtt_samples else None
+        return values
@@ -0,0 +1,205 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Tuple, Dict, Any, Optional
+
+from checkpoint import ExtentFile
+from messages import HandshakeOption
+from rdt_socket import RDTSocket, DATA_SIZE, SEGMENT_SIZE
+from utility import Address, HEADER_SIZE
+
+CHECKPOINT_INTERVAL = 4 * 1024 * 1024  # bytes written between two checkpoints. at most this much is sent again on resume
+
+logger = logging.getLogger(__name__)
+
+
+class StripeWriter:
+    """
+    Write-only file object for one stripe of a striped transfer.
+    Every stripe writes its own range of one preallocated output file with positional writes(pwrite),
+    so stripes received by different processes never share a file position or lock.
+    With extent file, written range is checkpointed every checkpoint_interval bytes and on close.
+    """
+
+    def __init__(self, path: str, offset: int, file_size: int, extents: Optional[ExtentFile] = None,
+                 checkpoint_interval: int = CHECKPOINT_INTERVAL):
+        """
+        :param path: output file. created if not exists, resized to file_size
+        :param offset: file offset where writing starts
+        :param file_size: size of the whole file
+        :param extents: checkpoint of resumable transfer. None to keep nothing on disk
+        :param checkpoint_interval: bytes written between two checkpoints
+        """
+        self.name = path
+        self.start = offset
+        self.position = offset
+        self.extents = extents
+        self.checkpoint_interval = checkpoint_interval
+        self._checkpointed = offset
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        # every stripe does the same, so the order stripes start in does not matter. data of other stripes is kept
+        if os.fstat(self._fd).st_size != file_size:
+            os.ftruncate(self._fd, file_size)
+        if file_size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._fd, 0, file_size)  # reserve blocks now, not one by one while writing
+            except OSError:  # file system does not support it. sparse file works too
+                pass
+
+    def write(self, data) -> int:
+        written = os.pwrite(self._fd, data, self.position)
+        self.position += written
+        if self.extents and self.position - self._checkpointed >= self.checkpoint_interval:
+            self.checkpoint()
+        return written
+
+    def checkpoint(self) -> None:
+        """
+        Flush written data to disk, then record it in extent file. so extent file never claims bytes not on disk
+        """
+        os.fdatasync(self._fd)
+        self.extents.add(self.start, self.position)
+        self._checkpointed = self.position
+
+    def close(self) -> None:
+        if self.extents:
+            self.checkpoint()
+            self.extents.close()
+        os.close(self._fd)
+
+
+def split_ranges(file_size: int, streams: int, data_size: int = DATA_SIZE) -> List[Tuple[int, int]]:
+    """
+    Split file into contiguous ranges, one per stream.
+    Range boundaries are multiples of data_size, so no stream sends a short packet except the last one.
+    Offsets go in START, before segment size is agreed, so data_size is the one sender asks for.
+    If receiver agrees on a smaller one(or MTU probing lowers it), each stripe may end with one more short packet
+    :param file_size: bytes
+    :param streams: number of ranges
+    :param data_size: payload size of a full DATA segment
+    :return: (offset, length) per stream. tail ones can be empty for small files
+    """
+    packets = -(-file_size // data_size)
+    stripe_size = -(-packets // streams) * data_size
+    return [(min(i * stripe_size, file_size), max(min(stripe_size, file_size - i * stripe_size), 0))
+            for i in range(streams)]
+
+
+def send_stripe(address: Address, path: str, offset: int, length: int, window_size: int, resume: bool = False,
+                **socket_options) -> Dict[str, Any]:
+    """
+    Send one range of file over its own connection(and its own UDP port)
+    :param address: receiver address of this stripe
+    :param path: file to send
+    :param offset: range start
+    :param length: range size(bytes)
+    :param window_size: sender window size
+    :param resume: ask receiver where to resume, and send only the rest of the range
+    :param socket_options: other RDTSocket parameters. mode, congestion, impairment, checksum
+    :return: sender stats
+    """
+    sock = RDTSocket(window_size, **socket_options)
+    sock.bind(('', 0))
+    options = {HandshakeOption.STRIPE_OFFSET: offset, HandshakeOption.FILE_SIZE: os.path.getsize(path)}
+    if resume:
+        options[HandshakeOption.RESUME] = 1
+    sock.connect(address, options)
+    start = offset
+    if resume:  # receiver without checkpoint answers offset itself
+        start = min(max(sock.start_ack_options.get(HandshakeOption.RESUME, offset), offset), offset + length)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        sock.send_stream(f, offset + length - start)
+    sock.close()
+    logger.info('Stripe [%d~%d) sent to %s, resumed from %d', offset, offset + length, address, start)
+    return sock.stats.snapshot()
+
+
+def receive_stripe(address: Address, path: str, window_size: int, resume: bool = False,
+                   **socket_options) -> Dict[str, Any]:
+    """
+    Receive one stripe on its own port, and write it at the offset sender tells in START
+    :param address: address to bind
+    :param path: output file, shared by every stripe
+    :param window_size: receiver window size
+    :param resume: checkpoint received range in <path>.extents, and skip range already there if sender can resume
+    :param socket_options: other RDTSocket parameters. impairment, ack_every, ack_delay
+    :return: receiver stats
+    """
+    writers: List[StripeWriter] = []
+
+    def on_start(options: Dict[int, int]) -> Dict[int, int]:
+        offset = options.get(HandshakeOption.STRIPE_OFFSET, 0)
+        file_size = options.get(HandshakeOption.FILE_SIZE, 0)
+        if not (resume and options.get(HandshakeOption.RESUME)):
+            writers.append(StripeWriter(path, offset, file_size))
+            return {}
+        extents = ExtentFile(path, file_size)
+        start = extents.resume_offset(offset)
+        writers.append(StripeWriter(path, start, file_size, extents))
+        return {HandshakeOption.RESUME: start}
+
+    sock = RDTSocket(window_size, **socket_options)
+    sock.bind((address.ip, address.port))
+    sock.sender_addr = sock.accept(on_start)
+    writer = writers[0]
+    try:
+        sock.recv_into(writer)
+    finally:
+        writer.close()
+    logger.info('Stripe [%d~%d) received from %s', writer.start, writer.position, sock.sender_addr)
+    return sock.stats.snapshot()
+
+
+def _executor(streams: int, processes: bool):
+    """
+    :return: pool running one stripe per worker. processes do not share GIL, so every stripe gets its own core
+    """
+    # forked workers do not import the calling script again(sender.py, receiver.py have no main guard).
+    # threads where fork is not available
+    if processes and 'fork' in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(streams, mp_context=multiprocessing.get_context('fork'))
+    return ThreadPoolExecutor(streams)
+
+
+def send_striped(address: Address, path: str, streams: int, window_size: int, processes: bool = True,
+                 resume: bool = False, **socket_options) -> List[Dict[str, Any]]:
+    """
+    Send file over streams concurrent connections. stripe i goes to port address.port + i
+    :param address: receiver address of the first stripe
+    :param path: file to send
+    :param streams: number of connections
+    :param window_size: sender window size of each connection
+    :param processes: run stripes in processes(True) or threads(False)
+    :param resume: send only ranges receiver does not have yet
+    :param socket_options: other RDTSocket parameters
+    :return: sender stats per stripe
+    """
+    data_size = socket_options.get('segment_size', SEGMENT_SIZE) - HEADER_SIZE
+    ranges = split_ranges(os.path.getsize(path), streams, data_size)
+    with _executor(streams, processes) as pool:
+        futures = [pool.submit(send_stripe, Address(address.ip, address.port + i), path, offset, length,
+                               window_size, resume, **socket_options)
+                   for i, (offset, length) in enumerate(ranges)]
+        return [future.result() for future in futures]
+
+
+def receive_striped(address: Address, path: str, streams: int, window_size: int, processes: bool = True,
+                    resume: bool = False, **socket_options) -> List[Dict[str, Any]]:
+    """
+    Receive file striped over streams connections, on ports address.port ~ address.port + streams - 1
+    :param address: address of the first stripe
+    :param path: output file
+    :param streams: number of connections
+    :param window_size: receiver window size of each connection
+    :param processes: run stripes in processes(True) or threads(False)
+    :param resume: checkpoint received ranges, so interrupted transfer can be resumed
+    :param socket_options: other RDTSocket parameters
+    :return: receiver stats per stripe
+    """
+    with _executor(streams, processes) as pool:
+        futures = [pool.submit(receive_stripe, Address(address.ip, address.port + i), path, window_size, resume,
+                               **socket_options)
+                   for i in range(streams)]
+        return [future.result() for future in futures]
@@ -0,0 +1,52 @@
+import asyncio
+import io
+import os
+import time
+
+import pytest
+
+from rdt_protocol import RDTProtocol
+
+IDLE_TIMEOUT = 0.3
+
+
+async def _connect(idle_timeout: float):
+    receiver = await RDTProtocol.create(('127.0.0.1', 0), window_size=8, idle_timeout=idle_timeout)
+    sender = await RDTProtocol.create(('127.0.0.1', 0), window_size=8)
+    accepted = asyncio.ensure_future(receiver.accept())
+    await sender.connect(receiver.transport.get_extra_info('sockname'))
+    await accepted
+    return receiver, sender
+
+
+def test_silent_sender_fails_recv():
+    async def run():
+        receiver, sender = await _connect(IDLE_TIMEOUT)
+        sender.transport.close()  # sender dies right after START, without any DATA or END
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(receiver.recv_into(io.BytesIO()), IDLE_TIMEOUT * 10)
+        receiver.transport.close()
+        return time.monotonic() - start
+
+    assert IDLE_TIMEOUT <= asyncio.run(run()) < IDLE_TIMEOUT * 5
+
+
+def test_transfer_longer_than_idle_timeout():
+    data = os.urandom(200 * 1024)
+
+    async def run():
+        receiver, sender = await _connect(IDLE_TIMEOUT)
+        received = asyncio.ensure_future(receiver.recv())
+
+        async def send_slowly():  # whole transfer takes longer than idle_timeout, but sender is never silent that long
+            for offset in range(0, len(data), len(data) // 4):
+                await sender.send(data[offset:offset + len(data) // 4])
+                await asyncio.sleep(IDLE_TIMEOUT / 2)
+            await sender.close()
+
+        await asyncio.gather(send_slowly(), received)
+        receiver.transport.close()
+        return received.result()
+
+    assert asyncio.run(run()) == data
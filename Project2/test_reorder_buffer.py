@@ -0,0 +1,65 @@
+import io
+import os
+import random
+
+from messages import PacketType
+from rdt_socket import ReceiverConnection
+from utility import PacketHeader, Segment
+
+WINDOW_SIZE = 16
+CHUNK_SIZE = 100
+
+
+def _start(connection: ReceiverConnection) -> None:
+    connection.on_segment(Segment(PacketHeader(type=PacketType.START, seq_num=0, conn_id=connection.conn_id)))
+
+
+def _data(connection: ReceiverConnection, seq_num: int, payload: bytes) -> Segment:
+    return connection.on_segment(Segment(PacketHeader(type=PacketType.DATA, seq_num=seq_num,
+                                                      conn_id=connection.conn_id), payload))
+
+
+def test_heavy_reordering_with_duplicates():
+    rng = random.Random(325)
+    data = os.urandom(CHUNK_SIZE * 40 * WINDOW_SIZE + 17)
+    chunks = {seq_num: data[offset:offset + CHUNK_SIZE]
+              for seq_num, offset in enumerate(range(0, len(data), CHUNK_SIZE), start=1)}
+    sink = io.BytesIO()
+    connection = ReceiverConnection(('127.0.0.1', 1), 1, WINDOW_SIZE, sink)
+    _start(connection)
+
+    # each window is shuffled, with duplicates of its own packets and of the previous window
+    seq_nums = sorted(chunks)
+    for start in range(0, len(seq_nums), WINDOW_SIZE):
+        window = seq_nums[start:start + WINDOW_SIZE]
+        arrivals = window + rng.sample(window, len(window) // 2) + seq_nums[max(start - WINDOW_SIZE, 0):start][:4]
+        rng.shuffle(arrivals)
+        for seq_num in arrivals:
+            ack = _data(connection, seq_num, chunks[seq_num])
+            assert ack is not None and ack.header.type == PacketType.ACK
+            assert len(connection.reorder_buffer) <= WINDOW_SIZE
+
+    assert sink.getvalue() == data
+    assert connection.rcv_expected_seq_num == len(chunks) + 1
+    assert len(connection.reorder_buffer) == 0
+    assert connection.stats.dropped_duplicate > 0
+    assert connection.stats.dropped_out_of_window == 0
+
+
+def test_out_of_window_rejected():
+    sink = io.BytesIO()
+    connection = ReceiverConnection(('127.0.0.1', 1), 1, WINDOW_SIZE, sink)
+    _start(connection)
+
+    ack = _data(connection, 1 + WINDOW_SIZE, b'over window')
+    assert ack.header.seq_num == 1
+    assert connection.stats.dropped_out_of_window == 1
+    assert 1 + WINDOW_SIZE not in connection.reorder_buffer
+
+    # the last seq_num inside the window is buffered, and delivered once the gap is filled
+    _data(connection, WINDOW_SIZE, b'last')
+    assert WINDOW_SIZE in connection.reorder_buffer
+    for seq_num in range(1, WINDOW_SIZE):
+        _data(connection, seq_num, b'.')
+    assert sink.getvalue() == b'.' * (WINDOW_SIZE - 1) + b'last'
+    assert connection.stats.dropped_out_of_window == 1
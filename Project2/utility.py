@@ -1,15 +1,40 @@
+import errno
+import heapq
+import select
 import struct
+import time
 from dataclasses import dataclass
 import socket
-from typing import Tuple, Any, Optional
+from typing import Tuple, Any, Optional, Union, List, Sequence, Dict, Callable
 import zlib
 
-from messages import PacketType
+from impairment import Impairment, ImpairmentConfig
+from messages import PacketType, ChecksumType
+
+try:
+    import crc32c  # optional. C accelerated crc32c(pip install crc32c)
+except ImportError:
+    crc32c = None
+
+Payload = Union[bytes, bytearray, memoryview]
+
+# linux socket options for path MTU discovery. not exported by socket module on every python build
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
 
 
 class UnreliableSocket(socket.socket):
-    def __init__(self):
+    impairment: Optional[Impairment]  # None for reliable(pass through) socket
+
+    def __init__(self, impairment: Optional[ImpairmentConfig] = None):
+        """
+        :param impairment: loss, delay, reordering, duplication, corruption, bandwidth applied to received datagrams
+        """
         super().__init__(family=socket.AF_INET, type=socket.SOCK_DGRAM, proto=socket.IPPROTO_UDP)
+        self.impairment = Impairment(impairment) if impairment else None
+        self._delayed: List[Tuple[float, int, bytes, Any]] = []  # heap of (release time, arrival order, datagram, addr)
+        self._arrival_count = 0
 
     def bind(self, address: Tuple[str, int]) -> None:
         """
@@ -18,7 +43,7 @@ class UnreliableSocket(socket.socket):
         """
         super().bind(address)
 
-    def recvfrom(self, bufsize: int, flags: int = ...) -> Tuple[bytes, Any]:
+    def recvfrom(self, bufsize: int, flags: int = 0) -> Tuple[bytes, Any]:
         """
         Inherited from normal UDP socket
         should simulate packet loss, packet delay, packet corruption scenarios
@@ -26,7 +51,69 @@ class UnreliableSocket(socket.socket):
         :param flags: flags
         :return: datagram and return address
         """
-        return super().recvfrom(bufsize)
+        if not self.impairment:
+            return super().recvfrom(bufsize, flags)
+        datagram, addr = self._recv_impaired()
+        return datagram[:bufsize], addr
+
+    def recvfrom_into(self, buffer, nbytes: int = 0, flags: int = 0) -> Tuple[int, Any]:
+        """
+        Inherited from normal UDP socket
+        Receive datagram directly into a preallocated writable buffer, so no new bytes object is created per packet.
+        should simulate packet loss, packet delay, packet corruption scenarios
+        :param buffer: writable buffer(bytearray, memoryview)
+        :param nbytes: maximum bytes to receive. 0 means size of buffer
+        :param flags: flags
+        :return: number of received bytes and return address
+        """
+        if not self.impairment:
+            return super().recvfrom_into(buffer, nbytes, flags)
+        datagram, addr = self._recv_impaired()
+        size = min(len(datagram), nbytes or len(buffer))
+        buffer[:size] = datagram[:size]
+        return size, addr
+
+    def _recv_impaired(self) -> Tuple[bytes, Any]:
+        """
+        Deliver the earliest released datagram, keeping socket timeout(blocking, non-blocking, timeout) semantics.
+        Datagrams in flight wait in a timer queue instead of sleep, so delay does not throttle receiving.
+        :return: datagram and return address
+        """
+        timeout = self.gettimeout()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._pull_datagrams()
+            now = time.monotonic()
+            if self._delayed and self._delayed[0][0] <= now:
+                _, _, datagram, addr = heapq.heappop(self._delayed)
+                return datagram, addr
+            if deadline is not None and now >= deadline:
+                if timeout == 0:
+                    raise BlockingIOError(errno.EAGAIN, 'Resource temporarily unavailable')
+                raise socket.timeout('timed out')
+            waits = [self._delayed[0][0] - now] if self._delayed else []
+            if deadline is not None:
+                waits.append(deadline - now)
+            select.select([self], [], [], min(waits) if waits else None)
+
+    def _pull_datagrams(self) -> None:
+        """
+        Move every datagram ready in kernel buffer into the timer queue through impairment
+        """
+        while select.select([self], [], [], 0)[0]:
+            datagram, addr = super().recvfrom(65535)
+            for release, delivered in self.impairment.process(datagram, time.monotonic()):
+                self._arrival_count += 1
+                heapq.heappush(self._delayed, (release, self._arrival_count, delivered, addr))
+
+    def pending_delay(self) -> Optional[float]:
+        """
+        Datagrams released later are invisible to select(), so event loops should wake up by this time.
+        :return: seconds until next delayed datagram is released. None if nothing is delayed
+        """
+        if not self._delayed:
+            return None
+        return max(self._delayed[0][0] - time.monotonic(), 0)
 
     def sendto(self, data, address):
         """
@@ -38,84 +125,346 @@ class UnreliableSocket(socket.socket):
             address = (address.ip, address.port)
         return super().sendto(data, address)
 
+    def sendto_many(self, datagrams: Sequence[Payload], address) -> int:
+        """
+        Send a burst of datagrams to one address.
+        Python socket module has no sendmmsg() binding, so this falls back to a loop of sendto().
+        Socket is made non-blocking once for the whole burst, because sendto() of a socket with timeout
+        polls before every datagram(two syscalls per packet). It waits only when kernel send buffer is full.
+        :param datagrams: readable buffers, sent in order
+        :param address: (host, port)
+        :return: number of sent datagrams
+        """
+        timeout = self.gettimeout()
+        if timeout != 0:
+            self.settimeout(0)
+        try:
+            for datagram in datagrams:
+                while True:
+                    try:
+                        self.sendto(datagram, address)
+                        break
+                    except BlockingIOError:
+                        select.select([], [self], [])
+        finally:
+            if timeout != 0:
+                self.settimeout(timeout)
+        return len(datagrams)
+
+    def recvfrom_many(self, buffers: Sequence[Any]) -> List[Tuple[int, Any]]:
+        """
+        Wait for one datagram(socket timeout applies), then drain datagrams already readable without waiting.
+        recvmmsg()-style batch on top of recvfrom_into(), so impairment applies to every datagram.
+        :param buffers: preallocated writable buffers, one datagram is received into each
+        :return: (number of received bytes, return address) of each datagram, in buffers order. at least one
+        """
+        received = [self.recvfrom_into(buffers[0])]
+        timeout = self.gettimeout()
+        if timeout != 0:
+            self.settimeout(0)
+        try:
+            for buffer in buffers[1:]:
+                received.append(self.recvfrom_into(buffer))
+        except BlockingIOError:  # nothing more to read
+            pass
+        finally:
+            if timeout != 0:
+                self.settimeout(timeout)
+        return received
+
+    def set_dont_fragment(self) -> bool:
+        """
+        Set DF bit on sent datagrams, so a datagram over the path MTU fails(EMSGSIZE) or is lost instead of fragmented
+        :return: False if platform does not support it(linux only)
+        """
+        try:
+            self.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def route_mtu(address: Tuple[str, int]) -> Optional[int]:
+        """
+        :param address: peer address
+        :return: MTU kernel knows for the route to address(interface MTU, or path MTU learned from ICMP). None if unknown
+        """
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            try:
+                probe.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+                probe.connect(address)
+                return probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+            except OSError:
+                return None
+
     def close(self) -> None:
         """
         Inherited from normal UDP socket
         :return:
         """
-        self.close()
+        super().close()
+
+
+HEADER_STRUCT = struct.Struct('I2HI2HI')  # checksum, type, flags, seq_num, length, window, conn_id
+HEADER_SIZE = HEADER_STRUCT.size  # 20 bytes. type and flags, length(datagram is under 64KB) and window share 32 bit words
+# checksum comes first, so the rest of datagram(header fields + payload) is covered in one pass over a memoryview
+CHECKSUM_STRUCT = struct.Struct('I')
+CHECKED_HEADER_STRUCT = struct.Struct('2HI2HI')  # type, flags, seq_num, length, window, conn_id
+CHECKSUM_SIZE = CHECKSUM_STRUCT.size
 
 
 class PacketHeader:
-    type: int  # 0: START; 1: END; 2: DATA; 3: ACK; 4: END_ACK
+    type: int  # 0: START; 1: END; 2: DATA; 3: ACK; 4: END_ACK; 5: START_ACK
     seq_num: int
-    length: int  # length of data. 0 for ACK, START, END packets
-    checksum: int  # 32-bit crc
+    length: int  # length of data. 0 for END packets
+    checksum: int  # checksum of the other header fields and data. filled when segment is packed
+    conn_id: int  # connection id chosen by sender, lets one receiver port demultiplex many connections
+    flags: int  # PacketFlag bits. ex) COMPRESSED payload
+    window: int  # ACK, START_ACK - packets receiver can take from ACK seq_num on(advertised receive window)
 
-    def __init__(self, type: PacketType, seq_num: int, length: int = 0, checksum: int = 0):
+    def __init__(self, type: PacketType, seq_num: int, length: int = 0, checksum: int = 0, conn_id: int = 0,
+                 flags: int = 0, window: int = 0):
         self.type = type
         self.seq_num = seq_num
         self.length = length
         self.checksum = checksum
+        self.conn_id = conn_id
+        self.flags = flags
+        self.window = window
 
 
 class Segment:
     header: Optional[PacketHeader]
-    data: str
+    data: Payload  # binary payload. memoryview when it is parsed from(or sliced out of) a bigger buffer
 
-    def __init__(self, header: PacketHeader, payload: str = ''):
+    def __init__(self, header: PacketHeader, payload: Union[Payload, str] = b''):
         """
         Create formatted segment that can be parsed
         :param header: rdt packet header
-        :param payload: segment data
+        :param payload: segment data. bytes-like object is used as it is(no copy), str is encoded once.
         """
-        bin_data = str_to_byte(payload)
+        if isinstance(payload, str):
+            payload = str_to_byte(payload)
         self.header = header
-        self.header.length = len(bin_data)
-        self.header.checksum = compute_checksum(bin_data)
+        self.header.length = len(payload)
         self.data = payload
 
-    def to_bytes(self) -> bytes:
-        header_bytes = struct.pack(
-            '4I',
+    @property
+    def size(self) -> int:
+        return HEADER_SIZE + self.header.length
+
+    def pack_into(self, buffer, offset: int = 0, checksum: ChecksumType = ChecksumType.CRC32) -> int:
+        """
+        Write segment into preallocated writable buffer without making intermediate bytes objects.
+        Checksum is calculated over the packed bytes, so header fields changed after construction(conn_id) are covered.
+        :param buffer: writable buffer(bytearray, memoryview). should be at least offset + self.size long
+        :param offset: start position in buffer
+        :param checksum: checksum algorithm agreed in handshake. START, START_ACK always use HANDSHAKE_CHECKSUM
+        :return: number of bytes written
+        """
+        size = HEADER_SIZE + self.header.length
+        view = memoryview(buffer)[offset:offset + size]
+        CHECKED_HEADER_STRUCT.pack_into(
+            view,
+            CHECKSUM_SIZE,
             int(self.header.type),
+            int(self.header.flags),
             self.header.seq_num,
-            self.header.checksum,
-            self.header.length
+            self.header.length,
+            self.header.window,
+            self.header.conn_id
         )
-        payload_bytes = str_to_byte(self.data)
-        segment_bytes = header_bytes + payload_bytes
-        return segment_bytes
+        if self.header.length:  # header only(ACK, END) packets skip payload copy
+            view[HEADER_SIZE:] = self.data
+        if self.header.type in HANDSHAKE_TYPES:
+            checksum = HANDSHAKE_CHECKSUM
+        self.header.checksum = CHECKSUMS[checksum](view[CHECKSUM_SIZE:])
+        CHECKSUM_STRUCT.pack_into(view, 0, self.header.checksum)
+        return size
+
+    def to_bytes(self, checksum: ChecksumType = ChecksumType.CRC32) -> bytes:
+        segment_bytes = bytearray(self.size)
+        self.pack_into(segment_bytes, checksum=checksum)
+        return bytes(segment_bytes)
 
     @classmethod
-    def from_bytes(cls, segment_bytes: bytes):
-        header_bytes, data_bytes = segment_bytes[:16], segment_bytes[16:]
-        values = struct.unpack('4I', header_bytes)
-        header = PacketHeader(*values)
-        data = byte_to_str(data_bytes)
-        parsed_segment = Segment(header=header, payload=data)
+    def from_bytes(cls, segment_bytes: Payload):
+        """
+        Parse segment from received datagram. verify it by verify_packet() first.
+        Payload is a memoryview over segment_bytes, so it is valid only while segment_bytes is not overwritten.
+        :param segment_bytes: received datagram
+        :return: parsed segment
+        """
+        view = memoryview(segment_bytes)
+        checksum, type, flags, seq_num, length, window, conn_id = HEADER_STRUCT.unpack_from(view)
+        header = PacketHeader(type, seq_num, length, checksum, conn_id, flags, window)
+        parsed_segment = cls.__new__(cls)
+        parsed_segment.header = header
+        parsed_segment.data = view[HEADER_SIZE:]
         return parsed_segment
 
+class ReorderBuffer:
+    """
+    Fixed size receiver buffer of out of order packets.
+    Packet is stored in slot [seq_num % capacity], so receiver must keep seq_nums in [expected, expected + capacity).
+    Every operation is O(1) and memory never grows over capacity.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._payloads: List[Optional[Payload]] = [None] * capacity
+        self._seq_nums: List[int] = [0] * capacity  # seq_num of packet in each slot. 0 for empty slot
+        self.count = 0  # number of buffered packets
+
+    def __contains__(self, seq_num: int) -> bool:
+        return self._seq_nums[seq_num % self.capacity] == seq_num
+
+    def __len__(self) -> int:
+        return self.count
+
+    def put(self, seq_num: int, payload: Payload) -> bool:
+        """
+        :param seq_num: packet seq_num
+        :param payload: packet payload. it must not be overwritten until popped
+        :return: False if slot is already taken(duplicated packet, or seq_num out of window)
+        """
+        slot = seq_num % self.capacity
+        if self._payloads[slot] is not None:
+            return False
+        self._payloads[slot] = payload
+        self._seq_nums[slot] = seq_num
+        self.count += 1
+        return True
+
+    def pop(self, seq_num: int) -> Optional[Payload]:
+        """
+        :param seq_num: packet seq_num
+        :return: buffered payload of the packet, None if it is not buffered
+        """
+        slot = seq_num % self.capacity
+        if self._seq_nums[slot] != seq_num:
+            return None
+        payload = self._payloads[slot]
+        self._payloads[slot] = None
+        self._seq_nums[slot] = 0
+        self.count -= 1
+        return payload
+
+    def ranges(self, first: int, limit: int) -> List[Tuple[int, int]]:
+        """
+        Contiguous ranges of buffered seq_nums, lowest first. slots are walked from first, and the walk stops
+        once every buffered packet is seen or limit ranges are found, so no sort and no scan past the last packet
+        :param first: seq_num to start from. receiver's expected seq_num
+        :param limit: ranges returned at most
+        :return: [start, end) seq_num ranges
+        """
+        ranges = []
+        seen = 0
+        seq_num = first
+        while seen < self.count and len(ranges) < limit and seq_num < first + self.capacity:
+            if seq_num in self:
+                start = seq_num
+                while seq_num in self:
+                    seq_num += 1
+                seen += seq_num - start
+                ranges.append((start, seq_num))
+            seq_num += 1
+        return ranges
+
+
 @dataclass
 class Address:
     ip: str
     port: int
 
 
-def compute_checksum(bin_str: bytes) -> int:
+def _no_checksum(bin_str: Payload) -> int:
+    return 0
+
+
+# checksum algorithms available in this process. crc32c only if its C library is installed
+CHECKSUMS: Dict[ChecksumType, Callable[[Payload], int]] = {
+    ChecksumType.NONE: _no_checksum,
+    ChecksumType.CRC32: zlib.crc32,
+}
+if crc32c:
+    CHECKSUMS[ChecksumType.CRC32C] = crc32c.crc32c
+
+# START and START_ACK are protected by this fixed algorithm, because the algorithm of connection is not agreed yet
+HANDSHAKE_CHECKSUM = ChecksumType.CRC32
+HANDSHAKE_TYPES = (PacketType.START, PacketType.START_ACK)
+
+
+def compute_checksum(bin_str: Payload, checksum: ChecksumType = ChecksumType.CRC32) -> int:
+    """
+    calculate the checksum value
+    :param bin_str: data to cover
+    :param checksum: algorithm
+    :return: 32-bit checksum
+    """
+    return CHECKSUMS[checksum](bin_str)
+
+
+def verify_packet(datagram: Payload, checksum: ChecksumType = ChecksumType.CRC32) -> bool:
+    """
+    verifies the integrity of a received datagram straight from the receive buffer, before it is parsed into Segment.
+    Header fields and payload are covered, so corrupted seq_num, type, length or conn_id is detected too.
+    :param datagram: received datagram
+    :param checksum: algorithm agreed in handshake. START, START_ACK always use HANDSHAKE_CHECKSUM
+    :return: True if datagram is intact
+    """
+    if len(datagram) < HEADER_SIZE:
+        return False
+    value, type, _, _, length, _, _ = HEADER_STRUCT.unpack_from(datagram)
+    if len(datagram) != HEADER_SIZE + length:
+        return False
+    if type in HANDSHAKE_TYPES:
+        checksum = HANDSHAKE_CHECKSUM
+    return CHECKSUMS[checksum](memoryview(datagram)[CHECKSUM_SIZE:]) == value
+
+
+SACK_RANGE_STRUCT = struct.Struct('2I')  # start, end(exclusive) seq_num of a selectively acknowledged range
+
+
+def encode_sack_ranges(ranges: List[Tuple[int, int]]) -> bytes:
+    """
+    Encode ranges of received out of order seq_nums into ACK payload
+    :param ranges: selectively acknowledged [start, end) ranges. caller bounds their number to fit a segment
+    :return: packed [start, end) ranges
+    """
+    return b''.join(SACK_RANGE_STRUCT.pack(start, end) for start, end in ranges)
+
+
+def decode_sack_ranges(payload: Payload) -> List[Tuple[int, int]]:
+    """
+    Decode SACK ranges from ACK payload
+    :param payload: ACK payload
+    :return: list of [start, end) seq_num ranges
+    """
+    usable = len(payload) - len(payload) % SACK_RANGE_STRUCT.size
+    return list(SACK_RANGE_STRUCT.iter_unpack(payload[:usable]))
+
+
+OPTION_STRUCT = struct.Struct('IQ')  # HandshakeOption, value. 64 bit value holds file offsets
+
+
+def encode_options(options: Dict[int, int]) -> bytes:
     """
-    calculate the crc32 checksum value
-    :return:
+    Encode handshake options into START / START_ACK payload
+    :param options: HandshakeOption -> value
+    :return: packed (option, value) pairs
     """
-    return zlib.crc32(bin_str)
+    return b''.join(OPTION_STRUCT.pack(option, value) for option, value in options.items())
 
 
-def verify_packet(segment: Segment) -> bool:
+def decode_options(payload: Payload) -> Dict[int, int]:
     """
-    verifies the integrity of the received segments
-    :return:
+    Decode handshake options from START / START_ACK payload. peer without options sends empty payload
+    :param payload: START / START_ACK payload
+    :return: HandshakeOption -> value
     """
-    return compute_checksum(segment.data.encode()) == segment.header.checksum
+    usable = len(payload) - len(payload) % OPTION_STRUCT.size
+    return dict(OPTION_STRUCT.iter_unpack(payload[:usable]))
 
 
 def str_to_byte(data: str):
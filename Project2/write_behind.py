@@ -0,0 +1,70 @@
+import threading
+from collections import deque
+from typing import BinaryIO, Deque, Optional
+
+
+class WriteBehindWriter:
+    """
+    Write-only file object that queues data and lets a thread write it to the real file object,
+    so receiving goes on while a slow disk is busy. file writes release GIL, so they overlap with packet handling.
+    Receiver counts chunks still in the queue as buffered data, and advertises that much smaller window,
+    so slow writing throttles sender instead of overflowing the queue.
+    """
+
+    def __init__(self, fileobj: BinaryIO):
+        """
+        :param fileobj: file object opened in binary write mode. not closed by close()
+        """
+        self.fileobj = fileobj
+        self._queue: Deque[bytes] = deque()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        """
+        :return: number of chunks written to this, not to fileobj yet
+        """
+        return len(self._queue)
+
+    def write(self, data) -> int:
+        """
+        :param data: bytes-like object. copied, so caller can reuse its buffer at once
+        :return: number of queued bytes
+        """
+        if self._error:
+            raise self._error
+        with self._condition:
+            self._queue.append(bytes(data))
+            self._condition.notify()
+        return len(data)
+
+    def close(self) -> None:
+        """
+        Wait until every queued chunk is written, and stop the thread
+        :raise: error of the write that failed in the thread
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+        if self._error:
+            raise self._error
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue and not self._closing:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                data = self._queue[0]
+            try:
+                self.fileobj.write(data)
+            except BaseException as error:  # raised to receiver on its next write() or close()
+                self._error = error
+                self._queue.clear()
+                return
+            self._queue.popleft()  # after writing, so the chunk being written still counts as buffered
@@ -1,14 +1,16 @@
 import json
 import math
-import re
+import os
 import sys
 import select
 import socket
 import argparse
-from typing import Tuple
 
 from messages import MessageType
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # framing.py is shared by projects
+from framing import pack_frame, unpack_frame
+
 parser = argparse.ArgumentParser(description='Network Node Client')
 parser.add_argument('-ip', '--server_ip', help='Remote server ip')
 parser.add_argument('-p', '--server_port', help='Remote server port')
@@ -50,18 +52,18 @@ class NodeClient:
             print("Updating is done. Connection closed.")
             return
 
-        msg_type, content = self._parse_msg(data)
+        msg_type, _, payload = unpack_frame(data)
 
-        if int(msg_type) == MessageType.UPDATE:
-            vector_info = json.loads(content)
+        if msg_type == MessageType.UPDATE:
+            vector_info = json.loads(payload)
             original_vector = self._vector.copy()
             self._update_vector(vector_info)
             if not self._vector == original_vector:
                 self._broadcast_request()
-        elif int(msg_type) == MessageType.ACCEPT:  # this node joined in network
-            distance_info = json.loads(content)
+        elif msg_type == MessageType.ACCEPT:  # this node joined in network
+            distance_info = json.loads(payload)
             self._initialize_vector(distance_info)
-        elif int(msg_type) == MessageType.ESTABLISHED:  # All other nodes are in network now
+        elif msg_type == MessageType.ESTABLISHED:  # All other nodes are in network now
             self._broadcast_request()
         else:
             pass
@@ -88,18 +90,6 @@ class NodeClient:
         message = json.dumps({self._node_name: self._vector})
         self._send_msg(message)
 
-    def _parse_msg(self, msg: bytes) -> Tuple[str, str]:
-        """
-        Parse datagram easy to use.
-        :param msg: byte encoded message from socket
-        :return: message type, message content
-        """
-        match = re.search(r"^\[(\w+)\](\S.*)", msg.decode())
-        if not match:
-            raise ValueError()
-        msg_type, content = match.group(1), match.group(2)
-        return msg_type, content
-
     def _create_message(self, type: MessageType, msg: str) -> bytes:
         """
         Create formatted message that can be parsed by client, server either
@@ -107,9 +97,7 @@ class NodeClient:
         :param msg: message content
         :return: formatted binary message data
         """
-        data = f"[{type}]{msg}"
-        byte_msg = data.encode()
-        return byte_msg
+        return pack_frame(type, msg.encode())
 
     def register(self):
         message = self._create_message(MessageType.JOIN, msg=self._node_name)
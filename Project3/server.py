@@ -1,11 +1,15 @@
 import argparse
 import json
-import re
+import os
 import socket
+import sys
 from typing import Tuple, Dict
 
 from messages import MessageType
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # framing.py is shared by projects
+from framing import pack_frame, unpack_frame
+
 parser = argparse.ArgumentParser(description='Distance routing vector algorithm server')
 parser.add_argument('-p', '--port', help='Server listening socket port')
 
@@ -25,9 +29,10 @@ class Server:
             "z": {"neighbors": {"u": -1, "x": 9, "w": -1, "v": -1, "y": 2}}
         }
 
-        for node_name, _ in self._clients.items():
+        for node_id, node_name in enumerate(self._clients, start=1):
             self._clients[node_name]["ip"] = None
             self._clients[node_name]["port"] = None
+            self._clients[node_name]["id"] = node_id  # sender id of frames relayed from the node
 
     def init(self):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) # Create socket for IPv4,UDP Protocol
@@ -38,16 +43,16 @@ class Server:
 
     def recv_msg(self):
         data, sender = self._sock.recvfrom(1472)
-        msg_type, content = self._parse_msg(data)
-        print(msg_type, content)
+        msg_type, _, payload = unpack_frame(data)
+        print(msg_type, payload.decode())
 
-        if int(msg_type) == MessageType.JOIN:
-            self._join(sender, content)
+        if msg_type == MessageType.JOIN:
+            self._join(sender, payload.decode())
             self._accept(sender)
             if len(self._addr_to_client) == len(self._clients):
                 self._establishing_complete()
-        elif int(msg_type) == MessageType.UPDATE:
-            self._broadcast_updated_vector(sender, content)
+        elif msg_type == MessageType.UPDATE:
+            self._broadcast_updated_vector(sender, payload)
         else:
             pass  # do not handle exception case
 
@@ -74,18 +79,6 @@ class Server:
             byte_msg = self._create_byte_message(MessageType.ESTABLISHED, "Network established. You can update distance routing vector now.")
             self._sock.sendto(byte_msg, sender)
 
-    def _parse_msg(self, msg: bytes) -> Tuple[str, str]:
-        """
-        Parse datagram easy to use.
-        :param msg: byte encoded message from socket
-        :return: message type, message content
-        """
-        match = re.search(r"^\[(\w+)\](\S.*)", msg.decode())
-        if not match:
-            raise ValueError()
-        msg_type, content = match.group(1), match.group(2)
-        return msg_type, content
-
     def _get_initial_distance_info(self, node_name: str) -> Dict[str, int]:
         neighbors = self._clients[node_name]["neighbors"]
         return {node_name: neighbors}
@@ -97,13 +90,16 @@ class Server:
         :param msg: message content
         :return: formatted binary message data
         """
-        data = f"[{msg_type}]{msg}"
-        byte_msg = data.encode()
-        return byte_msg
+        return pack_frame(msg_type, msg.encode())
 
-    def _broadcast_updated_vector(self, sender: Tuple[str, int], msg: str):
-        byte_msg = self._create_byte_message(MessageType.UPDATE, msg)
+    def _broadcast_updated_vector(self, sender: Tuple[str, int], payload: bytes):
+        """
+        Relay distance vector of sender to its neighbors. payload is forwarded untouched, not decoded
+        :param sender: sender ip addr
+        :param payload: payload of received UPDATE frame
+        """
         node_name = self._addr_to_client[sender]
+        byte_msg = pack_frame(MessageType.UPDATE, payload, self._clients[node_name]['id'])
         neighbors = self._clients[node_name]['neighbors']
         for neighbor, distance in neighbors.items():
             if distance < 0:  # not directly connected
@@ -0,0 +1,47 @@
+from struct import Struct
+from typing import Tuple, Union
+
+Payload = Union[bytes, bytearray, memoryview]
+
+# type(1 byte), payload length(2 bytes), sender id(4 bytes). network byte order, so hosts of any endian agree
+FRAME_HEADER = Struct('!BHI')
+HEADER_SIZE = FRAME_HEADER.size
+NO_SENDER = 0  # sender id of frames sent to a server. server knows the sender by its address
+MAX_PAYLOAD = 0xFFFF
+
+
+def frame_size(data: bytes, offset: int = 0) -> int:
+    """
+    :param data: frames written back to back
+    :param offset: start of a frame in data
+    :return: size of the frame, header included
+    """
+    return HEADER_SIZE + FRAME_HEADER.unpack_from(data, offset)[1]
+
+
+def pack_frame(msg_type: int, payload: Payload, sender_id: int = NO_SENDER) -> bytes:
+    """
+    :param msg_type: message type of the project. IntEnum member or int under 256
+    :param payload: message content. written as it is
+    :param sender_id: id of the original sender, given by the server relaying the frame
+    :return: datagram
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"payload of {len(payload)} bytes does not fit a frame")
+    return FRAME_HEADER.pack(msg_type, len(payload), sender_id) + payload
+
+
+def unpack_frame(data: bytes) -> Tuple[int, int, bytes]:
+    """
+    Parse datagram without decoding the payload, so a relay can forward it untouched.
+    payload is a bytes slice, not a memoryview - datagrams are small, and slicing them is cheaper than making a view
+    :param data: datagram from socket
+    :return: message type, sender id, payload
+    :raise ValueError: datagram is shorter than header, or length field does not match
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"datagram of {len(data)} bytes is shorter than frame header")
+    msg_type, length, sender_id = FRAME_HEADER.unpack_from(data)
+    if len(data) - HEADER_SIZE != length:
+        raise ValueError(f"frame length {length} does not match payload of {len(data) - HEADER_SIZE} bytes")
+    return msg_type, sender_id, data[HEADER_SIZE:]
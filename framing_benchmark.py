@@ -0,0 +1,69 @@
+import argparse
+import os
+import re
+import timeit
+
+from framing import pack_frame, unpack_frame
+
+parser = argparse.ArgumentParser(description='Micro-benchmark of binary frames(framing.py) against "[TYPE]content" text')
+parser.add_argument('-s', '--sizes', help='Comma separated message sizes(bytes)', default='16,256,1400')
+parser.add_argument('-n', '--number', help='Messages per measurement', type=int, default=100000)
+parser.add_argument('-r', '--repeat', help='Measurements per case. best one is reported', type=int, default=5)
+
+args = parser.parse_args()
+
+TEXT_PATTERN = re.compile(r"^\[(\w+)\](\S.*)")  # compiled once, which is kinder to text path than re.search(str)
+SENDER = ('127.0.0.1', 50000)
+SENDER_ID = 1
+MESSAGE, INCOMING = 1, 2
+
+
+def text_relay(data: bytes) -> bytes:
+    """
+    Old server path - decode, regex parse, then format and encode the relayed datagram
+    """
+    match = TEXT_PATTERN.search(data.decode())
+    if not match:
+        raise ValueError()
+    content = match.group(2)
+    ip, port = SENDER
+    return f"[INCOMING]<From {ip}:{port}>{content}".encode()
+
+
+def binary_relay(data: bytes) -> bytes:
+    """
+    New server path - unpack header, put payload untouched behind a new header
+    """
+    msg_type, _, payload = unpack_frame(data)
+    return pack_frame(INCOMING, payload, SENDER_ID)
+
+
+def text_receive(data: bytes) -> str:
+    match = TEXT_PATTERN.search(data.decode())
+    return match.group(2)
+
+
+def binary_receive(data: bytes) -> str:
+    msg_type, sender_id, payload = unpack_frame(data)
+    return f"<From {sender_id}>{payload.decode()}"
+
+
+def best_ns(func, data: bytes) -> float:
+    """
+    :return: nanoseconds per call, best of repeat measurements
+    """
+    seconds = min(timeit.repeat(lambda: func(data), number=args.number, repeat=args.repeat))
+    return seconds / args.number * 1e9
+
+
+for size in [int(size) for size in args.sizes.split(',')]:
+    message = os.urandom(size).hex()[:size]  # printable, so text framing can carry it
+    text_data = f"[MESSAGE]{message}".encode()
+    binary_data = pack_frame(MESSAGE, message.encode())
+    relayed_text, relayed_binary = text_relay(text_data), binary_relay(binary_data)
+    for path, text_func, binary_func, text_input, binary_input in (
+            ('relay', text_relay, binary_relay, text_data, binary_data),
+            ('receive', text_receive, binary_receive, relayed_text, relayed_binary)):
+        text_ns, binary_ns = best_ns(text_func, text_input), best_ns(binary_func, binary_input)
+        print(f'size [{size}] {path:<7} - text {text_ns:8.0f} ns, binary {binary_ns:8.0f} ns, '
+              f'{text_ns / binary_ns:.2f}x')